@@ -0,0 +1,219 @@
+import json
+import re
+import time
+import unicodedata
+from difflib import SequenceMatcher
+
+
+# Picks a game's soundtrack from its Spotify album search results without
+# asking. Each candidate is scored on how close its title is to the game
+# title, whether it is named as a soundtrack, how near its release year is to
+# the game's and how many tracks it has. A clear winner above ACCEPT_THRESHOLD
+# is taken; anything above REVIEW_THRESHOLD is queued in album_review to be
+# settled later with `python Database_Build.py --review`.
+
+WEIGHTS = {"title": 0.55, "keywords": 0.2, "year": 0.15, "tracks": 0.1}
+
+ACCEPT_THRESHOLD = 0.75
+# The best candidate must beat the runner-up by this much to be taken unasked
+ACCEPT_MARGIN = 0.05
+REVIEW_THRESHOLD = 0.4
+
+OST_KEYWORDS = ["soundtrack", "ost", "original score", "sound track", "music from", "game music", "original game"]
+
+# Words that say what kind of album it is rather than which game it is for
+NOISE_WORDS = {"original", "soundtrack", "ost", "game", "video", "music", "from", "the", "official",
+               "score", "sound", "track", "complete", "deluxe", "edition", "vol", "volume"}
+
+ROMAN_NUMERALS = {"ii", "iii", "iv", "v", "vi", "vii", "viii", "ix", "x"}
+
+# Numbers after these count discs and volumes, not sequels
+VOLUME_WORDS = {"vol", "volume", "disc", "disk", "cd"}
+
+stats = {"accept": 0, "review": 0, "reject": 0}
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode().lower()
+
+    return re.sub(r"[^a-z0-9]+", " ", text).split()
+
+
+def get_sequel_markers(title):
+    # Numbers, and roman numerals that end a title or a part of it ("Final
+    # Fantasy VII: ..."), but not years, volume or disc numbers, or a numeral
+    # inside a name ("Mega Man X Legacy Collection")
+    markers = set()
+
+    for part in re.split(r"[:(\[/]| - ", title or ""):
+        words = normalize(part)
+
+        for i, word in enumerate(words):
+            if i and words[i - 1] in VOLUME_WORDS:
+                continue
+
+            if word.isdigit():
+                if not re.fullmatch(r"(19|20)\d\d", word):
+                    markers.add(word)
+
+            elif word in ROMAN_NUMERALS and all(after in NOISE_WORDS for after in words[i + 1:]):
+                markers.add(word)
+
+    return markers
+
+
+def get_title_score(game_title, album_name):
+    game_words = [word for word in normalize(game_title) if word not in NOISE_WORDS]
+    album_words = [word for word in normalize(album_name) if word not in NOISE_WORDS]
+
+    if not game_words or not album_words:
+        return 0.0
+
+    ratio = SequenceMatcher(None, " ".join(game_words), " ".join(album_words)).ratio()
+
+    # Album names often put a subtitle or volume after the full game title
+    coverage = len(set(game_words) & set(album_words)) / len(set(game_words))
+    score = max(ratio, 0.9 * coverage)
+
+    # A sequel number the game does not have usually means another game
+    if get_sequel_markers(album_name) - set(normalize(game_title)):
+        score *= 0.5
+
+    return score
+
+
+def get_keyword_score(album_name):
+    text = " ".join(normalize(album_name))
+
+    return 1.0 if any(re.search(rf"\b{keyword}\b", text) for keyword in OST_KEYWORDS) else 0.0
+
+
+def get_year_score(released, album_release_date):
+    # Spotify dates may be just a year; either side can be missing
+    if not released or not album_release_date:
+        return 0.5
+
+    difference = abs(int(released[:4]) - int(album_release_date[:4]))
+
+    if difference == 0:
+        return 1.0
+    if difference == 1:
+        return 0.8
+    if difference <= 3:
+        return 0.4
+
+    return 0.0
+
+
+def get_track_score(total_tracks):
+    if total_tracks is None:
+        return 0.5
+    if total_tracks >= 10:
+        return 1.0
+    if total_tracks >= 5:
+        return 0.7
+    if total_tracks >= 2:
+        return 0.4
+
+    return 0.1
+
+
+def get_album_data(album):
+    # The fields the album table and later review need from a Spotify album
+    return {
+        'name': album['name'],
+        'artist': ', '.join([artist['name'] for artist in album['artists']]),
+        'link': album['external_urls']['spotify'],
+        'release_date': album.get('release_date'),
+        'total_tracks': album.get('total_tracks')
+    }
+
+
+def score_album(game_title, released, album_data):
+    parts = {
+        "title": get_title_score(game_title, album_data['name']),
+        "keywords": get_keyword_score(album_data['name']),
+        "year": get_year_score(released, album_data['release_date']),
+        "tracks": get_track_score(album_data['total_tracks']),
+    }
+
+    return round(sum(WEIGHTS[part] * value for part, value in parts.items()), 3)
+
+
+def rank_albums(game_title, released, album_list):
+    # Best first, as album data with its score
+    ranked = []
+
+    for album in album_list:
+        album_data = get_album_data(album)
+        album_data['score'] = score_album(game_title, released, album_data)
+        ranked.append(album_data)
+
+    return sorted(ranked, key=lambda album_data: album_data['score'], reverse=True)
+
+
+def match_album(game_title, released, album_list):
+    # Returns ("accept", "review" or "reject", ranked candidates)
+    ranked = rank_albums(game_title, released, album_list)
+
+    best = ranked[0]['score'] if ranked else 0.0
+    runner_up = ranked[1]['score'] if len(ranked) > 1 else 0.0
+
+    if best >= ACCEPT_THRESHOLD and best - runner_up >= ACCEPT_MARGIN:
+        decision = "accept"
+    elif best >= REVIEW_THRESHOLD:
+        decision = "review"
+    else:
+        decision = "reject"
+
+    stats[decision] += 1
+
+    return decision, ranked
+
+
+def create_review_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS album_review
+        (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            game_title TEXT UNIQUE,
+            developer_id INTEGER,
+            game TEXT,
+            candidates TEXT,
+            status TEXT,
+            chosen INTEGER,
+            created_at REAL
+        )
+    """)
+    conn.commit()
+
+
+def add_reviews(conn, reviews):
+    # reviews holds (RAWG game, developer id, ranked candidates); a game
+    # already queued keeps its first review. Only the RAWG fields the game
+    # table needs are kept.
+    conn.executemany("""
+        INSERT OR IGNORE INTO album_review (game_title, developer_id, game, candidates, status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(game['name'], developer_id, json.dumps({key: game.get(key) for key in ('name', 'released', 'genres')}),
+           json.dumps(ranked), "pending", time.time())
+          for game, developer_id, ranked in reviews])
+
+
+def get_pending_reviews(conn):
+    rows = conn.execute("""
+        SELECT id, developer_id, game, candidates FROM album_review WHERE status = ? ORDER BY id
+    """, ("pending",))
+
+    return [{'id': review_id, 'developer_id': developer_id, 'game': json.loads(game), 'candidates': json.loads(candidates)}
+            for review_id, developer_id, game, candidates in rows]
+
+
+def set_review_status(conn, decisions):
+    # decisions holds (status, chosen candidate index or None, review id)
+    conn.executemany("UPDATE album_review SET status = ?, chosen = ? WHERE id = ?", decisions)
+
+
+def print_match_stats():
+    print(f"Album matching: {stats['accept']} accepted, {stats['review']} queued for review, "
+          f"{stats['reject']} without a match")
@@ -1,538 +1,732 @@
+import logging
 import essentia
 import essentia.standard as es
-from essentia.standard import MonoLoader, TensorflowPredictEffnetDiscogs, TensorflowPredict2D
+from essentia.standard import MonoLoader
+import ffmpeg
 import numpy as np
+from Embedding_Cache import get_audio_hash, load_embeddings, store_embeddings
+from Model_Registry import BATCH_EMBEDDING_MODEL, get_embedding_model, get_batch_embedding_model, get_mel_bands, get_prediction_model
+import Metrics
+
+log = logging.getLogger(__name__)
+
+
+genre_labels = ["Blues---Boogie Woogie",
+    "Blues---Chicago Blues",
+    "Blues---Country Blues",
+    "Blues---Delta Blues",
+    "Blues---Electric Blues",
+    "Blues---Harmonica Blues",
+    "Blues---Jump Blues",
+    "Blues---Louisiana Blues",
+    "Blues---Modern Electric Blues",
+    "Blues---Piano Blues",
+    "Blues---Rhythm & Blues",
+    "Blues---Texas Blues",
+    "Brass & Military---Brass Band",
+    "Brass & Military---Marches",
+    "Brass & Military---Military",
+    "Children's---Educational",
+    "Children's---Nursery Rhymes",
+    "Children's---Story",
+    "Classical---Baroque",
+    "Classical---Choral",
+    "Classical---Classical",
+    "Classical---Contemporary",
+    "Classical---Impressionist",
+    "Classical---Medieval",
+    "Classical---Modern",
+    "Classical---Neo-Classical",
+    "Classical---Neo-Romantic",
+    "Classical---Opera",
+    "Classical---Post-Modern",
+    "Classical---Renaissance",
+    "Classical---Romantic",
+    "Electronic---Abstract",
+    "Electronic---Acid",
+    "Electronic---Acid House",
+    "Electronic---Acid Jazz",
+    "Electronic---Ambient",
+    "Electronic---Bassline",
+    "Electronic---Beatdown",
+    "Electronic---Berlin-School",
+    "Electronic---Big Beat",
+    "Electronic---Bleep",
+    "Electronic---Breakbeat",
+    "Electronic---Breakcore",
+    "Electronic---Breaks",
+    "Electronic---Broken Beat",
+    "Electronic---Chillwave",
+    "Electronic---Chiptune",
+    "Electronic---Dance-pop",
+    "Electronic---Dark Ambient",
+    "Electronic---Darkwave",
+    "Electronic---Deep House",
+    "Electronic---Deep Techno",
+    "Electronic---Disco",
+    "Electronic---Disco Polo",
+    "Electronic---Donk",
+    "Electronic---Downtempo",
+    "Electronic---Drone",
+    "Electronic---Drum n Bass",
+    "Electronic---Dub",
+    "Electronic---Dub Techno",
+    "Electronic---Dubstep",
+    "Electronic---Dungeon Synth",
+    "Electronic---EBM",
+    "Electronic---Electro",
+    "Electronic---Electro House",
+    "Electronic---Electroclash",
+    "Electronic---Euro House",
+    "Electronic---Euro-Disco",
+    "Electronic---Eurobeat",
+    "Electronic---Eurodance",
+    "Electronic---Experimental",
+    "Electronic---Freestyle",
+    "Electronic---Future Jazz",
+    "Electronic---Gabber",
+    "Electronic---Garage House",
+    "Electronic---Ghetto",
+    "Electronic---Ghetto House",
+    "Electronic---Glitch",
+    "Electronic---Goa Trance",
+    "Electronic---Grime",
+    "Electronic---Halftime",
+    "Electronic---Hands Up",
+    "Electronic---Happy Hardcore",
+    "Electronic---Hard House",
+    "Electronic---Hard Techno",
+    "Electronic---Hard Trance",
+    "Electronic---Hardcore",
+    "Electronic---Hardstyle",
+    "Electronic---Hi NRG",
+    "Electronic---Hip Hop",
+    "Electronic---Hip-House",
+    "Electronic---House",
+    "Electronic---IDM",
+    "Electronic---Illbient",
+    "Electronic---Industrial",
+    "Electronic---Italo House",
+    "Electronic---Italo-Disco",
+    "Electronic---Italodance",
+    "Electronic---Jazzdance",
+    "Electronic---Juke",
+    "Electronic---Jumpstyle",
+    "Electronic---Jungle",
+    "Electronic---Latin",
+    "Electronic---Leftfield",
+    "Electronic---Makina",
+    "Electronic---Minimal",
+    "Electronic---Minimal Techno",
+    "Electronic---Modern Classical",
+    "Electronic---Musique Concr\u00e8te",
+    "Electronic---Neofolk",
+    "Electronic---New Age",
+    "Electronic---New Beat",
+    "Electronic---New Wave",
+    "Electronic---Noise",
+    "Electronic---Nu-Disco",
+    "Electronic---Power Electronics",
+    "Electronic---Progressive Breaks",
+    "Electronic---Progressive House",
+    "Electronic---Progressive Trance",
+    "Electronic---Psy-Trance",
+    "Electronic---Rhythmic Noise",
+    "Electronic---Schranz",
+    "Electronic---Sound Collage",
+    "Electronic---Speed Garage",
+    "Electronic---Speedcore",
+    "Electronic---Synth-pop",
+    "Electronic---Synthwave",
+    "Electronic---Tech House",
+    "Electronic---Tech Trance",
+    "Electronic---Techno",
+    "Electronic---Trance",
+    "Electronic---Tribal",
+    "Electronic---Tribal House",
+    "Electronic---Trip Hop",
+    "Electronic---Tropical House",
+    "Electronic---UK Garage",
+    "Electronic---Vaporwave",
+    "Folk, World, & Country---African",
+    "Folk, World, & Country---Bluegrass",
+    "Folk, World, & Country---Cajun",
+    "Folk, World, & Country---Canzone Napoletana",
+    "Folk, World, & Country---Catalan Music",
+    "Folk, World, & Country---Celtic",
+    "Folk, World, & Country---Country",
+    "Folk, World, & Country---Fado",
+    "Folk, World, & Country---Flamenco",
+    "Folk, World, & Country---Folk",
+    "Folk, World, & Country---Gospel",
+    "Folk, World, & Country---Highlife",
+    "Folk, World, & Country---Hillbilly",
+    "Folk, World, & Country---Hindustani",
+    "Folk, World, & Country---Honky Tonk",
+    "Folk, World, & Country---Indian Classical",
+    "Folk, World, & Country---La\u00efk\u00f3",
+    "Folk, World, & Country---Nordic",
+    "Folk, World, & Country---Pacific",
+    "Folk, World, & Country---Polka",
+    "Folk, World, & Country---Ra\u00ef",
+    "Folk, World, & Country---Romani",
+    "Folk, World, & Country---Soukous",
+    "Folk, World, & Country---S\u00e9ga",
+    "Folk, World, & Country---Volksmusik",
+    "Folk, World, & Country---Zouk",
+    "Folk, World, & Country---\u00c9ntekhno",
+    "Funk / Soul---Afrobeat",
+    "Funk / Soul---Boogie",
+    "Funk / Soul---Contemporary R&B",
+    "Funk / Soul---Disco",
+    "Funk / Soul---Free Funk",
+    "Funk / Soul---Funk",
+    "Funk / Soul---Gospel",
+    "Funk / Soul---Neo Soul",
+    "Funk / Soul---New Jack Swing",
+    "Funk / Soul---P.Funk",
+    "Funk / Soul---Psychedelic",
+    "Funk / Soul---Rhythm & Blues",
+    "Funk / Soul---Soul",
+    "Funk / Soul---Swingbeat",
+    "Funk / Soul---UK Street Soul",
+    "Hip Hop---Bass Music",
+    "Hip Hop---Boom Bap",
+    "Hip Hop---Bounce",
+    "Hip Hop---Britcore",
+    "Hip Hop---Cloud Rap",
+    "Hip Hop---Conscious",
+    "Hip Hop---Crunk",
+    "Hip Hop---Cut-up/DJ",
+    "Hip Hop---DJ Battle Tool",
+    "Hip Hop---Electro",
+    "Hip Hop---G-Funk",
+    "Hip Hop---Gangsta",
+    "Hip Hop---Grime",
+    "Hip Hop---Hardcore Hip-Hop",
+    "Hip Hop---Horrorcore",
+    "Hip Hop---Instrumental",
+    "Hip Hop---Jazzy Hip-Hop",
+    "Hip Hop---Miami Bass",
+    "Hip Hop---Pop Rap",
+    "Hip Hop---Ragga HipHop",
+    "Hip Hop---RnB/Swing",
+    "Hip Hop---Screw",
+    "Hip Hop---Thug Rap",
+    "Hip Hop---Trap",
+    "Hip Hop---Trip Hop",
+    "Hip Hop---Turntablism",
+    "Jazz---Afro-Cuban Jazz",
+    "Jazz---Afrobeat",
+    "Jazz---Avant-garde Jazz",
+    "Jazz---Big Band",
+    "Jazz---Bop",
+    "Jazz---Bossa Nova",
+    "Jazz---Contemporary Jazz",
+    "Jazz---Cool Jazz",
+    "Jazz---Dixieland",
+    "Jazz---Easy Listening",
+    "Jazz---Free Improvisation",
+    "Jazz---Free Jazz",
+    "Jazz---Fusion",
+    "Jazz---Gypsy Jazz",
+    "Jazz---Hard Bop",
+    "Jazz---Jazz-Funk",
+    "Jazz---Jazz-Rock",
+    "Jazz---Latin Jazz",
+    "Jazz---Modal",
+    "Jazz---Post Bop",
+    "Jazz---Ragtime",
+    "Jazz---Smooth Jazz",
+    "Jazz---Soul-Jazz",
+    "Jazz---Space-Age",
+    "Jazz---Swing",
+    "Latin---Afro-Cuban",
+    "Latin---Bai\u00e3o",
+    "Latin---Batucada",
+    "Latin---Beguine",
+    "Latin---Bolero",
+    "Latin---Boogaloo",
+    "Latin---Bossanova",
+    "Latin---Cha-Cha",
+    "Latin---Charanga",
+    "Latin---Compas",
+    "Latin---Cubano",
+    "Latin---Cumbia",
+    "Latin---Descarga",
+    "Latin---Forr\u00f3",
+    "Latin---Guaguanc\u00f3",
+    "Latin---Guajira",
+    "Latin---Guaracha",
+    "Latin---MPB",
+    "Latin---Mambo",
+    "Latin---Mariachi",
+    "Latin---Merengue",
+    "Latin---Norte\u00f1o",
+    "Latin---Nueva Cancion",
+    "Latin---Pachanga",
+    "Latin---Porro",
+    "Latin---Ranchera",
+    "Latin---Reggaeton",
+    "Latin---Rumba",
+    "Latin---Salsa",
+    "Latin---Samba",
+    "Latin---Son",
+    "Latin---Son Montuno",
+    "Latin---Tango",
+    "Latin---Tejano",
+    "Latin---Vallenato",
+    "Non-Music---Audiobook",
+    "Non-Music---Comedy",
+    "Non-Music---Dialogue",
+    "Non-Music---Education",
+    "Non-Music---Field Recording",
+    "Non-Music---Interview",
+    "Non-Music---Monolog",
+    "Non-Music---Poetry",
+    "Non-Music---Political",
+    "Non-Music---Promotional",
+    "Non-Music---Radioplay",
+    "Non-Music---Religious",
+    "Non-Music---Spoken Word",
+    "Pop---Ballad",
+    "Pop---Bollywood",
+    "Pop---Bubblegum",
+    "Pop---Chanson",
+    "Pop---City Pop",
+    "Pop---Europop",
+    "Pop---Indie Pop",
+    "Pop---J-pop",
+    "Pop---K-pop",
+    "Pop---Kay\u014dkyoku",
+    "Pop---Light Music",
+    "Pop---Music Hall",
+    "Pop---Novelty",
+    "Pop---Parody",
+    "Pop---Schlager",
+    "Pop---Vocal",
+    "Reggae---Calypso",
+    "Reggae---Dancehall",
+    "Reggae---Dub",
+    "Reggae---Lovers Rock",
+    "Reggae---Ragga",
+    "Reggae---Reggae",
+    "Reggae---Reggae-Pop",
+    "Reggae---Rocksteady",
+    "Reggae---Roots Reggae",
+    "Reggae---Ska",
+    "Reggae---Soca",
+    "Rock---AOR",
+    "Rock---Acid Rock",
+    "Rock---Acoustic",
+    "Rock---Alternative Rock",
+    "Rock---Arena Rock",
+    "Rock---Art Rock",
+    "Rock---Atmospheric Black Metal",
+    "Rock---Avantgarde",
+    "Rock---Beat",
+    "Rock---Black Metal",
+    "Rock---Blues Rock",
+    "Rock---Brit Pop",
+    "Rock---Classic Rock",
+    "Rock---Coldwave",
+    "Rock---Country Rock",
+    "Rock---Crust",
+    "Rock---Death Metal",
+    "Rock---Deathcore",
+    "Rock---Deathrock",
+    "Rock---Depressive Black Metal",
+    "Rock---Doo Wop",
+    "Rock---Doom Metal",
+    "Rock---Dream Pop",
+    "Rock---Emo",
+    "Rock---Ethereal",
+    "Rock---Experimental",
+    "Rock---Folk Metal",
+    "Rock---Folk Rock",
+    "Rock---Funeral Doom Metal",
+    "Rock---Funk Metal",
+    "Rock---Garage Rock",
+    "Rock---Glam",
+    "Rock---Goregrind",
+    "Rock---Goth Rock",
+    "Rock---Gothic Metal",
+    "Rock---Grindcore",
+    "Rock---Grunge",
+    "Rock---Hard Rock",
+    "Rock---Hardcore",
+    "Rock---Heavy Metal",
+    "Rock---Indie Rock",
+    "Rock---Industrial",
+    "Rock---Krautrock",
+    "Rock---Lo-Fi",
+    "Rock---Lounge",
+    "Rock---Math Rock",
+    "Rock---Melodic Death Metal",
+    "Rock---Melodic Hardcore",
+    "Rock---Metalcore",
+    "Rock---Mod",
+    "Rock---Neofolk",
+    "Rock---New Wave",
+    "Rock---No Wave",
+    "Rock---Noise",
+    "Rock---Noisecore",
+    "Rock---Nu Metal",
+    "Rock---Oi",
+    "Rock---Parody",
+    "Rock---Pop Punk",
+    "Rock---Pop Rock",
+    "Rock---Pornogrind",
+    "Rock---Post Rock",
+    "Rock---Post-Hardcore",
+    "Rock---Post-Metal",
+    "Rock---Post-Punk",
+    "Rock---Power Metal",
+    "Rock---Power Pop",
+    "Rock---Power Violence",
+    "Rock---Prog Rock",
+    "Rock---Progressive Metal",
+    "Rock---Psychedelic Rock",
+    "Rock---Psychobilly",
+    "Rock---Pub Rock",
+    "Rock---Punk",
+    "Rock---Rock & Roll",
+    "Rock---Rockabilly",
+    "Rock---Shoegaze",
+    "Rock---Ska",
+    "Rock---Sludge Metal",
+    "Rock---Soft Rock",
+    "Rock---Southern Rock",
+    "Rock---Space Rock",
+    "Rock---Speed Metal",
+    "Rock---Stoner Rock",
+    "Rock---Surf",
+    "Rock---Symphonic Rock",
+    "Rock---Technical Death Metal",
+    "Rock---Thrash",
+    "Rock---Twist",
+    "Rock---Viking Metal",
+    "Rock---Y\u00e9-Y\u00e9",
+    "Stage & Screen---Musical",
+    "Stage & Screen---Score",
+    "Stage & Screen---Soundtrack",
+    "Stage & Screen---Theme"
+]
+
+
+# Binary heads scored for every track, in the same order as the song table
+# columns. The index is the position of the positive class in each softmax.
+FEATURE_HEADS = [
+    ("Approachability", 1),     # Index 0: Negative, Index 1: Positive
+    ("Engagement", 1),          # Index 0: Negative, Index 1: Positive
+    ("Danceability", 0),        # Index 0: Positive, Index 1: Negative
+    ("Aggressiveness", 0),      # Index 0: Positive, Index 1: Negative
+    ("Mood_Happy", 0),          # Index 0: Positive, Index 1: Negative
+    ("Mood_Party", 1),          # Index 0: Negative, Index 1: Positive
+    ("Mood_Relaxed", 1),        # Index 0: Negative, Index 1: Positive
+    ("Mood_Sad", 1),            # Index 0: Negative, Index 1: Positive
+    ("Mood_Electronic", 0),     # Index 0: Positive, Index 1: Negative
+    ("Mood_Acoustic", 0),       # Index 0: Positive, Index 1: Negative
+]
+
+
+def score_batch_heads(batch_embeddings):
+    # The heads score each embedding row on its own, so the tracks are stacked
+    # into one matrix and every head runs once over the whole batch. Each
+    # track's rows are then sliced back out and mean pooled over time.
+    embeddings = np.ascontiguousarray(np.concatenate(batch_embeddings), dtype=np.float32)
+    offsets = np.cumsum([0] + [len(track) for track in batch_embeddings])
+    scores = [{} for track in batch_embeddings]
+
+    for name in ["Genre"] + [head for head, index in FEATURE_HEADS]:
+        with Metrics.timed(f"head {name}"):
+            predictions = np.array(get_prediction_model(name)(embeddings))
+
+            for i, track_scores in enumerate(scores):
+                track_scores[name] = predictions[offsets[i]:offsets[i + 1]].mean(axis=0)
+
+    return scores
+
+
+def score_heads(embeddings):
+    return score_batch_heads([embeddings])[0]
+
+
+def scores_to_features(scores):
+    track_features = [genre_labels[np.argmax(scores["Genre"])]]
+
+    for name, index in FEATURE_HEADS:
+        track_features.append(scores[name][index])
+
+    return track_features
+
+
+SAMPLE_RATE = 16000
+
+
+def decode_audio(file_directory):
+    # ffmpeg decodes and resamples straight to 16 kHz mono float32 on a pipe,
+    # so no intermediate WAV is written or read back
+    with Metrics.timed("ffmpeg decode") as measurement:
+        out, _ = (
+            ffmpeg.input(file_directory)
+            .output("pipe:", format="f32le", acodec="pcm_f32le", ac=1, ar=SAMPLE_RATE)
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+        measurement["bytes"] = len(out)
 
+    return np.frombuffer(out, dtype=np.float32).copy()
 
-def get_audio_features(file_directory):
 
-    try:
-        track_features = []
-
-        # ----------------------- Embeddings -----------------------
-        labels = ["Blues---Boogie Woogie",
-                "Blues---Chicago Blues",
-                "Blues---Country Blues",
-                "Blues---Delta Blues",
-                "Blues---Electric Blues",
-                "Blues---Harmonica Blues",
-                "Blues---Jump Blues",
-                "Blues---Louisiana Blues",
-                "Blues---Modern Electric Blues",
-                "Blues---Piano Blues",
-                "Blues---Rhythm & Blues",
-                "Blues---Texas Blues",
-                "Brass & Military---Brass Band",
-                "Brass & Military---Marches",
-                "Brass & Military---Military",
-                "Children's---Educational",
-                "Children's---Nursery Rhymes",
-                "Children's---Story",
-                "Classical---Baroque",
-                "Classical---Choral",
-                "Classical---Classical",
-                "Classical---Contemporary",
-                "Classical---Impressionist",
-                "Classical---Medieval",
-                "Classical---Modern",
-                "Classical---Neo-Classical",
-                "Classical---Neo-Romantic",
-                "Classical---Opera",
-                "Classical---Post-Modern",
-                "Classical---Renaissance",
-                "Classical---Romantic",
-                "Electronic---Abstract",
-                "Electronic---Acid",
-                "Electronic---Acid House",
-                "Electronic---Acid Jazz",
-                "Electronic---Ambient",
-                "Electronic---Bassline",
-                "Electronic---Beatdown",
-                "Electronic---Berlin-School",
-                "Electronic---Big Beat",
-                "Electronic---Bleep",
-                "Electronic---Breakbeat",
-                "Electronic---Breakcore",
-                "Electronic---Breaks",
-                "Electronic---Broken Beat",
-                "Electronic---Chillwave",
-                "Electronic---Chiptune",
-                "Electronic---Dance-pop",
-                "Electronic---Dark Ambient",
-                "Electronic---Darkwave",
-                "Electronic---Deep House",
-                "Electronic---Deep Techno",
-                "Electronic---Disco",
-                "Electronic---Disco Polo",
-                "Electronic---Donk",
-                "Electronic---Downtempo",
-                "Electronic---Drone",
-                "Electronic---Drum n Bass",
-                "Electronic---Dub",
-                "Electronic---Dub Techno",
-                "Electronic---Dubstep",
-                "Electronic---Dungeon Synth",
-                "Electronic---EBM",
-                "Electronic---Electro",
-                "Electronic---Electro House",
-                "Electronic---Electroclash",
-                "Electronic---Euro House",
-                "Electronic---Euro-Disco",
-                "Electronic---Eurobeat",
-                "Electronic---Eurodance",
-                "Electronic---Experimental",
-                "Electronic---Freestyle",
-                "Electronic---Future Jazz",
-                "Electronic---Gabber",
-                "Electronic---Garage House",
-                "Electronic---Ghetto",
-                "Electronic---Ghetto House",
-                "Electronic---Glitch",
-                "Electronic---Goa Trance",
-                "Electronic---Grime",
-                "Electronic---Halftime",
-                "Electronic---Hands Up",
-                "Electronic---Happy Hardcore",
-                "Electronic---Hard House",
-                "Electronic---Hard Techno",
-                "Electronic---Hard Trance",
-                "Electronic---Hardcore",
-                "Electronic---Hardstyle",
-                "Electronic---Hi NRG",
-                "Electronic---Hip Hop",
-                "Electronic---Hip-House",
-                "Electronic---House",
-                "Electronic---IDM",
-                "Electronic---Illbient",
-                "Electronic---Industrial",
-                "Electronic---Italo House",
-                "Electronic---Italo-Disco",
-                "Electronic---Italodance",
-                "Electronic---Jazzdance",
-                "Electronic---Juke",
-                "Electronic---Jumpstyle",
-                "Electronic---Jungle",
-                "Electronic---Latin",
-                "Electronic---Leftfield",
-                "Electronic---Makina",
-                "Electronic---Minimal",
-                "Electronic---Minimal Techno",
-                "Electronic---Modern Classical",
-                "Electronic---Musique Concr\u00e8te",
-                "Electronic---Neofolk",
-                "Electronic---New Age",
-                "Electronic---New Beat",
-                "Electronic---New Wave",
-                "Electronic---Noise",
-                "Electronic---Nu-Disco",
-                "Electronic---Power Electronics",
-                "Electronic---Progressive Breaks",
-                "Electronic---Progressive House",
-                "Electronic---Progressive Trance",
-                "Electronic---Psy-Trance",
-                "Electronic---Rhythmic Noise",
-                "Electronic---Schranz",
-                "Electronic---Sound Collage",
-                "Electronic---Speed Garage",
-                "Electronic---Speedcore",
-                "Electronic---Synth-pop",
-                "Electronic---Synthwave",
-                "Electronic---Tech House",
-                "Electronic---Tech Trance",
-                "Electronic---Techno",
-                "Electronic---Trance",
-                "Electronic---Tribal",
-                "Electronic---Tribal House",
-                "Electronic---Trip Hop",
-                "Electronic---Tropical House",
-                "Electronic---UK Garage",
-                "Electronic---Vaporwave",
-                "Folk, World, & Country---African",
-                "Folk, World, & Country---Bluegrass",
-                "Folk, World, & Country---Cajun",
-                "Folk, World, & Country---Canzone Napoletana",
-                "Folk, World, & Country---Catalan Music",
-                "Folk, World, & Country---Celtic",
-                "Folk, World, & Country---Country",
-                "Folk, World, & Country---Fado",
-                "Folk, World, & Country---Flamenco",
-                "Folk, World, & Country---Folk",
-                "Folk, World, & Country---Gospel",
-                "Folk, World, & Country---Highlife",
-                "Folk, World, & Country---Hillbilly",
-                "Folk, World, & Country---Hindustani",
-                "Folk, World, & Country---Honky Tonk",
-                "Folk, World, & Country---Indian Classical",
-                "Folk, World, & Country---La\u00efk\u00f3",
-                "Folk, World, & Country---Nordic",
-                "Folk, World, & Country---Pacific",
-                "Folk, World, & Country---Polka",
-                "Folk, World, & Country---Ra\u00ef",
-                "Folk, World, & Country---Romani",
-                "Folk, World, & Country---Soukous",
-                "Folk, World, & Country---S\u00e9ga",
-                "Folk, World, & Country---Volksmusik",
-                "Folk, World, & Country---Zouk",
-                "Folk, World, & Country---\u00c9ntekhno",
-                "Funk / Soul---Afrobeat",
-                "Funk / Soul---Boogie",
-                "Funk / Soul---Contemporary R&B",
-                "Funk / Soul---Disco",
-                "Funk / Soul---Free Funk",
-                "Funk / Soul---Funk",
-                "Funk / Soul---Gospel",
-                "Funk / Soul---Neo Soul",
-                "Funk / Soul---New Jack Swing",
-                "Funk / Soul---P.Funk",
-                "Funk / Soul---Psychedelic",
-                "Funk / Soul---Rhythm & Blues",
-                "Funk / Soul---Soul",
-                "Funk / Soul---Swingbeat",
-                "Funk / Soul---UK Street Soul",
-                "Hip Hop---Bass Music",
-                "Hip Hop---Boom Bap",
-                "Hip Hop---Bounce",
-                "Hip Hop---Britcore",
-                "Hip Hop---Cloud Rap",
-                "Hip Hop---Conscious",
-                "Hip Hop---Crunk",
-                "Hip Hop---Cut-up/DJ",
-                "Hip Hop---DJ Battle Tool",
-                "Hip Hop---Electro",
-                "Hip Hop---G-Funk",
-                "Hip Hop---Gangsta",
-                "Hip Hop---Grime",
-                "Hip Hop---Hardcore Hip-Hop",
-                "Hip Hop---Horrorcore",
-                "Hip Hop---Instrumental",
-                "Hip Hop---Jazzy Hip-Hop",
-                "Hip Hop---Miami Bass",
-                "Hip Hop---Pop Rap",
-                "Hip Hop---Ragga HipHop",
-                "Hip Hop---RnB/Swing",
-                "Hip Hop---Screw",
-                "Hip Hop---Thug Rap",
-                "Hip Hop---Trap",
-                "Hip Hop---Trip Hop",
-                "Hip Hop---Turntablism",
-                "Jazz---Afro-Cuban Jazz",
-                "Jazz---Afrobeat",
-                "Jazz---Avant-garde Jazz",
-                "Jazz---Big Band",
-                "Jazz---Bop",
-                "Jazz---Bossa Nova",
-                "Jazz---Contemporary Jazz",
-                "Jazz---Cool Jazz",
-                "Jazz---Dixieland",
-                "Jazz---Easy Listening",
-                "Jazz---Free Improvisation",
-                "Jazz---Free Jazz",
-                "Jazz---Fusion",
-                "Jazz---Gypsy Jazz",
-                "Jazz---Hard Bop",
-                "Jazz---Jazz-Funk",
-                "Jazz---Jazz-Rock",
-                "Jazz---Latin Jazz",
-                "Jazz---Modal",
-                "Jazz---Post Bop",
-                "Jazz---Ragtime",
-                "Jazz---Smooth Jazz",
-                "Jazz---Soul-Jazz",
-                "Jazz---Space-Age",
-                "Jazz---Swing",
-                "Latin---Afro-Cuban",
-                "Latin---Bai\u00e3o",
-                "Latin---Batucada",
-                "Latin---Beguine",
-                "Latin---Bolero",
-                "Latin---Boogaloo",
-                "Latin---Bossanova",
-                "Latin---Cha-Cha",
-                "Latin---Charanga",
-                "Latin---Compas",
-                "Latin---Cubano",
-                "Latin---Cumbia",
-                "Latin---Descarga",
-                "Latin---Forr\u00f3",
-                "Latin---Guaguanc\u00f3",
-                "Latin---Guajira",
-                "Latin---Guaracha",
-                "Latin---MPB",
-                "Latin---Mambo",
-                "Latin---Mariachi",
-                "Latin---Merengue",
-                "Latin---Norte\u00f1o",
-                "Latin---Nueva Cancion",
-                "Latin---Pachanga",
-                "Latin---Porro",
-                "Latin---Ranchera",
-                "Latin---Reggaeton",
-                "Latin---Rumba",
-                "Latin---Salsa",
-                "Latin---Samba",
-                "Latin---Son",
-                "Latin---Son Montuno",
-                "Latin---Tango",
-                "Latin---Tejano",
-                "Latin---Vallenato",
-                "Non-Music---Audiobook",
-                "Non-Music---Comedy",
-                "Non-Music---Dialogue",
-                "Non-Music---Education",
-                "Non-Music---Field Recording",
-                "Non-Music---Interview",
-                "Non-Music---Monolog",
-                "Non-Music---Poetry",
-                "Non-Music---Political",
-                "Non-Music---Promotional",
-                "Non-Music---Radioplay",
-                "Non-Music---Religious",
-                "Non-Music---Spoken Word",
-                "Pop---Ballad",
-                "Pop---Bollywood",
-                "Pop---Bubblegum",
-                "Pop---Chanson",
-                "Pop---City Pop",
-                "Pop---Europop",
-                "Pop---Indie Pop",
-                "Pop---J-pop",
-                "Pop---K-pop",
-                "Pop---Kay\u014dkyoku",
-                "Pop---Light Music",
-                "Pop---Music Hall",
-                "Pop---Novelty",
-                "Pop---Parody",
-                "Pop---Schlager",
-                "Pop---Vocal",
-                "Reggae---Calypso",
-                "Reggae---Dancehall",
-                "Reggae---Dub",
-                "Reggae---Lovers Rock",
-                "Reggae---Ragga",
-                "Reggae---Reggae",
-                "Reggae---Reggae-Pop",
-                "Reggae---Rocksteady",
-                "Reggae---Roots Reggae",
-                "Reggae---Ska",
-                "Reggae---Soca",
-                "Rock---AOR",
-                "Rock---Acid Rock",
-                "Rock---Acoustic",
-                "Rock---Alternative Rock",
-                "Rock---Arena Rock",
-                "Rock---Art Rock",
-                "Rock---Atmospheric Black Metal",
-                "Rock---Avantgarde",
-                "Rock---Beat",
-                "Rock---Black Metal",
-                "Rock---Blues Rock",
-                "Rock---Brit Pop",
-                "Rock---Classic Rock",
-                "Rock---Coldwave",
-                "Rock---Country Rock",
-                "Rock---Crust",
-                "Rock---Death Metal",
-                "Rock---Deathcore",
-                "Rock---Deathrock",
-                "Rock---Depressive Black Metal",
-                "Rock---Doo Wop",
-                "Rock---Doom Metal",
-                "Rock---Dream Pop",
-                "Rock---Emo",
-                "Rock---Ethereal",
-                "Rock---Experimental",
-                "Rock---Folk Metal",
-                "Rock---Folk Rock",
-                "Rock---Funeral Doom Metal",
-                "Rock---Funk Metal",
-                "Rock---Garage Rock",
-                "Rock---Glam",
-                "Rock---Goregrind",
-                "Rock---Goth Rock",
-                "Rock---Gothic Metal",
-                "Rock---Grindcore",
-                "Rock---Grunge",
-                "Rock---Hard Rock",
-                "Rock---Hardcore",
-                "Rock---Heavy Metal",
-                "Rock---Indie Rock",
-                "Rock---Industrial",
-                "Rock---Krautrock",
-                "Rock---Lo-Fi",
-                "Rock---Lounge",
-                "Rock---Math Rock",
-                "Rock---Melodic Death Metal",
-                "Rock---Melodic Hardcore",
-                "Rock---Metalcore",
-                "Rock---Mod",
-                "Rock---Neofolk",
-                "Rock---New Wave",
-                "Rock---No Wave",
-                "Rock---Noise",
-                "Rock---Noisecore",
-                "Rock---Nu Metal",
-                "Rock---Oi",
-                "Rock---Parody",
-                "Rock---Pop Punk",
-                "Rock---Pop Rock",
-                "Rock---Pornogrind",
-                "Rock---Post Rock",
-                "Rock---Post-Hardcore",
-                "Rock---Post-Metal",
-                "Rock---Post-Punk",
-                "Rock---Power Metal",
-                "Rock---Power Pop",
-                "Rock---Power Violence",
-                "Rock---Prog Rock",
-                "Rock---Progressive Metal",
-                "Rock---Psychedelic Rock",
-                "Rock---Psychobilly",
-                "Rock---Pub Rock",
-                "Rock---Punk",
-                "Rock---Rock & Roll",
-                "Rock---Rockabilly",
-                "Rock---Shoegaze",
-                "Rock---Ska",
-                "Rock---Sludge Metal",
-                "Rock---Soft Rock",
-                "Rock---Southern Rock",
-                "Rock---Space Rock",
-                "Rock---Speed Metal",
-                "Rock---Stoner Rock",
-                "Rock---Surf",
-                "Rock---Symphonic Rock",
-                "Rock---Technical Death Metal",
-                "Rock---Thrash",
-                "Rock---Twist",
-                "Rock---Viking Metal",
-                "Rock---Y\u00e9-Y\u00e9",
-                "Stage & Screen---Musical",
-                "Stage & Screen---Score",
-                "Stage & Screen---Soundtrack",
-                "Stage & Screen---Theme"
-            ]
-
-        print("here")
-        audio = MonoLoader(filename=file_directory, sampleRate=16000, resampleQuality=4)()
-        embedding_model = TensorflowPredictEffnetDiscogs(graphFilename="Embedding_Models/discogs-effnet-bs64-1.pb", output="PartitionedCall:1")
-        embeddings = embedding_model(audio)
-
-        # ----------------------- Genre Prediction -----------------------
-
-        model = TensorflowPredict2D(graphFilename="Prediction_Models/Genre_Predictor.pb", input="serving_default_model_Placeholder", output="PartitionedCall:0")
-        predictions = model(embeddings)
-
-
-        # Suppose `predictions` is your (407, 400) array
-        predictions = np.array(predictions)
-
-        # Mean pool over the time dimension (axis 0)
-        mean_prediction = predictions.mean(axis=0)  # Now shape is (400,)
-
-        # Now find the most probable genre
-        predicted_index = np.argmax(mean_prediction)
-        predicted_label = labels[predicted_index]
-        track_features.append(predicted_label)
-        print(f"Predicted Genre: {predicted_label}")
-
-
-        # ----------------------- Approachability Prediction -----------------------
-        model = TensorflowPredict2D(graphFilename="Prediction_Models/Approachability_Predictor.pb", output="model/Softmax")
-        predictions = model(embeddings)
-        mean_prediction = predictions.mean(axis=0)
-        approachability = mean_prediction[1]
-        track_features.append(approachability)
-
-        print(f"Predicted Approachability: {mean_prediction}") # Index 0: Negative, Index 1: Positive
-
-        # ----------------------- Engagement Prediction -----------------------
-        model = TensorflowPredict2D(graphFilename="Prediction_Models/Engagement_Predictor.pb", output="model/Softmax")
-        predictions = model(embeddings)
-        mean_prediction = predictions.mean(axis=0)
-        engagement = mean_prediction[1]
-        track_features.append(engagement)
-
-        print(f"Predicted Engagement: {mean_prediction}") # Index 0: Negative, Index 1: Positive
-
-        # ----------------------- Danceability Prediction -----------------------
-        model = TensorflowPredict2D(graphFilename="Prediction_Models/Danceability_Predictor.pb", output="model/Softmax")
-        predictions = model(embeddings)
-        mean_prediction = predictions.mean(axis=0)
-        danceability = mean_prediction[0]
-        track_features.append(danceability)
-
-        print(f"Predicted Danceability: {mean_prediction}") # Index 0: Positive, Index 1: Negative
-
-
-        # ----------------------- Aggressiveness Prediction -----------------------
-        model = TensorflowPredict2D(graphFilename="Prediction_Models/Aggressiveness_Predictor.pb", output="model/Softmax")
-        predictions = model(embeddings)
-        mean_prediction = predictions.mean(axis=0)
-        aggressiveness = mean_prediction[0]
-        track_features.append(aggressiveness)
-
-        print(f"Predicted Aggressiveness: {mean_prediction}") # Index 0: Positive, Index 1: Negative
-
-
-        # ----------------------- Happiness Prediction -----------------------
-        model = TensorflowPredict2D(graphFilename="Prediction_Models/Mood_Happy_Predictor.pb", output="model/Softmax")
-        predictions = model(embeddings)
-        mean_prediction = predictions.mean(axis=0)
-        happy = mean_prediction[0]
-        track_features.append(happy)
-
-        print(f"Predicted Happiness: {mean_prediction}") # Index 0: Positive, Index 1: Negative
-
-
-        # ----------------------- Party Prediction -----------------------
-        model = TensorflowPredict2D(graphFilename="Prediction_Models/Mood_Party_Predictor.pb", output="model/Softmax")
-        predictions = model(embeddings)
-        mean_prediction = predictions.mean(axis=0)
-        party = mean_prediction[1]
-        track_features.append(party)
+def load_audio(source):
+    # Accepts either already decoded 16 kHz mono samples or a file to load
+    if isinstance(source, np.ndarray):
+        return np.ascontiguousarray(source, dtype=np.float32)
+
+    with Metrics.timed("monoloader") as measurement:
+        audio = MonoLoader(filename=source, sampleRate=SAMPLE_RATE, resampleQuality=4)()
+        measurement["bytes"] = audio.nbytes
+
+    return audio
+
+
+def load_track(source):
+    # A track given as a list of analysis windows is scored as one track, with
+    # the mean pooling taken over the patches of every window
+    if isinstance(source, list):
+        return [load_audio(window) for window in source]
+
+    return [load_audio(source)]
+
+
+def get_window_starts(duration, window_count, window_seconds):
+    # One window centred in each of window_count equal slices of the track. An
+    # empty list means the track fits in the budget and is analysed whole.
+    if duration <= window_count * window_seconds:
+        return []
+
+    slice_seconds = duration / window_count
+
+    return [i * slice_seconds + (slice_seconds - window_seconds) / 2 for i in range(window_count)]
+
+
+def sample_windows(audio, window_count, window_seconds):
+    starts = get_window_starts(len(audio) / SAMPLE_RATE, window_count, window_seconds)
+
+    if not starts:
+        return [audio]
+
+    length = int(window_seconds * SAMPLE_RATE)
+
+    return [audio[int(start * SAMPLE_RATE):int(start * SAMPLE_RATE) + length] for start in starts]
+
+
+# discogs-effnet framing, matching the TensorflowPredictEffnetDiscogs defaults
+FRAME_SIZE = 512
+HOP_SIZE = 256
+PATCH_SIZE = 128
+PATCH_HOP_SIZE = 62
+NUMBER_BANDS = 96
+EMBEDDING_BATCH_SIZE = 64
+
+# The batched path is only used while its embeddings match the stock
+# TensorflowPredictEffnetDiscogs ones on a fixed fixture to within this, so
+# the two never write different feature spaces to the embedding cache
+EQUIVALENCE_TOLERANCE = 1e-4
+EQUIVALENCE_FIXTURE_SECONDS = 20
+
+_batch_path_matches = None
+
+
+def get_mel_patches(audio):
+    mel_bands = get_mel_bands()
+
+    bands = [mel_bands(frame) for frame in es.FrameGenerator(audio, frameSize=FRAME_SIZE, hopSize=HOP_SIZE)]
+    bands = np.array(bands, dtype=np.float32).reshape(-1, NUMBER_BANDS)
+
+    # Trailing frames that do not fill a whole patch are discarded, as the
+    # single-track model does
+    starts = range(0, len(bands) - PATCH_SIZE + 1, PATCH_HOP_SIZE)
+    patches = np.zeros((len(starts), PATCH_SIZE, NUMBER_BANDS), dtype=np.float32)
+
+    for i, start in enumerate(starts):
+        patches[i] = bands[start:start + PATCH_SIZE]
+
+    return patches
+
+
+def get_batch_embeddings(audio_list):
+    # Pack the patches of every track back to back so each inference batch is
+    # full, then split the embeddings back out per track
+    track_patches = [get_mel_patches(audio) for audio in audio_list]
+    counts = [len(patches) for patches in track_patches]
+    all_patches = np.concatenate(track_patches) if track_patches else np.zeros((0, PATCH_SIZE, NUMBER_BANDS), dtype=np.float32)
+
+    model = get_batch_embedding_model()
+    embeddings = []
+
+    # Each fixed-size effnet batch is one measurement
+    for start in range(0, len(all_patches), EMBEDDING_BATCH_SIZE):
+        batch = all_patches[start:start + EMBEDDING_BATCH_SIZE]
+        valid = len(batch)
+
+        # The bs64 graph has a fixed batch dimension, only the last batch is padded
+        if valid < EMBEDDING_BATCH_SIZE:
+            padding = np.zeros((EMBEDDING_BATCH_SIZE - valid, PATCH_SIZE, NUMBER_BANDS), dtype=np.float32)
+            batch = np.concatenate([batch, padding])
+
+        with Metrics.timed("effnet embedding"):
+            pool = essentia.Pool()
+            pool.set(BATCH_EMBEDDING_MODEL["inputs"][0], batch[:, np.newaxis, :, :])
+            output = np.array(model(pool)[BATCH_EMBEDDING_MODEL["outputs"][0]])
+            embeddings.append(output.reshape(EMBEDDING_BATCH_SIZE, -1)[:valid])
+
+    embeddings = np.concatenate(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+    offsets = np.cumsum([0] + counts)
 
-        print(f"Predicted Party: {mean_prediction}") # Index 0: Negative, Index 1: Positive
+    return [embeddings[offsets[i]:offsets[i + 1]] for i in range(len(audio_list))]
 
 
-        # ----------------------- Relaxed Prediction -----------------------
-        model = TensorflowPredict2D(graphFilename="Prediction_Models/Mood_Relaxed_Predictor.pb", output="model/Softmax")
-        predictions = model(embeddings)
-        mean_prediction = predictions.mean(axis=0)
-        relaxed = mean_prediction[1]
-        track_features.append(relaxed)
+def get_stock_embeddings(audio_list):
+    embedding_model = get_embedding_model()
+    embeddings = []
 
-        print(f"Predicted Relaxed: {mean_prediction}") # Index 0: Negative, Index 1: Positive
+    for audio in audio_list:
+        with Metrics.timed("effnet embedding"):
+            embeddings.append(np.array(embedding_model(audio)))
 
+    return embeddings
 
-        # ----------------------- Sad Prediction -----------------------
-        model = TensorflowPredict2D(graphFilename="Prediction_Models/Mood_Sad_Predictor.pb", output="model/Softmax")
-        predictions = model(embeddings)
-        mean_prediction = predictions.mean(axis=0)
-        sad = mean_prediction[1]
-        track_features.append(sad)
 
-        print(f"Predicted Sad: {mean_prediction}") # Index 0: Negative, Index 1: Positive
+def make_equivalence_fixture():
+    # A new random three-note chord every two seconds, the same every run
+    rng = np.random.default_rng(0)
+    t = np.arange(EQUIVALENCE_FIXTURE_SECONDS * SAMPLE_RATE) / SAMPLE_RATE
+    notes = rng.uniform(110, 880, size=(EQUIVALENCE_FIXTURE_SECONDS // 2, 3))[(t // 2).astype(int)]
+
+    return (0.2 * np.sin(2 * np.pi * notes * t[:, np.newaxis]).sum(axis=1)).astype(np.float32)
+
+
+def get_embedding_difference(audio):
+    # Largest absolute difference between the batched and stock embeddings
+    stock = get_stock_embeddings([audio])[0]
+    batched = get_batch_embeddings([audio])[0]
+
+    if stock.shape != batched.shape:
+        return float("inf")
+
+    return float(np.abs(stock - batched).max())
+
+
+def batch_path_matches():
+    # Checked once per process, the first time a batch is scored
+    global _batch_path_matches
+
+    if _batch_path_matches is None:
+        difference = get_embedding_difference(make_equivalence_fixture())
+        _batch_path_matches = difference <= EQUIVALENCE_TOLERANCE
+
+        if not _batch_path_matches:
+            log.warning(f"Batched effnet embeddings differ from the stock model by {difference:.2g}, "
+                        f"using the stock model")
+
+    return _batch_path_matches
+
+
+# What one unreadable, corrupt or unusable track raises (essentia and
+# TensorFlow raise RuntimeError). Anything else stops the run.
+ANALYSIS_ERRORS = (RuntimeError, ValueError, OSError, ffmpeg.Error)
+
+
+def embed_tracks(tracks, audio_hashes, track_embeddings, indices):
+    # Patches from all of a track's windows are pooled together
+    get_embeddings = get_batch_embeddings if batch_path_matches() else get_stock_embeddings
+    window_embeddings = iter(get_embeddings([window for i in indices for window in tracks[i]]))
+
+    for i in indices:
+        embeddings = np.concatenate([next(window_embeddings) for window in tracks[i]])
+        store_embeddings(audio_hashes[i], embeddings)
+        track_embeddings[i] = embeddings
+
+
+def get_batch_audio_features(file_directories):
+    tracks = []
+
+    for file_directory in file_directories:
+        try:
+            tracks.append(load_track(file_directory))
+        except ANALYSIS_ERRORS as e:
+            log.warning(f"Unable to load {file_directory if isinstance(file_directory, str) else 'decoded audio'}: {e}")
+            tracks.append(None)
+
+    # Only tracks missing from the embedding cache go through the effnet
+    audio_hashes = [get_audio_hash(np.concatenate(windows)) if windows is not None else None for windows in tracks]
+    track_embeddings = [load_embeddings(audio_hash) if audio_hash else None for audio_hash in audio_hashes]
+    missing = [i for i, windows in enumerate(tracks) if windows is not None and track_embeddings[i] is None]
+
+    if missing:
+        try:
+            embed_tracks(tracks, audio_hashes, track_embeddings, missing)
+
+        # One bad track must not fail the rest of its batch
+        except ANALYSIS_ERRORS as e:
+            log.warning(f"Batched embedding failed ({e}), embedding its tracks one at a time")
+
+            for i in missing:
+                if track_embeddings[i] is not None:
+                    continue
+
+                try:
+                    embed_tracks(tracks, audio_hashes, track_embeddings, [i])
+                except ANALYSIS_ERRORS as e:
+                    log.warning(f"Embedding failed for track {i} of the batch: {e}")
+
+    # Tracks that failed to load or are shorter than one patch have nothing to score
+    album_features = [-1] * len(tracks)
+    scorable = [i for i, embeddings in enumerate(track_embeddings) if embeddings is not None and len(embeddings) > 0]
+
+    if scorable:
+        try:
+            batch_scores = score_batch_heads([track_embeddings[i] for i in scorable])
+
+            for i, scores in zip(scorable, batch_scores):
+                album_features[i] = scores_to_features(scores)
+        except ANALYSIS_ERRORS as e:
+            log.warning(f"Batched scoring failed ({e}), scoring its tracks one at a time")
+
+            for i in scorable:
+                try:
+                    album_features[i] = scores_to_features(score_heads(track_embeddings[i]))
+                except ANALYSIS_ERRORS as e:
+                    log.warning(f"Scoring failed for track {i} of the batch: {e}")
+
+    return album_features
+
+
+def get_audio_features(file_directory):
+
+    try:
+        windows = load_track(file_directory)
+        audio_hash = get_audio_hash(np.concatenate(windows))
+        embeddings = load_embeddings(audio_hash)
 
-        # ----------------------- Electronic Prediction -----------------------
-        model = TensorflowPredict2D(graphFilename="Prediction_Models/Mood_Electronic_Predictor.pb", output="model/Softmax")
-        predictions = model(embeddings)
-        mean_prediction = predictions.mean(axis=0)
-        electronic = mean_prediction[0]
-        track_features.append(electronic)
+        if embeddings is None:
+            embedding_model = get_embedding_model()
 
-        print(f"Predicted Electronic: {mean_prediction}") # Index 0: Positive, Index 1: Negative
+            with Metrics.timed("effnet embedding"):
+                embeddings = np.concatenate([embedding_model(window) for window in windows])
 
+            store_embeddings(audio_hash, embeddings)
 
-        # ----------------------- Acoustic Prediction -----------------------
-        model = TensorflowPredict2D(graphFilename="Prediction_Models/Mood_Acoustic_Predictor.pb", output="model/Softmax")
-        predictions = model(embeddings)
-        mean_prediction = predictions.mean(axis=0)
-        acoustic = mean_prediction[0]
-        track_features.append(acoustic)
+        # ----------------------- Head Predictions -----------------------
+        scores = score_heads(embeddings)
+        track_features = scores_to_features(scores)
 
-        print(f"Predicted Acoustic: {mean_prediction}") # Index 0: Positive, Index 1: Negative
+        log.debug(f"Predicted Genre: {track_features[0]}")
+        for name, index in FEATURE_HEADS:
+            log.debug(f"Predicted {name}: {scores[name]}")
 
         return track_features
     
     except:
-        return -1
\ No newline at end of file
+        return -1
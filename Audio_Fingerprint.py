@@ -0,0 +1,215 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+import numpy as np
+
+
+# Soundtrack re-releases, "complete" editions and compilations carry the same
+# recordings, usually from a different upload, so the embedding cache (keyed
+# by the exact samples) does not catch them. Each analysed track gets a small
+# landmark fingerprint of its decoded 16 kHz audio: the loudest spectral peaks
+# are paired and every pair hashed with its time gap. A new track sharing
+# enough aligned hashes with an analysed one of the same length reuses its
+# features instead of running the models again.
+#
+#   python Audio_Fingerprint.py    shows how much inference the dedup has saved
+
+STORE_FILE = "fingerprints.db"
+
+SAMPLE_RATE = 16000
+FRAME_SIZE = 1024
+HOP_SIZE = 512
+# Only the start of each track is fingerprinted, which is enough to tell copies apart
+FINGERPRINT_SECONDS = 60
+
+# Peaks are taken per band between ~150 Hz and 4 kHz, and only where a band is
+# louder than in the frames around it
+BAND_EDGES = [10, 25, 50, 100, 160, 256]
+PEAK_NEIGHBOURHOOD = 2
+# Each peak is paired with up to FAN_OUT later peaks at most TARGET_FRAMES away
+FAN_OUT = 3
+TARGET_FRAMES = 32
+
+# A match needs this many hashes at one alignment, covering this share of the
+# new track's hashes, and a duration within DURATION_TOLERANCE
+MIN_MATCHES = 25
+MATCH_RATIO = 0.1
+DURATION_TOLERANCE = 0.02
+
+stats = {"fingerprinted": 0, "matches": 0, "seconds_saved": 0.0}
+
+_conn = None
+_lock = threading.Lock()
+
+
+def get_store():
+    global _conn
+
+    if _conn is None:
+        _conn = sqlite3.connect(STORE_FILE, timeout=30, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode = WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS fingerprint_track
+            (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                duration REAL,
+                features TEXT,
+                inference_seconds REAL,
+                reuse_count INTEGER DEFAULT 0,
+                created_at REAL
+            )
+        """)
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS fingerprint_hash
+            (
+                hash INTEGER,
+                track_id INTEGER,
+                frame INTEGER,
+                PRIMARY KEY (hash, track_id, frame)
+            ) WITHOUT ROWID
+        """)
+        _conn.commit()
+
+    return _conn
+
+
+def get_peaks(audio):
+    # Returns (frame, bin) of each peak, in frame order
+    audio = np.asarray(audio[:FINGERPRINT_SECONDS * SAMPLE_RATE], dtype=np.float32)
+
+    if len(audio) < FRAME_SIZE:
+        return []
+
+    frames = np.lib.stride_tricks.sliding_window_view(audio, FRAME_SIZE)[::HOP_SIZE]
+    spectrum = np.log1p(np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE).astype(np.float32))))
+
+    peaks = []
+
+    for low, high in zip(BAND_EDGES, BAND_EDGES[1:]):
+        band = spectrum[:, low:high]
+        bins = band.argmax(axis=1)
+        energy = band.max(axis=1)
+
+        # Keep a band's peak only where it is the loudest of its neighbouring frames
+        padded = np.pad(energy, PEAK_NEIGHBOURHOOD, constant_values=-np.inf)
+        local_max = np.lib.stride_tricks.sliding_window_view(padded, 2 * PEAK_NEIGHBOURHOOD + 1).max(axis=1)
+        frames_kept = np.nonzero((energy >= local_max) & (energy > energy.mean()))[0]
+
+        peaks.extend((int(frame), int(bins[frame]) + low) for frame in frames_kept)
+
+    return sorted(peaks)
+
+
+def get_hashes(audio):
+    # Returns unique (hash, anchor frame) pairs; a hash packs both peak bins
+    # (9 bits each) and the frame gap (6 bits)
+    peaks = get_peaks(audio)
+    hashes = set()
+
+    for index, (frame, peak_bin) in enumerate(peaks):
+        paired = 0
+
+        for target_frame, target_bin in peaks[index + 1:]:
+            gap = target_frame - frame
+
+            if gap == 0:
+                continue
+            if gap > TARGET_FRAMES or paired == FAN_OUT:
+                break
+
+            hashes.add(((peak_bin << 15) | (target_bin << 6) | gap, frame))
+            paired += 1
+
+    return sorted(hashes)
+
+
+def find_match(hashes, duration):
+    # Returns (track id, features, inference seconds) of an analysed copy, or None
+    if not hashes:
+        return None
+
+    frames_by_hash = {}
+
+    for hash_value, frame in hashes:
+        frames_by_hash.setdefault(hash_value, []).append(frame)
+
+    hash_values = list(frames_by_hash)
+
+    with _lock:
+        rows = get_store().execute(f"""
+            SELECT hash, track_id, frame FROM fingerprint_hash
+            WHERE hash IN ({', '.join(['?'] * len(hash_values))})
+        """, hash_values).fetchall()
+
+    # Copies line up at one offset, so votes are counted per (track, offset)
+    votes = Counter()
+
+    for hash_value, track_id, frame in rows:
+        for query_frame in frames_by_hash[hash_value]:
+            votes[(track_id, frame - query_frame)] += 1
+
+    # A copy cut at a point that is not a whole hop away splits its votes
+    # between two neighbouring offsets
+    aligned = Counter({(track_id, offset): count + votes[(track_id, offset - 1)] + votes[(track_id, offset + 1)]
+                       for (track_id, offset), count in votes.items()})
+
+    for (track_id, offset), count in aligned.most_common(5):
+        if count < max(MIN_MATCHES, MATCH_RATIO * len(hashes)):
+            break
+
+        with _lock:
+            track = get_store().execute("SELECT duration, features, inference_seconds FROM fingerprint_track WHERE id = ?",
+                                        (track_id,)).fetchone()
+
+        if track and abs(track[0] - duration) <= DURATION_TOLERANCE * max(track[0], duration):
+            return track_id, json.loads(track[1]), track[2]
+
+    return None
+
+
+def record_match(track_id, inference_seconds):
+    with _lock:
+        conn = get_store()
+        conn.execute("UPDATE fingerprint_track SET reuse_count = reuse_count + 1 WHERE id = ?", (track_id,))
+        conn.commit()
+
+    stats["matches"] += 1
+    stats["seconds_saved"] += inference_seconds
+
+
+def store_fingerprint(hashes, duration, features, inference_seconds):
+    features = [features[0]] + [float(feature) for feature in features[1:]]
+
+    with _lock:
+        conn = get_store()
+
+        with conn:
+            track_id = conn.execute("""
+                INSERT INTO fingerprint_track (duration, features, inference_seconds, created_at)
+                VALUES (?, ?, ?, ?)
+            """, (duration, json.dumps(features), inference_seconds, time.time())).lastrowid
+
+            conn.executemany("INSERT OR IGNORE INTO fingerprint_hash (hash, track_id, frame) VALUES (?, ?, ?)",
+                             [(hash_value, track_id, frame) for hash_value, frame in hashes])
+
+    stats["fingerprinted"] += 1
+
+    return track_id
+
+
+def print_fingerprint_stats():
+    print(f"Fingerprint dedup: {stats['matches']} copies reused, {stats['fingerprinted']} tracks fingerprinted, "
+          f"{stats['seconds_saved']:.1f}s of inference saved")
+
+
+if __name__ == "__main__":
+    tracks, reused, saved = get_store().execute("""
+        SELECT COUNT(*), COALESCE(SUM(reuse_count), 0), COALESCE(SUM(reuse_count * inference_seconds), 0)
+        FROM fingerprint_track
+    """).fetchone()
+
+    print(f"{tracks} analysed tracks fingerprinted")
+    print(f"{reused} copies reused existing features")
+    print(f"{saved:.1f}s ({saved / 60:.1f} min) of inference saved")
@@ -0,0 +1,184 @@
+import hashlib
+import os
+import sqlite3
+import json
+import threading
+import time
+import numpy as np
+import Metrics
+
+
+# Keeps the audio each track was analysed from as 16 kHz mono int16 samples,
+# zlib-compressed in an .npz named by a hash of its Spotify track id, so re-runs
+# and re-analysis never download it again. Samples are rounded to int16 before
+# the first analysis too, so every run scores, fingerprints and hashes (for
+# the embedding cache) exactly the samples in the store. A manifest maps
+# track ids to their blobs,
+# records the length of each analysis window and tracks sizes and last access
+# for LRU eviction past MAX_STORE_BYTES. Downloads and WAVs are only
+# intermediates and are deleted once a song is written, whether or not it was
+# analysed.
+
+STORE_DIRECTORY = "AudioStore"
+MAX_STORE_BYTES = 10 * 1024 * 1024 * 1024
+
+SAMPLE_RATE = 16000
+INT16_SCALE = 32768
+
+stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "intermediates_deleted": 0, "bytes_freed": 0}
+
+_conn = None
+_lock = threading.Lock()
+
+
+def get_manifest():
+    global _conn
+
+    if _conn is None:
+        os.makedirs(STORE_DIRECTORY, exist_ok=True)
+        _conn = sqlite3.connect(os.path.join(STORE_DIRECTORY, "manifest.db"), timeout=30, check_same_thread=False)
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS audio
+            (
+                track_key TEXT PRIMARY KEY,
+                blob TEXT,
+                analysis_windows INTEGER,
+                window_seconds REAL,
+                window_lengths TEXT,
+                size_bytes INTEGER,
+                last_access REAL
+            )
+        """)
+        _conn.commit()
+
+    return _conn
+
+
+def get_blob_path(blob):
+
+    return os.path.join(STORE_DIRECTORY, blob[:2], f"{blob}.npz")
+
+
+def read_blob(blob):
+    with Metrics.timed("audio store read") as measurement:
+        with np.load(get_blob_path(blob)) as blob_file:
+            audio = from_int16(blob_file["audio"])
+
+        measurement["bytes"] = audio.nbytes
+
+    return audio
+
+
+def to_int16(audio):
+
+    return np.clip(np.round(np.asarray(audio, dtype=np.float32) * INT16_SCALE), -INT16_SCALE, INT16_SCALE - 1).astype(np.int16)
+
+
+def from_int16(samples):
+
+    return samples.astype(np.float32) / INT16_SCALE
+
+
+def split_windows(audio, window_lengths):
+
+    return np.split(audio, np.cumsum(window_lengths)[:-1])
+
+
+def load_audio(track_key, analysis_windows, window_seconds):
+    # Returns the stored samples (a list of windows for windowed analysis), or
+    # None when the track is not stored for this analysis budget
+    with _lock:
+        conn = get_manifest()
+        row = conn.execute("""
+            SELECT blob, window_lengths FROM audio
+            WHERE track_key = ? AND analysis_windows = ? AND window_seconds = ?
+        """, (track_key, analysis_windows, window_seconds)).fetchone()
+
+        if row and os.path.exists(get_blob_path(row[0])):
+            conn.execute("UPDATE audio SET last_access = ? WHERE track_key = ?", (time.time(), track_key))
+            conn.commit()
+
+    if not row or not os.path.exists(get_blob_path(row[0])):
+        stats["misses"] += 1
+        return None
+
+    blob, window_lengths = row
+    audio = read_blob(blob)
+    stats["hits"] += 1
+
+    # Windows are split back at the lengths they were stored with
+    if window_lengths:
+        return split_windows(audio, json.loads(window_lengths))
+
+    return audio
+
+
+def store_audio(track_key, audio, analysis_windows, window_seconds):
+    # audio is the decoded samples or a list of windows. Returns them as they
+    # were stored, which is what the caller should analyse.
+    blob = hashlib.sha1(track_key.encode()).hexdigest()
+    path = get_blob_path(blob)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    lengths = [len(window) for window in audio] if isinstance(audio, list) else None
+    window_lengths = json.dumps(lengths) if lengths else None
+
+    with Metrics.timed("audio store write") as measurement:
+        samples = to_int16(np.concatenate(audio) if lengths else audio)
+        np.savez_compressed(path, audio=samples)
+        measurement["bytes"] = os.path.getsize(path)
+
+    with _lock:
+        conn = get_manifest()
+        conn.execute("""
+            INSERT OR REPLACE INTO audio (track_key, blob, analysis_windows, window_seconds, window_lengths, size_bytes, last_access)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (track_key, blob, analysis_windows, window_seconds, window_lengths, os.path.getsize(path), time.time()))
+        conn.commit()
+
+        evict(MAX_STORE_BYTES)
+
+    stats["stores"] += 1
+    audio = from_int16(samples)
+
+    return split_windows(audio, lengths) if lengths else audio
+
+
+def evict(max_bytes):
+    # Called with the manifest lock held
+    conn = get_manifest()
+    total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM audio").fetchone()[0]
+
+    if total <= max_bytes:
+        return
+
+    for track_key, blob, size_bytes in conn.execute("SELECT track_key, blob, size_bytes FROM audio ORDER BY last_access").fetchall():
+        if total <= max_bytes:
+            break
+
+        path = get_blob_path(blob)
+        if os.path.exists(path):
+            os.remove(path)
+
+        conn.execute("DELETE FROM audio WHERE track_key = ?", (track_key,))
+        total -= size_bytes
+        stats["evictions"] += 1
+
+    conn.commit()
+
+
+def delete_intermediates(paths):
+    for path in paths:
+        if os.path.exists(path):
+            stats["bytes_freed"] += os.path.getsize(path)
+            os.remove(path)
+            stats["intermediates_deleted"] += 1
+
+
+def print_store_stats():
+    with _lock:
+        stored, stored_bytes = get_manifest().execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM audio").fetchone()
+
+    print(f"Audio store: {stats['hits']} hits, {stats['misses']} misses, {stats['stores']} stored, "
+          f"{stats['evictions']} evicted, {stored} tracks in {stored_bytes / 1024 / 1024:.0f} MB; "
+          f"{stats['intermediates_deleted']} intermediate files deleted ({stats['bytes_freed'] / 1024 / 1024:.0f} MB)")
@@ -0,0 +1,293 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+import numpy as np
+import Embedding_Cache
+import Metrics
+from Model_Registry import EMBEDDING_MODEL, PREDICTION_MODELS, load_models, load_times
+
+
+# Offline, CPU-only benchmark of the feature extractor on deterministic
+# synthetic audio. It times model loading, ffmpeg and MonoLoader decoding, the
+# effnet embedding and each prediction head, compares the batched embedding
+# path against the stock TensorflowPredictEffnetDiscogs model (speed and
+# largest difference), then tracks/second with 1..N worker processes, and
+# saves the results to BenchmarkResults/ so runs from different commits can be
+# compared. The embedding cache is pointed at an empty directory for every
+# measurement, so nothing is served from it.
+#
+#   python Benchmark_Features.py [max workers] [previous results file]
+
+RESULTS_DIRECTORY = "BenchmarkResults"
+FIXTURE_DIRECTORY = os.path.join(RESULTS_DIRECTORY, "fixtures")
+
+# Fixtures are written like a typical download: 44.1 kHz 16-bit, so both
+# decoders also resample
+FIXTURE_RATE = 44100
+
+# (kind, seconds)
+FIXTURES = [
+    ("tone", 30),
+    ("noise", 30),
+    ("silence", 30),
+    ("chord", 60),
+    ("noise", 120),
+    ("chord", 180),
+    ("tone", 300),
+]
+
+# Each worker count scores this many copies of the fixture set
+THROUGHPUT_REPEATS = 2
+
+
+def make_fixture(kind, seconds, seed):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * FIXTURE_RATE)) / FIXTURE_RATE
+
+    if kind == "silence":
+        audio = np.zeros_like(t)
+
+    elif kind == "noise":
+        audio = 0.1 * rng.standard_normal(len(t))
+
+    elif kind == "tone":
+        # A slowly swept tone with a few harmonics
+        frequency = 220 + 110 * np.sin(2 * np.pi * t / 20)
+        phase = 2 * np.pi * np.cumsum(frequency) / FIXTURE_RATE
+        audio = 0.3 * sum(np.sin(phase * harmonic) / harmonic for harmonic in range(1, 5))
+
+    else:
+        # A new random three-note chord every two seconds
+        notes = rng.uniform(110, 880, size=(int(seconds / 2) + 1, 3))[(t // 2).astype(int)]
+        audio = 0.2 * np.sin(2 * np.pi * notes * t[:, np.newaxis]).sum(axis=1)
+
+    return np.clip(audio, -1, 1)
+
+
+def write_fixtures():
+    os.makedirs(FIXTURE_DIRECTORY, exist_ok=True)
+    paths = []
+
+    for seed, (kind, seconds) in enumerate(FIXTURES):
+        path = os.path.join(FIXTURE_DIRECTORY, f"{seed:02d}_{kind}_{seconds}s.wav")
+
+        if not os.path.exists(path):
+            samples = (make_fixture(kind, seconds, seed) * 32767).astype(np.int16)
+
+            with wave.open(path, "wb") as file:
+                file.setnchannels(1)
+                file.setsampwidth(2)
+                file.setframerate(FIXTURE_RATE)
+                file.writeframes(samples.tobytes())
+
+        paths.append(path)
+
+    return paths
+
+
+def get_missing_models():
+    graph_files = [EMBEDDING_MODEL["graphFilename"]] + [model["graphFilename"] for model in PREDICTION_MODELS.values()]
+
+    return [graph_file for graph_file in graph_files if not os.path.exists(graph_file)]
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def get_peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_worker_peak_rss_mb(delay):
+    # Runs as a task in a pool worker and returns its pid and VmHWM. Each pool
+    # is new, so that is the worker's peak during this run only. The delay
+    # keeps one worker from taking every task.
+    time.sleep(delay)
+
+    with open("/proc/self/status") as file:
+        peak_kb = next(int(line.split()[1]) for line in file if line.startswith("VmHWM:"))
+
+    return os.getpid(), peak_kb / 1024
+
+
+def summarize(latencies):
+
+    return {"calls": len(latencies), "total": round(sum(latencies), 4),
+            "mean": round(sum(latencies) / len(latencies), 4), "max": round(max(latencies), 4)}
+
+
+def run_in_process(paths):
+    from Audio_Features import decode_audio, get_batch_embeddings, load_audio, score_heads
+
+    results = {}
+
+    start = time.perf_counter()
+    load_models()
+    results["model_loading"] = {"total": round(time.perf_counter() - start, 4),
+                                "models": {name: round(seconds, 4) for name, seconds in load_times.items()}}
+
+    Metrics.take()
+    audio_seconds = 0.0
+
+    for path in paths:
+        audio = decode_audio(path)
+        load_audio(path)
+        audio_seconds += len(audio) / 16000
+
+        # Includes the mel patches, which the "effnet embedding" step does not
+        with Metrics.timed("embedding with mel patches"):
+            embeddings = get_batch_embeddings([audio])[0]
+
+        if len(embeddings):
+            score_heads(embeddings)
+
+    # Per-step latencies come from the same instrumentation as an ingest run
+    steps = {name: summarize(latencies) for name, (latencies, bytes_moved) in Metrics.take().items()}
+    results["steps"] = steps
+    results["audio_seconds"] = round(audio_seconds, 1)
+    # The path a worker takes per track: ffmpeg decode, embedding and heads
+    track_seconds = sum(step["total"] for name, step in steps.items()
+                        if name in ("ffmpeg decode", "embedding with mel patches") or name.startswith("head "))
+    results["realtime_factor"] = round(audio_seconds / track_seconds, 2)
+    results["peak_rss_mb"] = round(get_peak_rss_mb(), 1)
+
+    return results
+
+
+def run_embedding_paths(paths):
+    # Before and after batching: the stock model one track at a time, then the
+    # mel patches of every fixture packed into shared batches
+    from Audio_Features import decode_audio, get_batch_embeddings, get_stock_embeddings
+
+    audio_list = [decode_audio(path) for path in paths]
+
+    start = time.perf_counter()
+    stock = get_stock_embeddings(audio_list)
+    stock_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = get_batch_embeddings(audio_list)
+    batched_seconds = time.perf_counter() - start
+
+    differences = {os.path.basename(path): float(np.abs(a - b).max()) if a.shape == b.shape and a.size else None
+                   for path, a, b in zip(paths, stock, batched)}
+    Metrics.take()
+
+    return {"stock_seconds": round(stock_seconds, 4), "batched_seconds": round(batched_seconds, 4),
+            "max_abs_diff": differences}
+
+
+def run_throughput(paths, max_workers):
+    from Feature_Workers import create_pool, score_files
+
+    tracks = paths * THROUGHPUT_REPEATS
+    results = {}
+
+    for worker_count in range(1, max_workers + 1):
+        # Spawned workers read the cache location from the environment
+        with tempfile.TemporaryDirectory() as cache_directory:
+            os.environ["OSTVAULT_EMBEDDING_CACHE"] = cache_directory
+
+            # Model loading happens in the initializer and is not counted
+            pool = create_pool(worker_count, 1)
+            pool.map(time.sleep, [0.5] * worker_count, chunksize=1)
+
+            start = time.perf_counter()
+            failed = sum(features == -1 for index, features in score_files(tracks, pool, worker_count))
+            seconds = time.perf_counter() - start
+            peaks = dict(pool.map(get_worker_peak_rss_mb, [0.5] * worker_count, chunksize=1))
+            peak_worker_rss_mb = max(peaks.values())
+
+            pool.close()
+            pool.join()
+
+        results[str(worker_count)] = {"tracks": len(tracks), "failed": failed, "seconds": round(seconds, 3),
+                                      "tracks_per_second": round(len(tracks) / seconds, 3),
+                                      "peak_worker_rss_mb": round(peak_worker_rss_mb, 1)}
+
+        print(f"{worker_count} workers: {len(tracks) / seconds:.2f} tracks/s")
+
+    return results
+
+
+def print_results(results, previous=None):
+    print(f"\nCommit {results['commit']}, {results['cpu_count']} CPUs")
+    print(f"Model loading: {results['in_process']['model_loading']['total']:.2f}s")
+    print(f"Peak RSS: {results['in_process']['peak_rss_mb']:.0f} MB in process")
+    print(f"Realtime factor: {results['in_process']['realtime_factor']:.1f}x")
+
+    paths = results["embedding_paths"]
+    differences = [difference for difference in paths["max_abs_diff"].values() if difference is not None]
+    print(f"Embedding: stock model {paths['stock_seconds']:.2f}s, batched {paths['batched_seconds']:.2f}s, "
+          f"max abs diff {max(differences, default=0):.2g}\n")
+
+    def change(current, before):
+        return f"{(current - before) / before * 100:+.1f}%" if before else ""
+
+    print(f"{'Step':<28} {'Calls':>6} {'Mean ms':>9} {'Total s':>9} {'vs before':>10}")
+
+    for name, step in sorted(results["in_process"]["steps"].items()):
+        before = previous["in_process"]["steps"].get(name, {}).get("mean") if previous else None
+        print(f"{name:<28} {step['calls']:>6} {step['mean'] * 1000:>9.1f} {step['total']:>9.2f} {change(step['mean'], before):>10}")
+
+    print(f"\n{'Workers':<8} {'Tracks/s':>9} {'Peak RSS MB':>12} {'vs before':>10}")
+
+    for worker_count, run in results["throughput"].items():
+        before = previous["throughput"].get(worker_count, {}).get("tracks_per_second") if previous else None
+        print(f"{worker_count:<8} {run['tracks_per_second']:>9.2f} {run['peak_worker_rss_mb']:>12.0f} "
+              f"{change(run['tracks_per_second'], before):>10}")
+
+
+if __name__ == "__main__":
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+    previous_file = sys.argv[2] if len(sys.argv) > 2 else None
+
+    missing = get_missing_models()
+
+    if missing:
+        print("Missing model graphs: " + ", ".join(missing))
+        sys.exit(1)
+
+    os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+    Metrics.METRICS_FILE = os.path.join(RESULTS_DIRECTORY, "metrics.jsonl")
+    paths = write_fixtures()
+
+    with tempfile.TemporaryDirectory() as cache_directory:
+        Embedding_Cache.CACHE_DIRECTORY = cache_directory
+        in_process = run_in_process(paths)
+        embedding_paths = run_embedding_paths(paths)
+
+    results = {
+        "commit": get_commit(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "cpu_count": os.cpu_count(),
+        "fixtures": [os.path.basename(path) for path in paths],
+        "in_process": in_process,
+        "embedding_paths": embedding_paths,
+        "throughput": run_throughput(paths, max_workers),
+    }
+
+    results_file = os.path.join(RESULTS_DIRECTORY, f"{time.strftime('%Y%m%d-%H%M%S')}-{results['commit']}.json")
+
+    with open(results_file, "w") as file:
+        json.dump(results, file, indent=2)
+
+    previous = None
+
+    if previous_file:
+        with open(previous_file) as file:
+            previous = json.load(file)
+
+    print_results(results, previous)
+    print(f"\nSaved {results_file}")
@@ -1,50 +1,46 @@
-import sqlite3
-import requests
+import asyncio
 import json
-import base64
+import logging
+import math
+import sys
+from Db_Writer import connect, upsert, upsert_name
+from Schema_Migrations import migrate
+from Album_Matcher import add_reviews, create_review_table, get_pending_reviews, match_album, print_match_stats, set_review_status
+from Http_Client import get_spotify_token, print_stats, rawg_get, set_rawg_key, set_spotify_credentials, spotify_get
 
 with open('API_KEYS.json', 'r') as file:
     keys = json.load(file)
 
+log = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
 rawg_key = keys['rawg']
 spotify_client_id = keys['spotify_id']
 spotify_client_secret = keys['spotify_secret']
-spotify_key = ""
+set_rawg_key(rawg_key)
 
 genres = ['Action', 'Indie', 'Adventure', 'RPG', 'Strategy', 'Shooter', 'Casual', 
           'Simulation', 'Puzzle', 'Arcade', 'Platformer', 'Massively_Multiplayer', 'Racing', 
           'Sports', 'Fighting', 'Family', 'Board_Games', 'Card', 'Educational']
 
-conn = sqlite3.connect("games.db")
+# RAWG games per page, and how many RAWG/Spotify requests the crawl keeps in flight
+PAGE_SIZE = 30
+CRAWL_CONCURRENCY = 8
+
+conn = connect()
 cursor = conn.cursor()
 
 
 def get_access_token(client_id, client_secret):
-    auth_url = 'https://accounts.spotify.com/api/token'
-    auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+    # The shared client caches the token and refreshes it before it expires
+    set_spotify_credentials(client_id, client_secret)
 
-    headers = {
-        'Authorization': f'Basic {auth_header}'
-    }
-
-    data = {
-        'grant_type': 'client_credentials'
-    }
-
-    response = requests.post(auth_url, headers=headers, data=data)
-    
-    if response.status_code == 200:
-        return response.json()['access_token']
-    else:
-        raise Exception(f"Failed to get token: {response.status_code}, {response.text}")
+    return get_spotify_token()
 
 
 
-def search_album(game_title, limit=20):
+def fetch_album_candidates(game_title, limit=20):
     query = game_title + " soundtrack"
-    headers = {
-        'Authorization': f'Bearer {spotify_key}'
-    }
     
     params = {
         'q': query,
@@ -52,28 +48,35 @@ def search_album(game_title, limit=20):
         'limit': limit
     }
 
-    response = requests.get('https://api.spotify.com/v1/search', headers=headers, params=params)
+    response = spotify_get('/search', params=params)
 
-    inc = 0
-    album_list = []
-    print("Game: " + game_title)
     if response.status_code == 200:
-        for album in response.json()['albums']['items']:
-            print(f"{inc}:{album['name']}")
-            album_list.append(album)
-            inc += 1
-    else:
-        print(f"Search failed: {response.status_code}")
-        print(response.text)
-    
-    user_input = input("Enter number of album or -1 if correct album wasn't found (will be skipped): ")
+        return response.json()['albums']['items']
 
-    if user_input == "-1":
-        return None
+    log.warning(f"Search failed for {game_title}: {response.status_code}")
+    log.debug(response.text)
+    return []
+
+
+def choose_album(game, album_list):
+    # Returns the matched album data, or the ranked candidates when the match
+    # is too close to call and needs a review
+    decision, ranked = match_album(game['name'], game.get('released'), album_list)
+
+    if decision == "accept":
+        print(f"Matched {game['name']} to {ranked[0]['name']} ({ranked[0]['score']:.2f})")
+        return ranked[0], None
+
+    if decision == "review":
+        return None, ranked
+
+    return None, None
+
+
+def search_album(game, limit=20):
+
+    return choose_album(game, fetch_album_candidates(game['name'], limit))
 
-    else:
-        album_data = {'name': album_list[int(user_input)]['name'], 'artist': ', '.join([artist['name'] for artist in album_list[int(user_input)]['artists']]), 'link':album_list[int(user_input)]['external_urls']['spotify']}
-        return album_data
 
 def get_genre_list(game):
     raw_genres = game['genres']
@@ -156,203 +159,212 @@ def setup_tables(conn, cursor):
 
 def get_developer_id(dev_name, conn, cursor):
     
-    url = "https://api.rawg.io/api/developers"
-
     params = {
-            "key":rawg_key,
             "search":dev_name,
             "page_size":1
         }
 
-    response = requests.get(url, params=params)
-    print(response)
+    response = rawg_get("/developers", params=params)
     data = response.json()
-    print(data)
 
     if data['results']:
+        upsert_name(conn, "developer", "developer_name", dev_name)
+        conn.commit()
 
-        query = "SELECT id FROM developer WHERE developer_name = ?"
-        cursor.execute(query, (dev_name,))
-        result = cursor.fetchone()
-
-        if result:
-            print(f"{dev_name} already exists in database")
-            return data['results'][0]['id']
-
-        else:
-            query = f"""
-                INSERT INTO developer
-                (
-                    developer_name
-                )
-                VALUES
-                (   
-                    ?
-                )
-            """
-
-            values = (dev_name,)
-            cursor.execute(query, values)
-            conn.commit()
-
-            return data['results'][0]['id']
+        return data['results'][0]['id']
     
     else:
         print(f"Unable to find dev id for {dev_name}")
         return
 
 
-def insert_artist(album_data, conn, cursor):
-    artist_name = album_data['artist']
+def insert_artists(album_list, conn):
+    rows = [{"artist_name": album_data['artist']} for album_data in album_list]
 
-    query = "SELECT id FROM artist WHERE artist_name = ?"
-    cursor.execute(query, (artist_name,))
-    result = cursor.fetchone()
+    return upsert(conn, "artist", "artist_name", rows)
 
-    if result:
-        print(f"Artist {album_data['artist']} already exists in database")
-        artist_id = result[0]
-    
-    else:
-        query = """
-            INSERT INTO artist(
-                artist_name
-            )
 
-            VALUES(
-                ?
-            )
-        """
+def insert_albums(album_list, conn):
+    # album_list holds (album_data, game_id, artist_id)
+    rows = [
+        {
+            "album_title": album_data['name'],
+            "artist_id": artist_id,
+            "game_id": game_id,
+            "spotify_link": album_data['link'],
+            "songs_processed": 0
+        }
+        for album_data, game_id, artist_id in album_list
+    ]
 
-        values = (album_data['artist'],)
-        cursor.execute(query, values)
-        conn.commit
+    return upsert(conn, "album", "album_title", rows)
 
-        query = f""" SELECT id FROM artist WHERE artist_name = ?"""
-        cursor.execute(query, (album_data['artist'],))
-        artist_id = cursor.fetchone()[0]
 
-    return artist_id
+def insert_games(game_list, dev_id, conn):
+    rows = []
 
+    for game in game_list:
+        row = {"developer_id": dev_id, "game_title": game['name'], "release_date": game['released']}
+        row.update(zip(genres, get_genre_list(game)))
+        rows.append(row)
 
-def insert_album(album_data, game_id, artist_id, conn, cursor):
-    query = f"""SELECT id FROM album WHERE album_title = ?"""
-    cursor.execute(query, (album_data['name'],))
-    result = cursor.fetchone()
+    return upsert(conn, "game", "game_title", rows)
 
-    if result:
-        print(f"Album {album_data['name']} already exists in database")
-        album_id = result[0]
 
-    else:
-        query = """
-            INSERT INTO album(
-                album_title, artist_id, game_id, spotify_link, songs_processed
-                )
-
-            VALUES(
-                ?, ?, ?, ?, ?
-                )
-        """
-        values = (album_data['name'], artist_id, game_id, album_data['link'], 0)
-        cursor.execute(query, values)
-        conn.commit()
+def fetch_games_page(dev_id, page):
+    params = {
+            "page":page,
+            "developers":dev_id,
+            "page_size": PAGE_SIZE,
+            "ordering":"-added"
+    }
 
-        query = f"""SELECT id FROM album WHERE album_title = ?"""
-        cursor.execute(query, (album_data['name'],))
-        album_id = cursor.fetchone()[0]
+    response = rawg_get("/games", params=params)
 
-    return album_id
+    return response.json()
 
 
-def insert_game(game_title, release_date, genre_list, dev_id, conn, cursor):
-    query = f"""
-    SELECT id FROM game WHERE game_title = ?
-    """
-    cursor.execute(query, (game_title,))
-    result = cursor.fetchone()
+async def crawl_games(dev_id, max_pages=None):
+    # Blocking requests run in threads on the shared pooled session, at most
+    # CRAWL_CONCURRENCY at a time
+    semaphore = asyncio.Semaphore(CRAWL_CONCURRENCY)
 
-    if result:
-        print(f"{game_title} already exists in database")
-        game_id = result[0]
+    async def limited(function, *args):
+        async with semaphore:
+            return await asyncio.to_thread(function, *args)
 
-    else:
+    # The first page says how many pages there are, the rest are fetched together
+    first_page = await limited(fetch_games_page, dev_id, 1)
+    page_count = math.ceil(first_page.get('count', 0) / PAGE_SIZE)
 
-        query = f"""
-        INSERT INTO game
-        (   
-            developer_id, game_title, release_date, {','.join(genres)}
-        )
-        VALUES
-        (
-            ?, ?, ?, {', '.join(['?'] * len(genres))}
-        )
-        """
+    if max_pages:
+        page_count = min(page_count, max_pages)
 
-        values = (dev_id, game_title, release_date, *genre_list)
-        cursor.execute(query, values)
-        conn.commit()
+    # A request that still fails after its retries only loses its own page
+    # or game, the rest of the crawl carries on
+    pages = [first_page]
+
+    results = await asyncio.gather(*[limited(fetch_games_page, dev_id, page) for page in range(2, page_count + 1)],
+                                   return_exceptions=True)
 
-        query = f"""
-        SELECT id FROM game WHERE game_title = ?
-        """
-        cursor.execute(query, (game_title,))
-        game_id = cursor.fetchone()[0]
+    for page, result in enumerate(results, start=2):
+        if isinstance(result, Exception):
+            log.warning(f"Skipping page {page} of developer {dev_id}: {result}")
+        else:
+            pages.append(result)
 
-    return game_id
+    found = [game for page in pages for game in page.get('results', [])]
+    games = []
+    candidates = []
 
+    # Every game's soundtrack candidates are ready before matching starts
+    results = await asyncio.gather(*[limited(fetch_album_candidates, game['name']) for game in found], return_exceptions=True)
 
-def get_game_data(dev_id, dev_name, conn, cursor, max_pages=1):
+    for game, result in zip(found, results):
+        if isinstance(result, Exception):
+            log.warning(f"Skipping {game['name']}: album search failed ({result})")
+        else:
+            games.append(game)
+            candidates.append(result)
 
-    url = "https://api.rawg.io/api/games"
+    return games, candidates
 
-    query = f"""
-        SELECT Id FROM developer WHERE developer_name = ?
-    """
 
-    cursor.execute(query, (dev_name,))
-    result = cursor.fetchone()
+def get_game_data(dev_id, dev_name, conn, cursor, max_pages=None):
+    dev_sql_id = upsert_name(conn, "developer", "developer_name", dev_name)
 
-    if result:
-        dev_sql_id = result[0]
-    
-    else:
-        print(f"Unable to find {dev_name} in developers table")
-
-    for page in range(1, max_pages + 1):
-        params = {
-                "key":rawg_key,
-                "page":page,
-                "developers":dev_id,
-                "page_size": 30,
-                "ordering":"-added"
-        }
+    games, candidates = asyncio.run(crawl_games(dev_id, max_pages))
+    print(f"Fetched {len(games)} games for {dev_name}")
+
+    for start in range(0, len(games), PAGE_SIZE):
+        matches = []
+        reviews = []
+
+        for game, album_list in zip(games[start:start + PAGE_SIZE], candidates[start:start + PAGE_SIZE]):
+            album_data, ranked = choose_album(game, album_list)
+
+            if album_data:
+                matches.append((game, album_data))
+            elif ranked:
+                reviews.append((game, dev_sql_id, ranked))
+            else:
+                print(f"Unable to find album data for {game['name']}")
 
-        response = requests.get(url, params=params)
-        data = response.json()
+        # A page of games, their artists and their albums are committed
+        # together, with one upsert statement per table
+        with conn:
+            insert_matches(matches, dev_sql_id, conn)
+            add_reviews(conn, reviews)
 
-        games = data['results']
+    print_match_stats()
 
-        for game in games:
-            game_title = game['name']
-            release_date = game['released']
-            genre_list = get_genre_list(game)
-            album_data = search_album(game_title)
 
-            if not album_data:
-                print(f"Unable to find album data for {game_title}")
+def insert_matches(matches, dev_id, conn):
+    # matches holds (RAWG game, album data)
+    if not matches:
+        return
+
+    game_ids = insert_games([game for game, album_data in matches], dev_id, conn)
+    artist_ids = insert_artists([album_data for game, album_data in matches], conn)
+    insert_albums([(album_data, game_ids[game['name']], artist_ids[album_data['artist']])
+                   for game, album_data in matches], conn)
+
+
+def get_review_choice(candidates):
+    # Asks until the answer is a listed album, -1 or nothing (the top match)
+    while True:
+        user_input = input("Enter number of album, -1 if correct album wasn't found, or nothing for the top match: ").strip()
+
+        if not user_input:
+            return 0
+
+        try:
+            chosen = int(user_input)
+        except ValueError:
+            chosen = None
+
+        if chosen is not None and -1 <= chosen < len(candidates):
+            return chosen
+
+        print(f"Please enter a number from -1 to {len(candidates) - 1}")
+
+
+def resolve_reviews(conn):
+    # Each decision is written as soon as it is made, so stopping part way
+    # keeps the games already settled
+    reviews = get_pending_reviews(conn)
+    print(f"{len(reviews)} games to review")
+
+    for review in reviews:
+        print("Game: " + review['game']['name'] + f" ({review['game'].get('released')})")
+
+        for inc, album_data in enumerate(review['candidates']):
+            print(f"{inc}:{album_data['name']} ({album_data['score']:.2f})")
+
+        chosen = get_review_choice(review['candidates'])
+
+        with conn:
+            if chosen == -1:
+                set_review_status(conn, [("rejected", None, review['id'])])
                 continue
 
-            game_id = insert_game(game_title, release_date, genre_list, dev_sql_id, conn, cursor)
-            artist_id = insert_artist(album_data, conn, cursor)  
-            album_id = insert_album(album_data, game_id, artist_id, conn, cursor)
-            
+            insert_matches([(review['game'], review['candidates'][chosen])], review['developer_id'], conn)
+            set_review_status(conn, [("accepted", chosen, review['id'])])
 
-spotify_key = get_access_token(spotify_client_id, spotify_client_secret)
+
+get_access_token(spotify_client_id, spotify_client_secret)
 dev_name = "Capcom"
 setup_tables(conn, cursor)
-dev_id = get_developer_id(dev_name, conn, cursor)
-get_game_data(dev_id, dev_name, conn, cursor)
+create_review_table(conn)
+migrate(conn)
+
+# --review settles the games the matcher could not decide on by itself
+if "--review" in sys.argv:
+    resolve_reviews(conn)
+else:
+    dev_id = get_developer_id(dev_name, conn, cursor)
+    get_game_data(dev_id, dev_name, conn, cursor)
 
 conn.close()
+print_stats()
 
@@ -0,0 +1,121 @@
+import sqlite3
+import Metrics
+
+
+# games.db is opened in WAL mode so analytics queries can read while an ingest
+# is writing, and song rows are written a whole album per transaction so each
+# album costs one commit instead of one per song, together with the album's
+# track job states.
+#
+# Developers, games, artists and albums are written with single-statement
+# upserts that return their ids, so there is no SELECT/INSERT/SELECT round
+# trip and two ingesters cannot race between the check and the insert. Ids
+# seen this run are kept in memory.
+
+DATABASE_FILE = "games.db"
+
+# Stay well under SQLite's limit on bound parameters per statement
+MAX_VARIABLES = 32000
+
+_id_cache = {}
+
+SONG_COLUMNS = [
+    "song_name",
+    "song_genre",
+    "approachability_score",
+    "engagement_score",
+    "danceability_score",
+    "aggressiveness_score",
+    "happiness_score",
+    "party_score",
+    "relaxed_score",
+    "saddness_score",
+    "electronic_score",
+    "acoustic_score",
+    "album_id",
+    "game_id",
+    "artist_id",
+    "popularity_score",
+]
+
+
+def connect(path=DATABASE_FILE, check_same_thread=True):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=check_same_thread)
+
+    conn.execute("PRAGMA journal_mode = WAL")
+    # In WAL mode NORMAL only syncs at checkpoints and is still crash safe
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA cache_size = -65536")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA foreign_keys = ON")
+
+    return conn
+
+
+def write_songs(conn, song_rows, job_states, album_id=None):
+    # Songs, the final state of their track jobs and, once its last track is
+    # in, the album's processed flag are committed together. job_states holds
+    # rows from Track_Jobs.get_job_state.
+    query = f"""
+        INSERT INTO song ({', '.join(SONG_COLUMNS)})
+        VALUES ({', '.join(['?'] * len(SONG_COLUMNS))})
+    """
+
+    with Metrics.timed("sqlite write"), conn:
+        conn.executemany(query, song_rows)
+        conn.executemany("""
+            UPDATE track_job SET state = ?, reason = ?, updated_at = ?,
+                video_url = COALESCE(?, video_url), duration = COALESCE(?, duration), files = COALESCE(?, files),
+                windowed = COALESCE(?, windowed), source_song_id = COALESCE(?, source_song_id)
+            WHERE id = ?
+        """, job_states)
+
+        if album_id is not None:
+            conn.execute("UPDATE album SET songs_processed = ? WHERE id = ?", (1, album_id))
+
+
+def upsert(conn, table, key_column, rows):
+    # rows are dicts of column -> value sharing the same columns. Returns
+    # {key: id} for every row, whether it was inserted now or already existed.
+    ids = {}
+    new_rows = {}
+
+    for row in rows:
+        key = row[key_column]
+
+        if (table, key) in _id_cache:
+            ids[key] = _id_cache[(table, key)]
+        else:
+            new_rows.setdefault(key, row)
+
+    if not new_rows:
+        return ids
+
+    columns = list(next(iter(new_rows.values())))
+    placeholders = f"({', '.join(['?'] * len(columns))})"
+    chunk_size = max(1, MAX_VARIABLES // len(columns))
+    new_rows = list(new_rows.values())
+
+    for start in range(0, len(new_rows), chunk_size):
+        chunk = new_rows[start:start + chunk_size]
+
+        # The no-op update makes RETURNING report rows that already existed
+        query = f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            VALUES {', '.join([placeholders] * len(chunk))}
+            ON CONFLICT({key_column}) DO UPDATE SET {key_column} = excluded.{key_column}
+            RETURNING {key_column}, id
+        """
+
+        values = [row[column] for row in chunk for column in columns]
+
+        for key, row_id in conn.execute(query, values).fetchall():
+            _id_cache[(table, key)] = row_id
+            ids[key] = row_id
+
+    return ids
+
+
+def upsert_name(conn, table, key_column, name):
+
+    return upsert(conn, table, key_column, [{key_column: name}])[name]
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import sqlite3
+import time
+import numpy as np
+
+
+# Embeddings are stored as float32 .npy files named by a hash of the decoded
+# audio, so re-runs and new heads can skip the effnet pass entirely and score
+# exactly what a fresh pass would. A small SQLite index tracks sizes and last
+# access for LRU eviction.
+
+CACHE_DIRECTORY = os.environ.get("OSTVAULT_EMBEDDING_CACHE", "EmbeddingCache")
+MAX_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+_conn = None
+
+
+def get_index():
+    global _conn
+
+    if _conn is None:
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        _conn = sqlite3.connect(os.path.join(CACHE_DIRECTORY, "index.db"), timeout=30)
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding
+            (
+                audio_hash TEXT PRIMARY KEY,
+                size_bytes INTEGER,
+                last_access REAL
+            )
+        """)
+        _conn.commit()
+
+    return _conn
+
+
+def get_audio_hash(audio):
+
+    return hashlib.sha1(np.ascontiguousarray(audio, dtype=np.float32).tobytes()).hexdigest()
+
+
+def get_cache_path(audio_hash):
+
+    return os.path.join(CACHE_DIRECTORY, f"{audio_hash}.npy")
+
+
+def load_embeddings(audio_hash):
+    conn = get_index()
+    path = get_cache_path(audio_hash)
+
+    result = conn.execute("SELECT 1 FROM embedding WHERE audio_hash = ?", (audio_hash,)).fetchone()
+
+    if not result or not os.path.exists(path):
+        stats["misses"] += 1
+        return None
+
+    conn.execute("UPDATE embedding SET last_access = ? WHERE audio_hash = ?", (time.time(), audio_hash))
+    conn.commit()
+    stats["hits"] += 1
+
+    return np.load(path, mmap_mode="r")
+
+
+def store_embeddings(audio_hash, embeddings):
+    conn = get_index()
+    path = get_cache_path(audio_hash)
+
+    np.save(path, np.asarray(embeddings, dtype=np.float32))
+
+    conn.execute("INSERT OR REPLACE INTO embedding (audio_hash, size_bytes, last_access) VALUES (?, ?, ?)",
+                 (audio_hash, os.path.getsize(path), time.time()))
+    conn.commit()
+    stats["stores"] += 1
+
+    evict(MAX_CACHE_BYTES)
+
+
+def evict(max_bytes):
+    conn = get_index()
+    total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM embedding").fetchone()[0]
+
+    if total <= max_bytes:
+        return
+
+    for audio_hash, size_bytes in conn.execute("SELECT audio_hash, size_bytes FROM embedding ORDER BY last_access").fetchall():
+        if total <= max_bytes:
+            break
+
+        path = get_cache_path(audio_hash)
+        if os.path.exists(path):
+            os.remove(path)
+
+        conn.execute("DELETE FROM embedding WHERE audio_hash = ?", (audio_hash,))
+        total -= size_bytes
+        stats["evictions"] += 1
+
+    conn.commit()
+
+
+def print_cache_stats():
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = stats["hits"] / lookups * 100 if lookups else 0
+
+    print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses ({hit_rate:.1f}% hit rate), "
+          f"{stats['stores']} stored, {stats['evictions']} evicted")
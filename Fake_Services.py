@@ -0,0 +1,341 @@
+import hashlib
+import io
+import json
+import random
+import sys
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+
+
+# Local stand-in for RAWG, Spotify and YouTube, so Database_Build.py and
+# Populate_Songs.py can be run end to end without the network and their
+# throughput measured reproducibly. Every response is generated from a hash
+# of the request, so the same crawl always sees the same catalogue. Latency,
+# 5xx errors and 429s can be injected on every route.
+#
+# Point the scripts at it with
+#   OSTVAULT_RAWG_API_URL=http://<host>:<port>/rawg/api
+#   OSTVAULT_SPOTIFY_AUTH_URL=http://<host>:<port>/spotify/api/token
+#   OSTVAULT_SPOTIFY_API_URL=http://<host>:<port>/spotify/v1
+#   OSTVAULT_YOUTUBE_URL=http://<host>:<port>/youtube
+# or let Load_Test.py start it and run both scripts.
+#
+#   python Fake_Services.py [port] [--latency=0.05] [--jitter=0.02] [--error-rate=0.01] [--throttle-rate=0.01]
+#                                  [--games=60] [--tracks=12] [--track-seconds=30] [--seed=0]
+
+DEFAULT_PORT = 8766
+
+options = {
+    "latency": 0.0,         # seconds added to every response
+    "jitter": 0.0,          # up to this many more seconds, at random
+    "error-rate": 0.0,      # share of requests answered with a 503
+    "throttle-rate": 0.0,   # share of requests answered with a 429
+    "retry-after": 1,       # seconds sent with each 429
+    "games": 60,            # games per developer
+    "tracks": 12,           # tracks per soundtrack album
+    "track-seconds": 30,    # length of every served audio file
+    "seed": 0,
+}
+
+# One game in ten has no soundtrack on Spotify, only an unrelated compilation,
+# and another one in ten has two editions too close to call, so the crawl also
+# rejects games and queues them for review
+UNMATCHED_EVERY = 10
+
+AUDIO_RATE = 44100
+
+ADJECTIVES = ["Crimson", "Silent", "Eternal", "Broken", "Hidden", "Iron", "Lost", "Neon", "Savage", "Frozen",
+              "Golden", "Shadow", "Wild", "Final", "Burning", "Hollow", "Radiant", "Sunken", "Steel", "Quiet"]
+NOUNS = ["Kingdom", "Horizon", "Frontier", "Empire", "Legacy", "Odyssey", "Citadel", "Harbor", "Requiem", "Signal",
+         "Orbit", "Dynasty", "Labyrinth", "Vanguard", "Tempest", "Chronicle", "Garden", "Machine", "Voyage", "Summit"]
+TRACK_WORDS = ["Theme", "Battle", "Town", "Dungeon", "Finale", "Prologue", "Boss", "Night", "Escape", "Ending",
+               "Title", "Field", "Castle", "Memories", "Storm", "Awakening", "Credits", "Ruins", "Showdown", "Dawn"]
+GENRES = ["Action", "Indie", "Adventure", "RPG", "Strategy", "Shooter", "Platformer", "Fighting", "Racing", "Puzzle"]
+
+# Requests, injected errors and injected 429s per route
+stats = {}
+
+_stats_lock = threading.Lock()
+_fault_random = random.Random()
+_audio_cache = {}
+_audio_lock = threading.Lock()
+
+
+def get_hash(*parts):
+
+    return int(hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest(), 16)
+
+
+def get_id(*parts, length=22):
+    # Spotify and YouTube style ids: letters and digits only
+
+    return hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()[:length]
+
+
+def get_developer(name):
+
+    return {"id": get_hash("developer", name) % 100000, "name": name, "slug": name.lower().replace(" ", "-")}
+
+
+def get_games(developer_id):
+    rng = random.Random(get_hash("games", developer_id, options["seed"]))
+    titles = rng.sample([f"{adjective} {noun}" for adjective in ADJECTIVES for noun in NOUNS],
+                        min(options["games"], len(ADJECTIVES) * len(NOUNS)))
+
+    return [{"id": developer_id * 1000 + index, "name": title, "released": get_release_date(title),
+             "genres": [{"name": genre} for genre in rng.sample(GENRES, 2)]} for index, title in enumerate(titles)]
+
+
+def get_release_date(title):
+    # Shared by a game and its soundtrack, so the matcher sees matching years
+    value = get_hash("released", title)
+
+    return f"{1990 + value % 34}-{1 + value % 12:02d}-{1 + value % 28:02d}"
+
+
+def get_album(title, name, total_tracks):
+    album_id = get_id("album", name)
+
+    return {"id": album_id, "name": name, "album_type": "album", "total_tracks": total_tracks,
+            "release_date": get_release_date(title),
+            "artists": [{"name": f"{title} Sound Team"}],
+            "external_urls": {"spotify": f"https://open.spotify.com/album/{album_id}"}}
+
+
+def search_albums(query):
+    title = query[:-len(" soundtrack")] if query.endswith(" soundtrack") else query
+    albums = [get_album("Various Artists", f"Greatest Game Hits Vol. {1 + get_hash(title) % 9}", 40)]
+
+    kind = get_hash("soundtrack", title) % UNMATCHED_EVERY
+
+    if kind:
+        albums.insert(0, get_album(title, f"{title} (Original Soundtrack)", options["tracks"]))
+        albums.append(get_album(title, f"{title} Piano Collections", 8))
+
+    if kind == 1:
+        albums.insert(1, get_album(title, f"{title} Original Soundtrack (Deluxe Edition)", options["tracks"]))
+
+    return albums
+
+
+def get_track(album_id, number):
+    track_id = f"{album_id[:18]}t{number:03d}"
+    rng = random.Random(get_hash("track", track_id))
+
+    return {"id": track_id, "name": f"{rng.choice(TRACK_WORDS)} of the {rng.choice(NOUNS)}",
+            "track_number": number, "duration_ms": rng.randint(60, 300) * 1000}
+
+
+def get_full_track(track_id):
+    track = get_track(track_id[:18], int(track_id[19:]))
+    track["popularity"] = get_hash("popularity", track_id) % 100
+    track["external_ids"] = {"isrc": f"QZ{get_hash('isrc', track_id) % 10 ** 10:010d}"}
+
+    return track
+
+
+def get_audio(video_id):
+    # A WAV that yt-dlp downloads directly; each video gets its own chords so
+    # neither the fingerprint nor the embedding cache treats two as copies
+    if video_id not in _audio_cache:
+        rng = np.random.default_rng(get_hash("audio", video_id) % 2 ** 32)
+        t = np.arange(options["track-seconds"] * AUDIO_RATE) / AUDIO_RATE
+        notes = rng.uniform(110, 880, size=(int(options["track-seconds"] / 2) + 1, 3))[(t // 2).astype(int)]
+        audio = 0.2 * np.sin(2 * np.pi * notes * t[:, np.newaxis]).sum(axis=1) + 0.01 * rng.standard_normal(len(t))
+
+        buffer = io.BytesIO()
+
+        with wave.open(buffer, "wb") as file:
+            file.setnchannels(1)
+            file.setsampwidth(2)
+            file.setframerate(AUDIO_RATE)
+            file.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+
+        # Only the most recent files are kept in memory
+        with _audio_lock:
+            if len(_audio_cache) >= 64:
+                _audio_cache.pop(next(iter(_audio_cache)))
+
+            _audio_cache[video_id] = buffer.getvalue()
+
+    return _audio_cache[video_id]
+
+
+def route(path, params):
+    # Returns (status, content type, body) for a GET or POST path
+    def param(name, default=None):
+        return params.get(name, [default])[0]
+
+    if path == "/rawg/api/developers":
+        developer = get_developer(param("search", ""))
+        return 200, "application/json", {"count": 1, "next": None, "results": [developer]}
+
+    if path == "/rawg/api/games":
+        games = get_games(int(param("developers", 0)))
+        page, page_size = int(param("page", 1)), int(param("page_size", 20))
+        results = games[(page - 1) * page_size:page * page_size]
+
+        if not results:
+            return 404, "application/json", {"detail": "Invalid page."}
+
+        return 200, "application/json", {"count": len(games), "next": None, "results": results}
+
+    if path == "/spotify/api/token":
+        return 200, "application/json", {"access_token": get_id("token", time.time()), "token_type": "Bearer",
+                                          "expires_in": 3600}
+
+    if path == "/spotify/v1/search":
+        albums = search_albums(param("q", ""))[:int(param("limit", 20))]
+        return 200, "application/json", {"albums": {"items": albums, "total": len(albums)}}
+
+    if path.startswith("/spotify/v1/albums/") and path.endswith("/tracks"):
+        album_id = path.split("/")[4]
+        limit, offset = int(param("limit", 20)), int(param("offset", 0))
+        numbers = range(offset + 1, min(offset + limit, options["tracks"]) + 1)
+        next_url = f"/spotify/v1/albums/{album_id}/tracks?offset={offset + limit}" if offset + limit < options["tracks"] else None
+
+        return 200, "application/json", {"items": [get_track(album_id, number) for number in numbers],
+                                         "total": options["tracks"], "next": next_url}
+
+    if path == "/spotify/v1/tracks":
+        return 200, "application/json", {"tracks": [get_full_track(track_id) for track_id in param("ids", "").split(",") if track_id]}
+
+    if path == "/youtube/search":
+        query = param("q", "")
+        return 200, "application/json", {"entries": [{"id": get_id("video", query, length=11), "title": query,
+                                                      "duration": options["track-seconds"]}]}
+
+    if path.startswith("/youtube/audio/"):
+        return 200, "audio/wav", get_audio(path.split("/")[-1].split(".")[0])
+
+    return 404, "application/json", {"error": f"unknown path {path}"}
+
+
+def get_route_name(path):
+    # Ids are left out so every album's tracks count as one route
+    parts = path.strip("/").split("/")
+
+    if parts[:3] == ["spotify", "v1", "albums"]:
+        return "/spotify/v1/albums/tracks"
+    if parts[:2] == ["youtube", "audio"]:
+        return "/youtube/audio"
+
+    return path
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def respond(self, include_body=True):
+        url = urlparse(self.path)
+        route_name = get_route_name(url.path)
+
+        if self.headers.get("Content-Length"):
+            self.rfile.read(int(self.headers["Content-Length"]))
+
+        time.sleep(options["latency"] + _fault_random.uniform(0, options["jitter"]))
+
+        roll = _fault_random.random()
+
+        if roll < options["throttle-rate"]:
+            status, content_type, body = 429, "application/json", {"error": "rate limited"}
+        elif roll < options["throttle-rate"] + options["error-rate"]:
+            status, content_type, body = 503, "application/json", {"error": "injected failure"}
+        else:
+            status, content_type, body = route(url.path, parse_qs(url.query))
+
+        with _stats_lock:
+            route_stats = stats.setdefault(route_name, {"requests": 0, "errors": 0, "throttled": 0})
+            route_stats["requests"] += 1
+            route_stats["errors"] += status == 503
+            route_stats["throttled"] += status == 429
+
+        if content_type == "application/json":
+            body = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+
+        if status == 429:
+            self.send_header("Retry-After", str(options["retry-after"]))
+
+        self.end_headers()
+
+        if include_body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def do_HEAD(self):
+        self.respond(include_body=False)
+
+    def log_message(self, format, *args):
+        return
+
+
+def parse_options(args):
+    # --name=value flags override the defaults in options; other arguments are returned
+    rest = []
+
+    for arg in args:
+        name, _, value = arg[2:].partition("=")
+
+        if arg.startswith("--") and name in options:
+            options[name] = type(options[name])(float(value))
+        else:
+            rest.append(arg)
+
+    _fault_random.seed(options["seed"])
+
+    return rest
+
+
+def start(port=0):
+    # Serves from a background thread; port 0 picks a free port
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def get_environment(server):
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    return {
+        "OSTVAULT_RAWG_API_URL": f"{base_url}/rawg/api",
+        "OSTVAULT_SPOTIFY_AUTH_URL": f"{base_url}/spotify/api/token",
+        "OSTVAULT_SPOTIFY_API_URL": f"{base_url}/spotify/v1",
+        "OSTVAULT_YOUTUBE_URL": f"{base_url}/youtube",
+    }
+
+
+def print_service_stats():
+    for route_name, route_stats in sorted(stats.items()):
+        print(f"{route_name}: {route_stats['requests']} requests, {route_stats['errors']} errors injected, "
+              f"{route_stats['throttled']} throttled")
+
+
+if __name__ == "__main__":
+    args = parse_options(sys.argv[1:])
+    port = int(args[0]) if args else DEFAULT_PORT
+
+    server = ThreadingHTTPServer(("", port), FakeHandler)
+    print(f"Serving fake RAWG, Spotify and YouTube on port {port}")
+
+    for name, value in get_environment(server).items():
+        print(f"{name}={value.replace('127.0.0.1', 'localhost')}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print_service_stats()
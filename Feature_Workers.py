@@ -0,0 +1,67 @@
+import math
+import multiprocessing
+import os
+
+
+# Each worker process holds its own warm models. TensorFlow reads its thread
+# counts when the first session is created, so they are set in the initializer
+# before any model is built to keep N workers from oversubscribing the CPU.
+
+WORKER_COUNT = os.cpu_count() or 1
+THREADS_PER_WORKER = 1
+
+
+def init_worker(threads_per_worker):
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(threads_per_worker)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_worker)
+
+    from Model_Registry import load_models
+    load_models()
+
+
+def extract_chunk(job):
+    from Audio_Features import get_batch_audio_features
+    import Embedding_Cache
+    import Metrics
+
+    indices, file_directories = job
+    before = dict(Embedding_Cache.stats)
+    album_features = get_batch_audio_features(file_directories)
+    cache_stats = {key: Embedding_Cache.stats[key] - before[key] for key in before}
+
+    return indices, album_features, cache_stats, Metrics.take()
+
+
+def create_pool(worker_count=WORKER_COUNT, threads_per_worker=THREADS_PER_WORKER):
+    # spawn so workers never inherit a TensorFlow runtime from the parent
+    context = multiprocessing.get_context("spawn")
+
+    return context.Pool(worker_count, initializer=init_worker, initargs=(threads_per_worker,))
+
+
+def score_files(file_directories, pool=None, worker_count=WORKER_COUNT):
+    # Yields (index, track_features) as results arrive so a single writer can
+    # insert them while the remaining chunks are still being scored
+    if pool is None:
+        from Audio_Features import get_batch_audio_features
+        yield from enumerate(get_batch_audio_features(file_directories))
+        return
+
+    import Embedding_Cache
+    import Metrics
+
+    chunk_size = max(1, math.ceil(len(file_directories) / worker_count))
+    jobs = []
+
+    for start in range(0, len(file_directories), chunk_size):
+        indices = list(range(start, min(start + chunk_size, len(file_directories))))
+        jobs.append((indices, [file_directories[i] for i in indices]))
+
+    for indices, album_features, cache_stats, worker_metrics in pool.imap_unordered(extract_chunk, jobs):
+        for key, value in cache_stats.items():
+            Embedding_Cache.stats[key] += value
+
+        Metrics.merge(worker_metrics)
+
+        yield from zip(indices, album_features)
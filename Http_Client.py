@@ -0,0 +1,228 @@
+import base64
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+import Metrics
+import Response_Cache
+
+log = logging.getLogger(__name__)
+
+# One pooled session shared by Database_Build.py and Populate_Songs.py, so
+# connections to RAWG and Spotify are reused across calls and threads.
+# Requests that hit 429, 5xx or a connection error are retried with
+# exponential backoff and jitter, honouring Retry-After when the server sends
+# one, and the Spotify token is refreshed shortly before it expires.
+#
+# The base URLs can be pointed elsewhere, e.g. at Fake_Services.py for load tests.
+
+SPOTIFY_AUTH_URL = os.environ.get("OSTVAULT_SPOTIFY_AUTH_URL", "https://accounts.spotify.com/api/token")
+SPOTIFY_API_URL = os.environ.get("OSTVAULT_SPOTIFY_API_URL", "https://api.spotify.com/v1")
+RAWG_API_URL = os.environ.get("OSTVAULT_RAWG_API_URL", "https://api.rawg.io/api")
+
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+TIMEOUT_SECONDS = 30
+POOL_SIZE = 16
+TOKEN_REFRESH_MARGIN = 60
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+session.mount("http://", HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+
+# Per-host counters: requests sent, retries, failed responses and total seconds
+stats = {}
+
+_stats_lock = threading.Lock()
+_token_lock = threading.Lock()
+_spotify = {"client_id": None, "client_secret": None, "token": None, "expires_at": 0}
+_rawg = {"key": None}
+
+
+def set_rawg_key(key):
+    _rawg["key"] = key
+
+
+def set_spotify_credentials(client_id, client_secret):
+    _spotify["client_id"] = client_id
+    _spotify["client_secret"] = client_secret
+
+
+def record(url, seconds, retried=False, failed=False):
+    host = urlparse(url).netloc
+
+    with _stats_lock:
+        host_stats = stats.setdefault(host, {"requests": 0, "retries": 0, "errors": 0, "seconds": 0.0})
+        host_stats["requests"] += 1
+        host_stats["retries"] += retried
+        host_stats["errors"] += failed
+        host_stats["seconds"] += seconds
+
+
+def get_retry_delay(response, attempt):
+    # None when the server asks for a longer wait than MAX_BACKOFF_SECONDS;
+    # the request then fails instead of holding its thread and connection
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+
+        if retry_after and retry_after.isdigit():
+            return float(retry_after) if float(retry_after) <= MAX_BACKOFF_SECONDS else None
+
+    delay = min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** attempt)
+
+    # Full jitter keeps parallel workers from retrying in lockstep
+    return random.uniform(0, delay)
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault("timeout", TIMEOUT_SECONDS)
+    response = None
+
+    for attempt in range(MAX_RETRIES + 1):
+        start = time.perf_counter()
+
+        try:
+            response = session.request(method, url, **kwargs)
+            error = None
+        except requests.exceptions.RequestException as e:
+            response = None
+            error = e
+
+        retryable = response is None or response.status_code == 429 or response.status_code >= 500
+        seconds = time.perf_counter() - start
+        record(url, seconds, retried=attempt > 0, failed=retryable)
+        Metrics.record(f"http {urlparse(url).netloc}", seconds, len(response.content) if response is not None else 0)
+
+        if not retryable:
+            return response
+
+        if attempt == MAX_RETRIES:
+            break
+
+        delay = get_retry_delay(response, attempt)
+        status = response.status_code if response is not None else error
+
+        if delay is None:
+            log.warning(f"Request to {urlparse(url).netloc} failed ({status}), "
+                        f"Retry-After {response.headers['Retry-After']}s is over {MAX_BACKOFF_SECONDS:.0f}s, giving up")
+            break
+
+        log.warning(f"Request to {urlparse(url).netloc} failed ({status}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+    if response is None:
+        raise error
+
+    return response
+
+
+def build_response(url, status, headers, body):
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body
+
+    return response
+
+
+def cached_get(url, params=None, get_headers=None):
+    # get_headers is only called when the network is actually used, so cache
+    # hits and offline runs never need a Spotify token
+    ttl = Response_Cache.get_ttl(url)
+
+    if ttl is None:
+        return request("GET", url, headers=get_headers() if get_headers else None, params=params)
+
+    cache_key = Response_Cache.get_cache_key(url, params)
+    entry = Response_Cache.lookup(cache_key)
+
+    if entry and (Response_Cache.OFFLINE or Response_Cache.is_fresh(entry, ttl)):
+        Response_Cache.stats["hits"] += 1
+        return build_response(entry["url"], entry["status"], entry["headers"], entry["body"])
+
+    Response_Cache.stats["misses"] += 1
+
+    if Response_Cache.OFFLINE:
+        return build_response(url, 504, {}, b'{"error": "not in response cache (offline mode)"}')
+
+    headers = dict(get_headers() if get_headers else {})
+
+    if entry and entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry["last_modified"]:
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = request("GET", url, headers=headers, params=params)
+
+    if response.status_code == 304 and entry:
+        Response_Cache.touch(cache_key)
+        return build_response(entry["url"], entry["status"], entry["headers"], entry["body"])
+
+    if response.status_code == 200:
+        Response_Cache.store(cache_key, response.url, response.status_code, response.headers, response.content)
+
+    return response
+
+
+def get_spotify_token(force_refresh=False):
+    # Nothing is sent in offline mode, so no token is needed
+    if Response_Cache.OFFLINE:
+        return "offline"
+
+    with _token_lock:
+        if force_refresh or not _spotify["token"] or time.time() >= _spotify["expires_at"] - TOKEN_REFRESH_MARGIN:
+            auth_header = base64.b64encode(f"{_spotify['client_id']}:{_spotify['client_secret']}".encode()).decode()
+
+            headers = {
+                'Authorization': f'Basic {auth_header}'
+            }
+
+            data = {
+                'grant_type': 'client_credentials'
+            }
+
+            response = request("POST", SPOTIFY_AUTH_URL, headers=headers, data=data)
+
+            if response.status_code != 200:
+                raise Exception(f"Failed to get token: {response.status_code}, {response.text}")
+
+            token_data = response.json()
+            _spotify["token"] = token_data['access_token']
+            _spotify["expires_at"] = time.time() + token_data.get('expires_in', 3600)
+
+        return _spotify["token"]
+
+
+def spotify_get(path, params=None):
+    url = path if path.startswith("http") else f"{SPOTIFY_API_URL}{path}"
+
+    response = cached_get(url, params, lambda: {'Authorization': f'Bearer {get_spotify_token()}'})
+
+    # A token revoked early is refreshed once
+    if response.status_code == 401:
+        response = cached_get(url, params, lambda: {'Authorization': f'Bearer {get_spotify_token(force_refresh=True)}'})
+
+    return response
+
+
+def rawg_get(path, params=None):
+    params = dict(params or {})
+    params["key"] = _rawg["key"]
+
+    return cached_get(f"{RAWG_API_URL}{path}", params)
+
+
+def print_stats():
+    Response_Cache.print_cache_stats()
+
+    for host, host_stats in stats.items():
+        average = host_stats["seconds"] / host_stats["requests"] * 1000 if host_stats["requests"] else 0
+        print(f"{host}: {host_stats['requests']} requests, {host_stats['retries']} retries, "
+              f"{host_stats['errors']} errors, {average:.0f} ms average")
@@ -0,0 +1,111 @@
+import queue
+import threading
+import Metrics
+
+
+# Each stage runs in its own worker threads and hands items to the next stage
+# through a bounded queue, so network waits, ffmpeg and inference overlap and a
+# slow stage blocks the ones in front of it instead of letting work pile up.
+#
+# Items are dicts that stage functions fill in place. A stage marks an item it
+# cannot handle by setting item["skip"] to a reason; later stages pass skipped
+# items straight through so the final consumer still sees every item. An item
+# that is finished early (item["done"]) passes through the remaining stages the
+# same way, but is not treated as skipped.
+#
+# If the source itself raises, the items it already produced are still
+# finished, then the error is raised again to the consumer.
+
+_DONE = object()
+
+
+def run_stage(stage, input_queue, output_queue):
+    batch_size = stage.get("batch_size", 1)
+
+    while True:
+        item = input_queue.get()
+
+        if item is _DONE:
+            # Leave the marker for the other workers of this stage
+            input_queue.put(_DONE)
+            return
+
+        batch = [item]
+
+        # Batched stages take whatever else is already waiting, up to batch_size
+        while len(batch) < batch_size:
+            try:
+                item = input_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is _DONE:
+                input_queue.put(_DONE)
+                break
+
+            batch.append(item)
+
+        active = [item for item in batch if not item.get("skip") and not item.get("done")]
+
+        if active:
+            try:
+                with Metrics.timed(f"stage {stage['name']}"):
+                    if batch_size > 1:
+                        stage["function"](active)
+                    else:
+                        stage["function"](active[0])
+
+            except Exception as e:
+                for item in active:
+                    item["skip"] = f"{stage['name']} failed: {e}"
+
+        for item in batch:
+            output_queue.put(item)
+
+
+def run_workers(stage, input_queue, output_queue):
+    workers = [threading.Thread(target=run_stage, args=(stage, input_queue, output_queue), daemon=True)
+               for _ in range(stage.get("workers", 1))]
+
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+    output_queue.put(_DONE)
+
+
+def feed(source, output_queue, failure):
+    try:
+        for item in source:
+            output_queue.put(item)
+
+    except Exception as e:
+        failure.append(e)
+
+    finally:
+        output_queue.put(_DONE)
+
+
+def run_pipeline(source, stages, queue_size=8):
+    # Yields finished items in the calling thread, which makes it the single
+    # place results are consumed (e.g. the only SQLite writer)
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    failure = []
+
+    threading.Thread(target=feed, args=(source, queues[0], failure), daemon=True).start()
+
+    for i, stage in enumerate(stages):
+        threading.Thread(target=run_workers, args=(stage, queues[i], queues[i + 1]), daemon=True).start()
+
+    while True:
+        item = queues[-1].get()
+
+        if item is _DONE:
+            if failure:
+                raise failure[0]
+
+            return
+
+        yield item
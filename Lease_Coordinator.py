@@ -0,0 +1,56 @@
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Db_Writer import connect
+from Schema_Migrations import migrate
+from Work_Leases import ACTIONS, create_lease_table, run_action
+
+
+# Stand-in coordinator for workers on several machines. It owns the album
+# leases in one games.db and serves the lease actions from Work_Leases.py over
+# HTTP, including marking albums the workers finished as processed. Point workers at it with
+# OSTVAULT_COORDINATOR=http://<host>:<port>.
+#
+#   python Lease_Coordinator.py [port] [games.db]
+
+DEFAULT_PORT = 8765
+
+conn = None
+lock = threading.Lock()
+
+
+class LeaseHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        action = self.path.strip("/")
+
+        if action not in ACTIONS:
+            self.send_error(404)
+            return
+
+        with lock:
+            album_ids = run_action(conn, action, payload)
+
+        print(f"{payload['owner']} {action}: {payload.get('album_ids', album_ids)}")
+
+        body = json.dumps({"album_ids": album_ids}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    conn = connect(sys.argv[2] if len(sys.argv) > 2 else "games.db", check_same_thread=False)
+    create_lease_table(conn)
+    migrate(conn)
+
+    print(f"Serving album leases on port {port}")
+    ThreadingHTTPServer(("", port), LeaseHandler).serve_forever()
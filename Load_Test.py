@@ -0,0 +1,153 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+import Fake_Services
+
+
+# End-to-end throughput test without the network. Starts Fake_Services.py,
+# then runs Database_Build.py and Populate_Songs.py against it in a fresh run
+# directory under LoadTestRuns/, and reports games crawled, albums/hour and
+# the steps each script spent the most time in, from the Metrics timings it
+# wrote. Fake service options (latency, error and 429 rates, catalogue size)
+# are passed straight through.
+#
+#   python Load_Test.py [--build-only] [--latency=0.05] [--error-rate=0.01] [--throttle-rate=0.01] [--games=60] ...
+
+RUNS_DIRECTORY = "LoadTestRuns"
+REPOSITORY = os.path.dirname(os.path.abspath(__file__))
+
+# Model graphs are linked into the run directory, which the scripts run from
+MODEL_DIRECTORIES = ["Prediction_Models", "Embedding_Models"]
+
+# Steps listed per phase, slowest first
+TOP_STEPS = 10
+
+
+def prepare_run_directory():
+    run_directory = os.path.join(RUNS_DIRECTORY, time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(run_directory)
+
+    with open(os.path.join(run_directory, "API_KEYS.json"), "w") as file:
+        json.dump({"rawg": "load-test", "spotify_id": "load-test", "spotify_secret": "load-test"}, file)
+
+    for directory in MODEL_DIRECTORIES:
+        if os.path.exists(os.path.join(REPOSITORY, directory)):
+            os.symlink(os.path.join(REPOSITORY, directory), os.path.join(run_directory, directory))
+
+    return run_directory
+
+
+def run_script(script, run_directory, environment):
+    # Returns wall seconds and the exit code; output goes to <script>.log
+    name = os.path.splitext(script)[0]
+    environment = dict(environment, OSTVAULT_METRICS_FILE=f"{name}.metrics.jsonl")
+
+    print(f"Running {script}")
+    start = time.perf_counter()
+
+    with open(os.path.join(run_directory, f"{name}.log"), "w") as log_file:
+        returncode = subprocess.run([sys.executable, os.path.join(REPOSITORY, script)], cwd=run_directory,
+                                    env=environment, stdout=log_file, stderr=subprocess.STDOUT).returncode
+
+    return time.perf_counter() - start, returncode
+
+
+def get_step_totals(metrics_file):
+    # Total seconds, calls and bytes per step from every measurement line
+    steps = {}
+
+    if not os.path.exists(metrics_file):
+        return steps
+
+    with open(metrics_file) as file:
+        for line in file:
+            measurement = json.loads(line)
+
+            if "step" not in measurement:
+                continue
+
+            step = steps.setdefault(measurement["step"], {"calls": 0, "seconds": 0.0, "bytes": 0})
+            step["calls"] += 1
+            step["seconds"] += measurement["seconds"]
+            step["bytes"] += measurement["bytes"]
+
+    return steps
+
+
+def get_counts(database_file):
+    conn = sqlite3.connect(database_file)
+    counts = {}
+
+    for name, query in [("games", "SELECT COUNT(*) FROM game"),
+                        ("albums", "SELECT COUNT(*) FROM album"),
+                        ("albums_processed", "SELECT COUNT(*) FROM album WHERE songs_processed = 1"),
+                        ("songs", "SELECT COUNT(*) FROM song"),
+                        ("reviews", "SELECT COUNT(*) FROM album_review")]:
+        try:
+            counts[name] = conn.execute(query).fetchone()[0]
+        except sqlite3.OperationalError:
+            counts[name] = 0
+
+    conn.close()
+
+    return counts
+
+
+def print_phase(name, phase):
+    print(f"\n{name}: {phase['seconds']:.1f}s (exit code {phase['returncode']})")
+    print(f"{'Step':<36} {'Calls':>7} {'Total s':>9} {'Share':>7}")
+
+    # Steps overlap across pipeline threads, so a share above 100% means
+    # several threads were busy with that step at once
+    for step_name, step in sorted(phase["steps"].items(), key=lambda item: -item[1]["seconds"])[:TOP_STEPS]:
+        print(f"{step_name:<36} {step['calls']:>7} {step['seconds']:>9.1f} {step['seconds'] / phase['seconds'] * 100:>6.0f}%")
+
+
+if __name__ == "__main__":
+    args = Fake_Services.parse_options(sys.argv[1:])
+    build_only = "--build-only" in args
+
+    server = Fake_Services.start()
+    run_directory = prepare_run_directory()
+    environment = dict(os.environ, **Fake_Services.get_environment(server))
+
+    results = {"options": dict(Fake_Services.options), "phases": {}}
+
+    for script in ["Database_Build.py"] + ([] if build_only else ["Populate_Songs.py"]):
+        seconds, returncode = run_script(script, run_directory, environment)
+        steps = get_step_totals(os.path.join(run_directory, f"{os.path.splitext(script)[0]}.metrics.jsonl"))
+        results["phases"][script] = {"seconds": round(seconds, 3), "returncode": returncode, "steps": steps}
+
+    server.shutdown()
+
+    counts = get_counts(os.path.join(run_directory, "games.db"))
+    total_seconds = sum(phase["seconds"] for phase in results["phases"].values())
+    populate = results["phases"].get("Populate_Songs.py")
+
+    results["counts"] = counts
+    results["games_per_hour"] = round(counts["games"] / results["phases"]["Database_Build.py"]["seconds"] * 3600, 1)
+    results["albums_per_hour"] = round(counts["albums_processed"] / populate["seconds"] * 3600, 1) if populate else None
+    results["end_to_end_albums_per_hour"] = round(counts["albums_processed"] / total_seconds * 3600, 1) if populate else None
+    results["fake_services"] = Fake_Services.stats
+
+    with open(os.path.join(run_directory, "report.json"), "w") as file:
+        json.dump(results, file, indent=2)
+
+    for name, phase in results["phases"].items():
+        print_phase(name, phase)
+
+    print()
+    Fake_Services.print_service_stats()
+
+    print(f"\n{counts['games']} games matched to an album, {counts['reviews']} queued for review")
+    print(f"Crawl: {results['games_per_hour']:.0f} games/hour")
+
+    if populate:
+        print(f"{counts['albums_processed']} albums and {counts['songs']} songs processed")
+        print(f"Populate: {results['albums_per_hour']:.1f} albums/hour, "
+              f"end to end: {results['end_to_end_albums_per_hour']:.1f} albums/hour")
+
+    print(f"\nLogs and report in {run_directory}")
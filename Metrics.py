@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Latency, bytes moved and call counts for every step of an ingest run:
+# HTTP calls, YouTube searches and downloads, ffmpeg, MonoLoader, the effnet
+# embedding, each prediction head, SQLite writes and each pipeline stage.
+# Every measurement is appended to METRICS_FILE as one JSON line, and
+# print_summary() ends a run with a table per step.
+#
+# Worker processes measure into their own copy of this module; the parent
+# merges what take() returns from each chunk.
+
+METRICS_FILE = os.environ.get("OSTVAULT_METRICS_FILE", "metrics.jsonl")
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf")]
+
+metrics = {}
+counters = {}
+started_at = time.time()
+
+_lock = threading.Lock()
+_file = None
+
+
+def write_line(line):
+    global _file
+
+    if _file is None:
+        _file = open(METRICS_FILE, "a", buffering=1)
+
+    _file.write(json.dumps(line) + "\n")
+
+
+def add(name, latencies, bytes_moved):
+    step = metrics.setdefault(name, {"latencies": [], "bytes": 0, "buckets": [0] * len(BUCKETS)})
+    step["latencies"].extend(latencies)
+    step["bytes"] += bytes_moved
+
+    for seconds in latencies:
+        step["buckets"][next(i for i, bound in enumerate(BUCKETS) if seconds <= bound)] += 1
+
+
+def record(name, seconds, bytes_moved=0):
+    with _lock:
+        add(name, [seconds], bytes_moved)
+        write_line({"time": time.time(), "pid": os.getpid(), "step": name,
+                    "seconds": round(seconds, 6), "bytes": bytes_moved})
+
+
+@contextmanager
+def timed(name):
+    # The caller may set measurement["bytes"] inside the block
+    measurement = {"bytes": 0}
+    start = time.perf_counter()
+
+    try:
+        yield measurement
+    finally:
+        record(name, time.perf_counter() - start, measurement["bytes"])
+
+
+def count(name, amount=1):
+    with _lock:
+        counters[name] = counters.get(name, 0) + amount
+
+
+def take():
+    # Returns and clears what this process measured, for a worker to hand back
+    with _lock:
+        taken = {name: (step["latencies"], step["bytes"]) for name, step in metrics.items()}
+        metrics.clear()
+
+    return taken
+
+
+def merge(taken):
+    with _lock:
+        for name, (latencies, bytes_moved) in taken.items():
+            add(name, latencies, bytes_moved)
+
+
+def get_percentile(latencies, percentile):
+    ordered = sorted(latencies)
+
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+
+
+def print_summary():
+    elapsed = time.time() - started_at
+    tracks = counters.get("tracks", 0)
+
+    print(f"{'Step':<28} {'Calls':>7} {'Total s':>9} {'Mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'Max ms':>8} {'MB':>8}")
+
+    for name, step in sorted(metrics.items(), key=lambda item: -sum(item[1]["latencies"])):
+        latencies = step["latencies"]
+
+        print(f"{name:<28} {len(latencies):>7} {sum(latencies):>9.1f} {sum(latencies) / len(latencies) * 1000:>9.1f} "
+              f"{get_percentile(latencies, 0.5) * 1000:>8.1f} {get_percentile(latencies, 0.95) * 1000:>8.1f} "
+              f"{max(latencies) * 1000:>8.1f} {step['bytes'] / 1024 / 1024:>8.1f}")
+
+    print(f"{tracks} tracks in {elapsed / 60:.1f} min ({tracks / (elapsed / 60) if elapsed else 0:.1f} tracks/min)")
+
+    for name, value in sorted(counters.items()):
+        if name != "tracks":
+            print(f"{name}: {value}")
+
+    with _lock:
+        write_line({"time": time.time(), "summary": {
+            "elapsed_seconds": round(elapsed, 3),
+            "counters": counters,
+            "steps": {name: {"calls": len(step["latencies"]), "seconds": round(sum(step["latencies"]), 6),
+                             "bytes": step["bytes"], "buckets": dict(zip(map(str, BUCKETS), step["buckets"]))}
+                      for name, step in metrics.items()}
+        }})
@@ -0,0 +1,94 @@
+import time
+from essentia.standard import TensorflowInputMusiCNN, TensorflowPredictEffnetDiscogs, TensorflowPredict2D, TensorflowPredict
+
+
+# Models are built once per process and handed out warm on every call, so a
+# worker only pays the TensorFlow graph setup cost the first time it needs them.
+
+EMBEDDING_MODEL = {"graphFilename": "Embedding_Models/discogs-effnet-bs64-1.pb", "output": "PartitionedCall:1"}
+
+# Same graph driven directly with pre-built mel patches, so patches from many
+# tracks can share one inference batch.
+BATCH_EMBEDDING_MODEL = {"graphFilename": "Embedding_Models/discogs-effnet-bs64-1.pb", "inputs": ["serving_default_melspectrogram"], "outputs": ["PartitionedCall:1"], "squeeze": True}
+
+PREDICTION_MODELS = {
+    "Genre": {"graphFilename": "Prediction_Models/Genre_Predictor.pb", "input": "serving_default_model_Placeholder", "output": "PartitionedCall:0"},
+    "Approachability": {"graphFilename": "Prediction_Models/Approachability_Predictor.pb", "output": "model/Softmax"},
+    "Engagement": {"graphFilename": "Prediction_Models/Engagement_Predictor.pb", "output": "model/Softmax"},
+    "Danceability": {"graphFilename": "Prediction_Models/Danceability_Predictor.pb", "output": "model/Softmax"},
+    "Aggressiveness": {"graphFilename": "Prediction_Models/Aggressiveness_Predictor.pb", "output": "model/Softmax"},
+    "Mood_Happy": {"graphFilename": "Prediction_Models/Mood_Happy_Predictor.pb", "output": "model/Softmax"},
+    "Mood_Party": {"graphFilename": "Prediction_Models/Mood_Party_Predictor.pb", "output": "model/Softmax"},
+    "Mood_Relaxed": {"graphFilename": "Prediction_Models/Mood_Relaxed_Predictor.pb", "output": "model/Softmax"},
+    "Mood_Sad": {"graphFilename": "Prediction_Models/Mood_Sad_Predictor.pb", "output": "model/Softmax"},
+    "Mood_Electronic": {"graphFilename": "Prediction_Models/Mood_Electronic_Predictor.pb", "output": "model/Softmax"},
+    "Mood_Acoustic": {"graphFilename": "Prediction_Models/Mood_Acoustic_Predictor.pb", "output": "model/Softmax"},
+}
+
+_embedding_model = None
+_batch_embedding_model = None
+_mel_bands = None
+_prediction_models = {}
+load_times = {}
+
+
+def get_embedding_model():
+    global _embedding_model
+
+    if _embedding_model is None:
+        start = time.perf_counter()
+        _embedding_model = TensorflowPredictEffnetDiscogs(**EMBEDDING_MODEL)
+        load_times["Embedding"] = time.perf_counter() - start
+
+    return _embedding_model
+
+
+def get_batch_embedding_model():
+    global _batch_embedding_model
+
+    if _batch_embedding_model is None:
+        start = time.perf_counter()
+        _batch_embedding_model = TensorflowPredict(**BATCH_EMBEDDING_MODEL)
+        load_times["Batch_Embedding"] = time.perf_counter() - start
+
+    return _batch_embedding_model
+
+
+def get_mel_bands():
+    # The mel front end the stock effnet model runs internally
+    global _mel_bands
+
+    if _mel_bands is None:
+        _mel_bands = TensorflowInputMusiCNN()
+
+    return _mel_bands
+
+
+def get_prediction_model(name):
+
+    if name not in _prediction_models:
+        start = time.perf_counter()
+        _prediction_models[name] = TensorflowPredict2D(**PREDICTION_MODELS[name])
+        load_times[name] = time.perf_counter() - start
+
+    return _prediction_models[name]
+
+
+def load_models():
+    get_embedding_model()
+    get_batch_embedding_model()
+
+    for name in PREDICTION_MODELS:
+        get_prediction_model(name)
+
+    return load_times
+
+
+def print_load_times():
+    total = 0
+
+    for name, seconds in load_times.items():
+        print(f"Loaded {name} model in {seconds:.2f}s")
+        total += seconds
+
+    print(f"Loaded {len(load_times)} models in {total:.2f}s")
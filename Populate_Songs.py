@@ -1,22 +1,65 @@
-import requests
-import base64
 import json
+import logging
+import sys
+import time
 import yt_dlp
 import os
 import re
-import time
-import sqlite3
 import ffmpeg
-from Audio_Features import get_audio_features
+import numpy as np
+from Album_Matcher import match_album
+from Audio_Features import SAMPLE_RATE, decode_audio, get_window_starts, load_track, sample_windows
+from Audio_Fingerprint import find_match, get_hashes, print_fingerprint_stats, record_match, store_fingerprint
+from Db_Writer import SONG_COLUMNS, connect, write_songs
+from Schema_Migrations import check_query_plans, migrate
+from Embedding_Cache import print_cache_stats
+from Feature_Workers import create_pool, score_files
+from Http_Client import get_spotify_token, print_stats, set_spotify_credentials, spotify_get
+from Ingest_Pipeline import run_pipeline
+from Model_Registry import load_models, print_load_times
+from Youtube_Resolver import download, print_resolver_stats, resolve
+import Audio_Store
+import Metrics
+import Track_Jobs
+import Work_Leases
 
 
 with open("API_KEYS.json", "r") as file:
     keys = json.load(file)
 
+log = logging.getLogger(__name__)
+
 rawg_key = keys["rawg"]
 spotify_client_id = keys["spotify_id"]
 spotify_client_secret = keys["spotify_secret"]
-spotify_key = keys["spotify"]
+
+# Per-song progress is logged at DEBUG, skips and reused tracks at INFO
+LOG_LEVEL = os.environ.get("OSTVAULT_LOG_LEVEL", "INFO")
+
+# Feature extraction worker processes, and TensorFlow threads inside each one
+WORKER_COUNT = 1
+THREADS_PER_WORKER = 1
+
+# Pipeline threads per stage, songs scored per analyze call, and how many songs
+# may wait between two stages before the earlier one blocks
+STAGE_WORKERS = {'resolve': 4, 'download': 4, 'transcode': 2, 'fingerprint': 2, 'analyze': WORKER_COUNT}
+ANALYZE_BATCH_SIZE = 16
+QUEUE_SIZE = 8
+
+# Albums leased per claim, kept small so other workers get a share of the backlog,
+# and how long to wait before claiming again while other workers hold the rest
+CLAIM_SIZE = 4
+CLAIM_RETRY_SECONDS = 30
+
+# Decode downloads straight to 16 kHz mono samples in memory instead of writing
+# a WAV to WAVFiles/ and loading it back
+STREAM_DECODE = True
+
+# Analysis budget: when ANALYSIS_WINDOWS is set, only that many windows of
+# WINDOW_SECONDS spread across each track are downloaded and scored (0 = the
+# first five minutes). Window_Drift_Report.py shows how far a budget drifts.
+ANALYSIS_WINDOWS = 0
+WINDOW_SECONDS = 20
 
 
 def create_song_table(conn, cursor):
@@ -41,6 +84,7 @@ def create_song_table(conn, cursor):
             album_id INTEGER,
             game_id INTEGER,
             artist_id INTEGER,
+            popularity_score REAL,
             FOREIGN KEY(album_id) REFERENCES album(id),
             FOREIGN KEY(game_id) REFERENCES game(id),
             FOREIGN KEY(artist_id) REFERENCES artist(id)
@@ -54,258 +98,501 @@ def sanitize_text(text):
 
 
 def get_access_token(client_id, client_secret):
-    auth_url = 'https://accounts.spotify.com/api/token'
-    auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+    # The shared client caches the token and refreshes it before it expires
+    set_spotify_credentials(client_id, client_secret)
 
-    headers = {
-        'Authorization': f'Basic {auth_header}'
-    }
-
-    data = {
-        'grant_type': 'client_credentials'
-    }
-
-    response = requests.post(auth_url, headers=headers, data=data)
-    
-    if response.status_code == 200:
-        return response.json()['access_token']
-    else:
-        raise Exception(f"Failed to get token: {response.status_code}, {response.text}")
+    return get_spotify_token()
 
 
-
-def search_album(query, access_token, limit=10):
-    headers = {
-        'Authorization': f'Bearer {access_token}'
-    }
-    
+def search_album(query, limit=10):
     params = {
         'q': query,
         'type': 'album',
         'limit': limit
     }
 
-    response = requests.get('https://api.spotify.com/v1/search', headers=headers, params=params)
+    response = spotify_get('/search', params=params)
 
-    inc = 0
-    album_list = []
-    if response.status_code == 200:
-        for album in response.json()['albums']['items']:
-            print(f"{inc}:{album['name']}")
-            album_list.append(album)
-            inc += 1
-    else:
-        print(f"Search failed: {response.status_code}")
-        print(response.text)
-    
-    user_input = input("Enter number of album or -1 if correct album wasn't found (will be skipped): ")
+    if response.status_code != 200:
+        log.warning(f"Album search for {query} failed: {response.status_code}")
+        log.debug(response.text)
+        Metrics.count("album search failures")
+        return None
+
+    # Only a clear match is taken; there is nobody to ask
+    album_list = response.json()['albums']['items']
+    decision, ranked = match_album(query, None, album_list)
 
-    if user_input == "-1":
+    if decision != "accept":
         return None
 
-    else:
-        album_data = {'name': album_list[int(user_input)]['name'], 'artists': ', '.join([artist['name'] for artist in album_list[int(user_input)]['artists']]), 'id': album_list[int(user_input)]['id']}
-        return album_data
-    
+    album = next(album for album in album_list if album['external_urls']['spotify'] == ranked[0]['link'])
+    album_data = {'name': album['name'], 'artists': ranked[0]['artist'], 'id': album['id']}
+    return album_data
 
-def get_popularity_score(track_url):
-    match = re.search(r'track/([a-zA-Z0-9]+)', track_url)
-    if not match:
-        raise ValueError("Invalid Spotify track URL")
-    track_id = match.group(1)
 
-    # Build request
-    url = f'https://api.spotify.com/v1/tracks/{track_id}'
-    headers = {
-        'Authorization': f'Bearer {spotify_key}'
+def get_track_details(track_list):
+    # Full track objects, which unlike album tracks carry popularity and ISRC
+    track_ids = [track['id'] for track in track_list if track.get('id')]
+    details = {}
+
+    # The several-tracks endpoint takes up to 50 ids per request
+    for start in range(0, len(track_ids), 50):
+        params = {
+            'ids': ','.join(track_ids[start:start + 50])
         }
-    
-    # Make request
-    response = requests.get(url, headers=headers)
-    track_data = response.json()
 
-    popularity = track_data['popularity']
-    return popularity
+        response = spotify_get('/tracks', params=params)
 
+        # Tracks whose details could not be fetched still get jobs, just
+        # without popularity and ISRC
+        if not response.ok:
+            log.warning(f"Track details lookup failed: {response.status_code}")
+            Metrics.count("track details failures")
+            continue
 
-def search_song(developer, game, track_list, conn, cursor, album_id, game_id, artist_id, max_results=1):
+        # Unknown ids come back as null entries
+        for track_data in response.json()['tracks']:
+            if track_data:
+                details[track_data['id']] = track_data
 
-    for track in track_list:
-        dl_result = 1
-        track_name = track['name']
-        track_popularity = get_popularity_score(track['external_urls']['spotify'])  
-        
-        sanitized_name = sanitize_text(track_name)
+    return details
 
-        search_query = f"ytsearch{max_results}:{game} OST {track_name}"
 
-        print({f"Working on song {track_name}"})
+def create_album_jobs(conn, album_id, game_id, spotify_link):
+    # Spotify is only asked for an album's tracks the first time it is seen
+    track_list = get_track_list(spotify_link)
 
-        if os.path.exists(f"WAVFiles/{developer}/{game}/{sanitized_name}.wav"):
-            print(f"Song {track_name} has already been downloaded")
+    db_query = "SELECT song_name FROM song WHERE game_id = ? AND album_id = ?"
+    analyzed_names = {row[0] for row in conn.execute(db_query, (game_id, album_id))}
+    analyzed_positions = {position for position, track in enumerate(track_list)
+                          if sanitize_text(track['name']) in analyzed_names}
 
-        else:
-            with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
-                results = ydl.extract_info(search_query, download=False)
+    # One batched lookup for the whole album; analysed tracks need their ISRC
+    # too, so later copies of them can be found
+    details = get_track_details(track_list)
 
+    Track_Jobs.create_jobs(conn, album_id, track_list, details, analyzed_positions)
 
-            if not results['entries']:
-                print(f"Unable to process song {track_name}")
-                continue
 
-            else:
-                print(results['entries'][0]['original_url'])
-                dl_result = download_song(results['entries'][0]['original_url'], developer, game, sanitized_name, search_query)
+def link_analyzed_copies(conn, songs):
+    # Recordings already analysed under another album reuse that album's
+    # song row and skip the search, download and inference
+    copies = Track_Jobs.find_analyzed_copies(conn, [song['job_id'] for song in songs])
 
-        db_query = f"SELECT id FROM song WHERE song_name = ? AND game_id = ? AND album_id = ?"
-        cursor.execute(db_query, (sanitized_name, game_id, album_id))
-        result = cursor.fetchone()
+    db_query = f"""SELECT id, {', '.join(SONG_COLUMNS[1:12])} FROM song
+                  WHERE game_id = ? AND album_id = ? AND song_name = ?"""
 
-        if dl_result == 0:
-            print(f"Song {track_name} is too large to process, skiping...")
+    for song in songs:
+        if song['job_id'] not in copies:
             continue
 
-        if result:
-            print(f"Song {track_name} already exists in database")
+        album_id, game_id, track_name = copies[song['job_id']]
+        row = conn.execute(db_query, (game_id, album_id, sanitize_text(track_name))).fetchone()
+
+        if row:
+            log.info(f"Song {song['track_name']} was already analysed on album {album_id}, reusing its features")
+            song['features'] = list(row[1:])
+            song['done'] = True
+            song['source_song_id'] = row[0]
+
+
+def claim_albums():
+    # Albums are leased a few at a time as the feeder reaches them, so several
+    # processes can work through the same backlog
+    conn = connect()
+
+    db_query = """ SELECT album.id, album.artist_id, album.game_id, album.spotify_link, game.game_title, developer.developer_name
+                FROM album
+                JOIN game ON album.game_id = game.id
+                JOIN developer ON game.developer_id = developer.id
+                WHERE album.id IN ({})
+                """
+
+    while True:
+        album_ids = Work_Leases.claim(CLAIM_SIZE)
+
+        # Albums other workers hold come back if those workers stop without
+        # finishing them, so the run only ends once none are left
+        if not album_ids:
+            if not Work_Leases.waiting():
+                break
+
+            log.info(f"Waiting {CLAIM_RETRY_SECONDS}s for albums other workers hold")
+            time.sleep(CLAIM_RETRY_SECONDS)
             continue
-        
+
+        for album in conn.execute(db_query.format(', '.join(['?'] * len(album_ids))), album_ids).fetchall():
+            log.info(f"Claimed album {album[0]} ({album[4]})")
+            yield album
+
+    conn.close()
+
+
+def get_songs(conn, album):
+    album_id, artist_id, game_id, spotify_link, game, developer = album
+    jobs = Track_Jobs.get_album_jobs(conn, album_id)
+
+    if not jobs:
+        create_album_jobs(conn, album_id, game_id, spotify_link)
+        jobs = Track_Jobs.get_album_jobs(conn, album_id)
+
+    # Finished tracks are not walked again, and every other one is an attempt
+    jobs = [job for job in jobs if job['state'] not in Track_Jobs.FINISHED_STATES]
+    Track_Jobs.start_attempts(conn, [job['id'] for job in jobs])
+
+    songs = []
+
+    for job in jobs:
+        track_name = job['track_name']
+        sanitized_name = sanitize_text(track_name)
+
+        # Files are named by track id, which two tracks never share
+        store_key = job['spotify_track_id'] or f"job-{job['id']}"
+
+        songs.append({
+            'job_id': job['id'],
+            'store_key': store_key,
+            'track_name': track_name,
+            'sanitized_name': sanitized_name,
+            'duration_ms': job['duration_ms'],
+            'popularity': job['popularity'],
+            'video_url': job['video_url'],
+            'video_duration': job['duration'],
+            'job_files': job['files'],
+            'job_windowed': bool(job['windowed']),
+            'developer': developer,
+            'game': game,
+            'album_id': album_id,
+            'game_id': game_id,
+            'artist_id': artist_id,
+            'search_query': f"ytsearch1:{game} OST {track_name}",
+            'wav_file': f"WAVFiles/{developer}/{game}/{store_key}.wav"
+        })
+
+        # A track scored before the last run stopped only needs writing
+        if job['state'] == Track_Jobs.SCORED:
+            songs[-1]['features'] = job['features']
+            songs[-1]['done'] = True
+
+    if songs:
+        link_analyzed_copies(conn, [song for song in songs if not song.get('done')])
+
+    # Albums with nothing left still pass through so the writer marks them processed
+    if not songs:
+        songs.append({'job_id': None, 'track_name': None, 'album_id': album_id, 'skip': "no tracks left to process"})
+
+    return songs
+
+
+def get_failed_songs(conn, album_id, reason):
+    # An album that could not be set up fails its unfinished tracks, which
+    # --retry-failed picks up. Without any tracks the album itself is failed.
+    jobs = [job for job in Track_Jobs.get_album_jobs(conn, album_id) if job['state'] not in Track_Jobs.FINISHED_STATES]
+
+    if not jobs:
+        return [{'job_id': None, 'track_name': None, 'album_id': album_id, 'skip': reason, 'album_failed': True}]
+
+    return [{'job_id': job['id'], 'track_name': job['track_name'], 'album_id': album_id, 'skip': reason} for job in jobs]
+
+
+def get_album_songs(albums):
+    # Feeds the pipeline from its own thread, so it needs its own connection
+    conn = connect()
+
+    for album in albums:
+        # One album that cannot be set up must not stop the ones after it
+        try:
+            songs = get_songs(conn, album)
+        except Exception as e:
+            log.error(f"Album {album[0]} ({album[4]}) failed: {e}")
+            songs = get_failed_songs(conn, album[0], f"album failed: {e}")
+
+        for song in songs:
+            song['album_songs'] = len(songs)
+            yield song
+
+    conn.close()
+
+
+def resolve_song(song):
+    log.debug(f"Working on song {song['track_name']}")
+
+    # Audio kept in the store for this analysis budget needs no download
+    stored_audio = Audio_Store.load_audio(song['store_key'], ANALYSIS_WINDOWS, WINDOW_SECONDS)
+
+    if stored_audio is not None:
+        log.debug(f"Song {song['track_name']} is already in the audio store")
+        song['audio'] = stored_audio
+        song['stored'] = True
+        return
+
+    # Downloads recorded by an earlier run are reused while their files remain
+    job_files = song['job_files']
+
+    if job_files and all(os.path.exists(f) for f in job_files):
+        log.debug(f"Song {song['track_name']} has already been downloaded")
+        song['webm_files'] = job_files
+        song['windowed'] = song['job_windowed']
+        return
+
+    if song['video_url']:
+        song['url'] = song['video_url']
+        song['duration'] = song['video_duration']
+        return
+
+    video = resolve(song['search_query'])
+
+    if not video:
+        song['skip'] = "no search results"
+        return
+
+    song['url'] = video['url']
+    song['duration'] = video['duration'] or song['duration_ms'] / 1000
+    log.debug(song['url'])
+
+    Track_Jobs.set_state(song['job_id'], Track_Jobs.RESOLVED, video_url=song['url'], duration=song['duration'])
+
+
+def download_stage(song):
+    if song.get('stored') or song.get('webm_files'):
+        return
+
+    sections = None
+
+    if ANALYSIS_WINDOWS:
+        starts = get_window_starts(song['duration'], ANALYSIS_WINDOWS, WINDOW_SECONDS)
+        sections = [(start, start + WINDOW_SECONDS) for start in starts] or None
+
+    song['webm_files'] = download_song(song['url'], song['developer'], song['game'], song['store_key'], sections)
+    song['windowed'] = bool(sections)
+
+    if not song['webm_files']:
+        song['skip'] = "download failed"
+        return
+
+    Track_Jobs.set_state(song['job_id'], Track_Jobs.DOWNLOADED, files=song['webm_files'], windowed=song['windowed'])
+
+
+def transcode_stage(song):
+    if song.get('stored'):
+        return
+
+    if any(is_too_large(webm_file) for webm_file in song['webm_files']):
+        song['skip'] = "too large to process"
+
+    # Windows are short, so they are always decoded in memory
+    elif song.get('windowed'):
+        song['audio'] = [decode_audio(webm_file) for webm_file in song['webm_files']]
+
+    elif ANALYSIS_WINDOWS:
+        song['audio'] = sample_windows(decode_audio(song['webm_files'][0]), ANALYSIS_WINDOWS, WINDOW_SECONDS)
+
+    elif STREAM_DECODE:
+        song['audio'] = decode_audio(song['webm_files'][0])
+
+    # A WAV is loaded once here and kept for scoring
+    else:
+        transcode_song(song['webm_files'][0], song['wav_file'])
+        song['audio'] = load_track(song['wav_file'])[0]
+
+    # The stored samples are the ones analysed; the download is deleted once the song is written
+    if not song.get('skip'):
+        song['audio'] = Audio_Store.store_audio(song['store_key'], song['audio'], ANALYSIS_WINDOWS, WINDOW_SECONDS)
+
+
+def fingerprint_stage(song):
+    # Windows are fingerprinted as one stretch of audio, the same way they are scored
+    audio = load_track(song['audio'])
+    audio = audio[0] if len(audio) == 1 else np.concatenate(audio)
+
+    song['fingerprint'] = get_hashes(audio)
+    song['audio_duration'] = len(audio) / SAMPLE_RATE
+
+    match = find_match(song['fingerprint'], song['audio_duration'])
+
+    # A copy of an analysed recording reuses its features
+    if match:
+        track_id, song['features'], inference_seconds = match
+        record_match(track_id, inference_seconds)
+        song.pop('audio', None)
+        Track_Jobs.set_state(song['job_id'], Track_Jobs.SCORED, features=song['features'])
+        log.info(f"Song {song['track_name']} matches an analysed recording, reusing its features")
+
+
+def analyze_stage(songs, pool=None):
+    songs = [song for song in songs if 'features' not in song]
+
+    if not songs:
+        return
+
+    start = time.perf_counter()
+    scored = []
+
+    # One chunk per call, so each analyze thread keeps one pool worker busy
+    for index, track_features in score_files([song.get('audio', song['wav_file']) for song in songs], pool, 1):
+
+        # Decoded samples are only needed until the song is scored
+        songs[index].pop('audio', None)
+
+        if track_features == -1:
+            songs[index]['skip'] = "unable to process"
         else:
-            track_features = get_audio_features(f"WAVFiles/{developer}/{game}/{sanitized_name}.wav")
-
-            if track_features == -1:
-                print(f"Unable to process song {track_name}")
-                continue
-
-            db_query = f"""
-            INSERT INTO song
-            (
-                song_name,
-                song_genre,
-                approachability_score,
-                engagement_score,
-                danceability_score,
-                aggressiveness_score,
-                happiness_score,
-                party_score,
-                relaxed_score,
-                saddness_score,
-                electronic_score,
-                acoustic_score,
+            songs[index]['features'] = track_features
+            scored.append(songs[index])
+
+    # The batch's inference time is shared evenly, for the dedup savings report
+    inference_seconds = (time.perf_counter() - start) / len(songs)
+
+    for song in scored:
+        store_fingerprint(song['fingerprint'], song['audio_duration'], song['features'], inference_seconds)
+        Track_Jobs.set_state(song['job_id'], Track_Jobs.SCORED, features=song['features'])
+
+
+def search_songs(albums, conn, cursor, pool=None):
+
+    # Inference runs in-process without a pool, and the models are not shared across threads
+    stages = [
+        {'name': "resolve", 'function': resolve_song, 'workers': STAGE_WORKERS['resolve']},
+        {'name': "download", 'function': download_stage, 'workers': STAGE_WORKERS['download']},
+        {'name': "transcode", 'function': transcode_stage, 'workers': STAGE_WORKERS['transcode']},
+        {'name': "fingerprint", 'function': fingerprint_stage, 'workers': STAGE_WORKERS['fingerprint']},
+        {'name': "analyze", 'function': lambda songs: analyze_stage(songs, pool),
+         'workers': STAGE_WORKERS['analyze'] if pool else 1, 'batch_size': ANALYZE_BATCH_SIZE},
+    ]
+
+    album_progress = {}
+
+    # Each album's song rows, track states and intermediate files, written in
+    # one transaction once its last track is in
+    pending = {}
+
+    # This loop is the only writer of songs and final track states
+    for song in run_pipeline(get_album_songs(albums), stages, QUEUE_SIZE):
+        album_id = song['album_id']
+        album = pending.setdefault(album_id, {'song_rows': [], 'job_states': [], 'intermediates': []})
+
+        if song.get('skip'):
+            log.info(f"Skipping song {song['track_name']}: {song['skip']}")
+
+        else:
+            track_features = song['features']
+
+            # Ensure track_features[1] to track_features[10] are floats rounded to 2 decimals
+            cleaned_features = [track_features[0]] + [round(float(f), 2) for f in track_features[1:11]]
+
+            Metrics.count("tracks")
+
+            # Build values tuple
+            album['song_rows'].append((
+                song['sanitized_name'],
+                *cleaned_features,  # Unpack all 11 features (index 0 to 10)
                 album_id,
-                game_id,
-                artist_id,
-                popularity_score
-            )
-
-            VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """
-        # Ensure track_features[1] to track_features[10] are floats rounded to 2 decimals
-        cleaned_features = [track_features[0]] + [round(float(f), 2) for f in track_features[1:11]]
-
-        # Build values tuple
-        values = (
-            sanitized_name,
-            *cleaned_features,  # Unpack all 11 features (index 0 to 10)
-            album_id,
-            game_id,
-            artist_id,
-            track_popularity
-        )
+                song['game_id'],
+                song['artist_id'],
+                song['popularity']
+            ))
+
+        if song['job_id'] is not None:
+            # What the pipeline found on the way is kept for --retry-failed
+            job_state = Track_Jobs.get_job_state(song['job_id'], song.get('skip'), video_url=song.get('url'),
+                                                 duration=song.get('duration'), files=song.get('webm_files'),
+                                                 windowed=song.get('windowed'), source_song_id=song.get('source_song_id'))
+            album['job_states'].append(job_state)
+
+        # Downloads of failed tracks go too; analysed audio is in the store
+        album['intermediates'].extend(song.get('webm_files') or [])
+        if song.get('wav_file'):
+            album['intermediates'].append(song['wav_file'])
+
+        # A song that is skipped still counts towards finishing its album
+        album_progress[album_id] = album_progress.get(album_id, 0) + 1
+
+        if album_progress[album_id] < song['album_songs']:
+            continue
+
+        album = pending.pop(album_id)
 
-        # Execute and commit
-        cursor.execute(db_query, values)
-        conn.commit()
+        # An album that failed as a whole is not marked processed
+        if song.get('album_failed'):
+            write_songs(conn, album['song_rows'], album['job_states'])
+            Work_Leases.fail([album_id])
+        else:
+            write_songs(conn, album['song_rows'], album['job_states'], album_id)
+            Work_Leases.complete([album_id])
 
-    db_query = f"""UPDATE album
-                   SET songs_processed = ?
-                   WHERE id = ?;"""
-    values = (1, album_id)
-    cursor.execute(db_query, values)
-    conn.commit()
+        Audio_Store.delete_intermediates(album['intermediates'])
 
     return
 
 
-def download_song(url, developer, game, song, search_query):
+def download_song(url, developer, game, song, sections=None):
 
     webm_directory = f"WEBMFiles/{developer}/{game}"
-    wav_directory = f"WAVFiles/{developer}/{game}"
+    outtmpl = f'{webm_directory}/{song}.%(ext)s'
 
-    if not os.path.exists(webm_directory):
-        os.makedirs(webm_directory)
+    # Each analysis window is its own file, kept apart from full downloads
+    if sections:
+        outtmpl = f'{webm_directory}/windows/{song}.%(section_start)s.%(ext)s'
 
-    if not os.path.exists(wav_directory):
-        os.makedirs(wav_directory)
+    os.makedirs(webm_directory, exist_ok=True)
 
     try:
-            ydl_opts = {
-                'cookies': 'cookies.txt',
-                'format': 'bestaudio[ext=webm]/bestaudio/best',
-                'outtmpl': f'{webm_directory}/{song}.%(ext)s',
-                'socket_timeout': 120,
-                'download_sections': ['*00:00:00-00:05:00'],
-                'retries': 5,
-                'retry_sleep': 30,
-                'quiet': True,
-                'no_range': True,
-                'postprocessor_args': ['-ac', '1', '-ar', '16000']
-            }
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-                info = ydl.extract_info(search_query, download=True)
-
-        
-            
-            if 'entries' in info and info['entries']:
-                ext = info['entries'][0]['ext']
-            else:
-                ext = info['ext']
+        webm_files, ext = download(url, outtmpl, sections)
 
     except yt_dlp.utils.DownloadError as e:
-        print(f"Attempt failed: {e}")
+        log.info(f"Attempt failed: {e}")
+        return None
 
-    time.sleep(10)
+    return webm_files
 
-    input_file = os.path.join(webm_directory, f"{song}.{ext}")
-    output_file = os.path.join(wav_directory, f"{song}.wav")
+
+def is_too_large(input_file):
 
     size_mb = os.path.getsize(input_file) / (1024 * 1024)
 
     if size_mb >= 31:
-        print(f"File too large, skipping")
-        return 0  # use as-is
-    
+        log.debug(f"File too large, skipping")
+        return True
+
+    return False
+
+
+def transcode_song(input_file, output_file):
+
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
     try:
-        ffmpeg.input(input_file).output(output_file).run(capture_stdout=True, capture_stderr=True)
+        with Metrics.timed("ffmpeg transcode") as measurement:
+            ffmpeg.input(input_file).output(output_file).run(capture_stdout=True, capture_stderr=True)
+            measurement["bytes"] = os.path.getsize(output_file)
     
     except ffmpeg.Error as e:
-        print("stdout:", e.stdout.decode())
-        print("stderr:", e.stderr.decode())
+        log.error("stdout: " + e.stdout.decode())
+        log.error("stderr: " + e.stderr.decode())
         raise e
 
     return 1
 
 
-def get_track_list(album_url, spotify_key):
+def get_track_list(album_url):
 
     match = re.search(r'album/([a-zA-Z0-9]+)', album_url)
     album_id = match.group(1) if match else None
 
-    headers = {
-    "Authorization": f"Bearer {spotify_key}"
-    }
     tracks = []
     limit = 50  # max allowed by Spotify
     offset = 0
 
     while True:
-        url = f"https://api.spotify.com/v1/albums/{album_id}/tracks"
         params = {
             "limit": limit,
             "offset": offset
         }
-        response = requests.get(url, headers=headers, params=params)
+        response = spotify_get(f"/albums/{album_id}/tracks", params=params)
+
+        # Fails just this album, see get_album_songs
+        response.raise_for_status()
         data = response.json()
 
         tracks.extend(data["items"])
@@ -317,27 +604,59 @@ def get_track_list(album_url, spotify_key):
 
     return tracks
 
-conn = sqlite3.connect("games.db")
-cursor = conn.cursor()
 
-db_query = f""" SELECT album.id, album.artist_id, album.game_id, album.spotify_link, game.game_title, developer.developer_name
-            FROM album
-            JOIN game ON album.game_id = game.id
-            JOIN developer ON game. developer_id= developer.id
-            WHERE album.songs_processed = ?
-            """
-values = (0,)
-cursor.execute(db_query, values)
-result = cursor.fetchall()
-print(result)
+if __name__ == "__main__":
+    logging.basicConfig(level=LOG_LEVEL, format="%(message)s")
+
+    conn = connect()
+    cursor = conn.cursor()
+
+    create_song_table(conn, cursor)
+    Track_Jobs.create_job_table(conn)
+    Work_Leases.create_lease_table(conn)
+    migrate(conn)
+
+    # Failed tracks are only tried again when asked
+    if "--retry-failed" in sys.argv:
+        album_ids, count = Track_Jobs.retry_failed(conn)
+        Work_Leases.retry(album_ids)
+        print(f"Retrying {count} failed tracks")
 
-create_song_table(conn, cursor)
+    for problem in check_query_plans(conn):
+        print(f"Query plan regression: {problem}")
 
-spotify_key = get_access_token(spotify_client_id, spotify_client_secret)
+    get_access_token(spotify_client_id, spotify_client_secret)
 
-for album in result:
-    track_list = get_track_list(album[3], spotify_key)
-    search_song(album[5], album[4], track_list, conn, cursor, album[0], album[2], album[1])
+    # Workers warm their own models, the parent only needs them when scoring in-process
+    pool = None
+    if WORKER_COUNT > 1:
+        pool = create_pool(WORKER_COUNT, THREADS_PER_WORKER)
+    else:
+        load_models()
+        print_load_times()
+
+    # Leases still held when the run stops, however it stops, are given back,
+    # and the track states the stages recorded are written
+    Work_Leases.start_renewing()
+    Track_Jobs.start_state_writer()
+
+    try:
+        search_songs(claim_albums(), conn, cursor, pool=pool)
+    finally:
+        Track_Jobs.stop_state_writer()
+        Work_Leases.stop_renewing()
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    print_cache_stats()
+    print_stats()
+    print_resolver_stats()
+    print_fingerprint_stats()
+    Audio_Store.print_store_stats()
+    Metrics.print_summary()
+    Track_Jobs.print_job_stats(conn)
 
 # album_data = search_album(game, spotify_key)
 # track_list = get_tracks(album_data["id"])
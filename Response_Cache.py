@@ -0,0 +1,121 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+
+
+# Local store of RAWG and Spotify GET responses, keyed by the normalized URL
+# and query parameters (API keys left out), so re-runs do not ask again for
+# data that has not changed. Each endpoint has its own time to live; stale
+# entries are revalidated with ETag/Last-Modified where the API sends them.
+# In offline mode every request is served from the cache, however old.
+
+CACHE_FILE = "http_cache.db"
+OFFLINE = os.environ.get("OSTVAULT_OFFLINE") == "1"
+
+DAY = 24 * 60 * 60
+
+# (url pattern, seconds to keep), first match wins. Unlisted URLs are not cached.
+ENDPOINT_TTLS = [
+    (r"/api/developers", 30 * DAY),
+    (r"/api/games", 1 * DAY),
+    (r"/v1/search", 7 * DAY),
+    (r"/v1/albums/[^/]+/tracks", 30 * DAY),
+    (r"/v1/tracks", 1 * DAY),
+]
+
+# Parameters that identify the caller rather than the data
+IGNORED_PARAMS = {"key"}
+
+stats = {"hits": 0, "misses": 0, "revalidated": 0, "stored": 0}
+
+_conn = None
+_lock = threading.Lock()
+
+
+def get_store():
+    global _conn
+
+    if _conn is None:
+        _conn = sqlite3.connect(CACHE_FILE, timeout=30, check_same_thread=False)
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS response
+            (
+                cache_key TEXT PRIMARY KEY,
+                url TEXT,
+                status INTEGER,
+                headers TEXT,
+                body BLOB,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL
+            )
+        """)
+        _conn.commit()
+
+    return _conn
+
+
+def get_ttl(url):
+    for pattern, ttl in ENDPOINT_TTLS:
+        if re.search(pattern, url):
+            return ttl
+
+    return None
+
+
+def get_cache_key(url, params=None):
+    params = sorted((key, str(value)) for key, value in (params or {}).items() if key not in IGNORED_PARAMS)
+
+    return f"{url}?{urlencode(params)}" if params else url
+
+
+def lookup(cache_key):
+    with _lock:
+        row = get_store().execute(
+            "SELECT url, status, headers, body, etag, last_modified, fetched_at FROM response WHERE cache_key = ?",
+            (cache_key,)).fetchone()
+
+    if not row:
+        return None
+
+    url, status, headers, body, etag, last_modified, fetched_at = row
+
+    return {"url": url, "status": status, "headers": json.loads(headers), "body": body,
+            "etag": etag, "last_modified": last_modified, "fetched_at": fetched_at}
+
+
+def is_fresh(entry, ttl):
+
+    return time.time() - entry["fetched_at"] < ttl
+
+
+def store(cache_key, url, status, headers, body):
+    with _lock:
+        conn = get_store()
+        conn.execute("""
+            INSERT OR REPLACE INTO response (cache_key, url, status, headers, body, etag, last_modified, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (cache_key, url, status, json.dumps(dict(headers)), body,
+              headers.get("ETag"), headers.get("Last-Modified"), time.time()))
+        conn.commit()
+
+    stats["stored"] += 1
+
+
+def touch(cache_key):
+    # A 304 means the cached body is still current
+    with _lock:
+        conn = get_store()
+        conn.execute("UPDATE response SET fetched_at = ? WHERE cache_key = ?", (time.time(), cache_key))
+        conn.commit()
+
+    stats["revalidated"] += 1
+
+
+def print_cache_stats():
+    print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses, "
+          f"{stats['revalidated']} revalidated, {stats['stored']} stored" + (" (offline)" if OFFLINE else ""))
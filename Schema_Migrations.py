@@ -0,0 +1,130 @@
+import sqlite3
+import sys
+from Db_Writer import connect
+
+
+# Indexes for the lookups the ingest scripts run on every track and album, the
+# foreign keys, and the common analytics filters. migrate() is safe to run on
+# every start; check_query_plans() fails if a hot query stops using its index.
+
+SCHEMA_VERSION = 1
+
+SCORE_COLUMNS = [
+    "approachability_score",
+    "engagement_score",
+    "danceability_score",
+    "aggressiveness_score",
+    "happiness_score",
+    "party_score",
+    "relaxed_score",
+    "saddness_score",
+    "electronic_score",
+    "acoustic_score",
+    "popularity_score",
+]
+
+# (index name, table, columns)
+INDEXES = [
+    # Per-track duplicate check, and songs by game
+    ("idx_song_game_album_name", "song", "game_id, album_id, song_name"),
+    ("idx_song_album", "song", "album_id"),
+    ("idx_song_artist", "song", "artist_id"),
+    ("idx_song_genre", "song", "song_genre"),
+    # Startup query for unprocessed albums, covering the album columns it reads
+    ("idx_album_processed", "album", "songs_processed, game_id, artist_id, spotify_link"),
+    ("idx_album_game", "album", "game_id"),
+    ("idx_album_artist", "album", "artist_id"),
+    ("idx_game_developer", "game", "developer_id"),
+    # Failed track lookups for --retry-failed and the run summary
+    ("idx_track_job_state", "track_job", "state, album_id"),
+    ("idx_album_review_status", "album_review", "status"),
+    # Recordings already analysed under another album
+    ("idx_track_job_isrc", "track_job", "isrc, state"),
+    ("idx_track_job_title", "track_job", "title_key, state"),
+] + [(f"idx_song_{column}", "song", column) for column in SCORE_COLUMNS]
+
+# (query, parameters, index the plan must use)
+HOT_QUERIES = [
+    ("SELECT id FROM song WHERE song_name = ? AND game_id = ? AND album_id = ?", ("", 0, 0), "idx_song_game_album_name"),
+    ("""SELECT album.id, album.artist_id, album.game_id, album.spotify_link, game.game_title, developer.developer_name
+        FROM album
+        JOIN game ON album.game_id = game.id
+        JOIN developer ON game.developer_id = developer.id
+        WHERE album.songs_processed = ?""", (0,), "idx_album_processed"),
+    ("""SELECT album.id FROM album
+        LEFT JOIN album_lease ON album_lease.album_id = album.id
+        WHERE album.songs_processed = 0
+            AND (album_lease.album_id IS NULL OR (album_lease.state = ? AND album_lease.expires_at < ?))
+        ORDER BY album.game_id, album.artist_id, album.spotify_link, album.id
+        LIMIT ?""", ("leased", 0, 4), "idx_album_processed"),
+    ("SELECT * FROM song WHERE game_id = ?", (0,), "idx_song_game_album_name"),
+    ("SELECT * FROM song WHERE artist_id = ?", (0,), "idx_song_artist"),
+    ("SELECT * FROM song WHERE song_genre = ?", ("",), "idx_song_genre"),
+    ("SELECT * FROM song WHERE happiness_score BETWEEN ? AND ?", (0.5, 1.0), "idx_song_happiness_score"),
+    ("SELECT * FROM song WHERE popularity_score >= ?", (50,), "idx_song_popularity_score"),
+    ("SELECT * FROM album WHERE game_id = ?", (0,), "idx_album_game"),
+    ("SELECT * FROM game WHERE developer_id = ?", (0,), "idx_game_developer"),
+    ("SELECT album_id FROM track_job WHERE state = ?", ("failed",), "idx_track_job_state"),
+    ("SELECT album_id, track_name FROM track_job WHERE isrc = ? AND state = ?", ("", "analyzed"), "idx_track_job_isrc"),
+    ("SELECT album_id, track_name FROM track_job WHERE title_key = ? AND state = ?", ("", "analyzed"), "idx_track_job_title"),
+    ("SELECT id, developer_id, game, candidates FROM album_review WHERE status = ? ORDER BY id", ("pending",), "idx_album_review_status"),
+]
+
+
+def get_tables(conn):
+
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def migrate(conn):
+    tables = get_tables(conn)
+
+    # Older song tables were created without the popularity column
+    if "song" in tables:
+        song_columns = {row[1] for row in conn.execute("PRAGMA table_info(song)")}
+
+        if "popularity_score" not in song_columns:
+            conn.execute("ALTER TABLE song ADD COLUMN popularity_score REAL")
+
+    # Tables that do not exist yet get their indexes on a later run
+    for name, table, columns in INDEXES:
+        if table in tables:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+    conn.execute("ANALYZE")
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+
+
+def check_query_plans(conn):
+    tables = get_tables(conn)
+    problems = []
+
+    for query, params, index in HOT_QUERIES:
+        table = next(table for name, table, columns in INDEXES if name == index)
+
+        if table not in tables:
+            continue
+
+        # A query joining a table that does not exist yet is checked on a later run
+        try:
+            plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+        except sqlite3.OperationalError:
+            continue
+
+        if not any(index in detail for detail in plan):
+            problems.append(f"{' '.join(query.split())[:80]} does not use {index}: {'; '.join(plan)}")
+
+    return problems
+
+
+if __name__ == "__main__":
+    conn = connect(sys.argv[1] if len(sys.argv) > 1 else "games.db")
+    migrate(conn)
+    problems = check_query_plans(conn)
+
+    for problem in problems:
+        print(problem)
+
+    print(f"{len(HOT_QUERIES) - len(problems)}/{len(HOT_QUERIES)} hot queries use their index")
+    sys.exit(1 if problems else 0)
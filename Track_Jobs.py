@@ -0,0 +1,274 @@
+import json
+import queue
+import re
+import threading
+import time
+from Album_Matcher import normalize
+from Db_Writer import connect
+import Metrics
+
+
+# One row per album track recording how far it got, so a restart resumes each
+# track where it stopped instead of walking the whole album again. Tracks move
+# pending -> resolved -> downloaded -> scored -> analyzed, or end as failed
+# (with a reason) or skipped_too_large. A scored job keeps its features, so a
+# track scored before a crash is written without being analysed again.
+#
+# Pipeline stages hand the intermediate states to one state writer thread,
+# which commits whatever has gathered every STATE_FLUSH_SECONDS. The final
+# state is written by the song writer with the album's songs, and a late
+# intermediate state never overwrites it. Attempts are counted when a track's
+# album is claimed. Failed tracks keep their video (and any audio already in
+# the store), so --retry-failed only reruns the step that failed.
+#
+# Each job also keeps the track's ISRC and a normalized title, so a recording
+# already analysed under another album can be found before it is downloaded.
+
+PENDING = "pending"
+RESOLVED = "resolved"
+DOWNLOADED = "downloaded"
+SCORED = "scored"
+ANALYZED = "analyzed"
+FAILED = "failed"
+SKIPPED_TOO_LARGE = "skipped_too_large"
+
+FINISHED_STATES = (ANALYZED, FAILED, SKIPPED_TOO_LARGE)
+
+# Tracks matched by title and artist must also be this close in length
+DURATION_TOLERANCE_MS = 2000
+
+STATE_FLUSH_SECONDS = 0.5
+
+# Title words that mark a different release of the same recording
+RELEASE_WORDS = {"remaster", "remastered", "version", "edition", "bonus", "track"}
+
+JOB_COLUMNS = [
+    "id",
+    "album_id",
+    "position",
+    "spotify_track_id",
+    "track_name",
+    "duration_ms",
+    "popularity",
+    "state",
+    "reason",
+    "attempts",
+    "video_url",
+    "duration",
+    "files",
+    "windowed",
+    "isrc",
+    "title_key",
+    "source_song_id",
+    "features",
+]
+
+_updates = queue.Queue()
+_writer = None
+
+def create_job_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS track_job
+        (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            album_id INTEGER,
+            position INTEGER,
+            spotify_track_id TEXT,
+            track_name TEXT,
+            duration_ms INTEGER,
+            popularity REAL,
+            state TEXT,
+            reason TEXT,
+            attempts INTEGER DEFAULT 0,
+            video_url TEXT,
+            duration REAL,
+            files TEXT,
+            windowed INTEGER,
+            isrc TEXT,
+            title_key TEXT,
+            source_song_id INTEGER,
+            features TEXT,
+            updated_at REAL,
+            UNIQUE(album_id, position),
+            FOREIGN KEY(album_id) REFERENCES album(id)
+        )
+    """)
+    conn.commit()
+
+
+def get_title_key(track_name):
+    # Bracketed notes such as "(2019 Remaster)" are dropped with the release words
+    track_name = re.sub(r"[(\[].*?[)\]]", " ", track_name)
+
+    return " ".join(word for word in normalize(track_name) if word not in RELEASE_WORDS)
+
+
+def create_jobs(conn, album_id, track_list, details, analyzed_positions):
+    # Tracks already in the song table start out analyzed. details holds the
+    # full Spotify track for each track id, where it could be fetched.
+    rows = []
+
+    for position, track in enumerate(track_list):
+        state = ANALYZED if position in analyzed_positions else PENDING
+        track_details = details.get(track.get('id')) or {}
+
+        rows.append((album_id, position, track.get('id'), track['name'], track.get('duration_ms'),
+                     track_details.get('popularity'), track_details.get('external_ids', {}).get('isrc'),
+                     get_title_key(track['name']), state, time.time()))
+
+    with conn:
+        conn.executemany("""
+            INSERT OR IGNORE INTO track_job
+            (album_id, position, spotify_track_id, track_name, duration_ms, popularity, isrc, title_key, state, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+
+def find_analyzed_copies(conn, job_ids):
+    # Returns {job id: (album id, game id, track name)} of an analysed track on
+    # another album that is the same recording, by ISRC or else by title,
+    # album artist and length
+    placeholders = ', '.join(['?'] * len(job_ids))
+    copies = {}
+
+    isrc_query = f"""
+        SELECT job.id, source.album_id, source_album.game_id, source.track_name
+        FROM track_job AS job
+        JOIN track_job AS source ON source.isrc = job.isrc AND source.state = ? AND source.album_id != job.album_id
+        JOIN album AS source_album ON source_album.id = source.album_id
+        WHERE job.id IN ({placeholders}) AND job.isrc IS NOT NULL
+    """
+
+    title_query = f"""
+        SELECT job.id, source.album_id, source_album.game_id, source.track_name
+        FROM track_job AS job
+        JOIN album AS job_album ON job_album.id = job.album_id
+        JOIN track_job AS source ON source.title_key = job.title_key AND source.state = ? AND source.album_id != job.album_id
+        JOIN album AS source_album ON source_album.id = source.album_id AND source_album.artist_id = job_album.artist_id
+        WHERE job.id IN ({placeholders}) AND job.title_key != ''
+            AND ABS(source.duration_ms - job.duration_ms) <= ?
+    """
+
+    for query, params in [(isrc_query, (ANALYZED, *job_ids)), (title_query, (ANALYZED, *job_ids, DURATION_TOLERANCE_MS))]:
+        for job_id, album_id, game_id, track_name in conn.execute(query, params):
+            copies.setdefault(job_id, (album_id, game_id, track_name))
+
+    return copies
+
+
+def get_album_jobs(conn, album_id):
+    query = f"SELECT {', '.join(JOB_COLUMNS)} FROM track_job WHERE album_id = ? ORDER BY position"
+
+    jobs = [dict(zip(JOB_COLUMNS, row)) for row in conn.execute(query, (album_id,))]
+
+    for job in jobs:
+        job['files'] = json.loads(job['files']) if job['files'] else None
+        job['features'] = json.loads(job['features']) if job['features'] else None
+
+    return jobs
+
+
+def start_attempts(conn, job_ids):
+    with conn:
+        conn.executemany("UPDATE track_job SET attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                         [(time.time(), job_id) for job_id in job_ids])
+
+
+def set_state(job_id, state, **columns):
+    # Called from pipeline stages; columns are extra track_job columns to
+    # store with the state. The state writer commits it shortly after.
+    # Scores come back as numpy floats
+    for column in ('files', 'features'):
+        if column in columns:
+            columns[column] = json.dumps(columns[column], default=float)
+
+    _updates.put((job_id, state, time.time(), columns))
+
+
+def write_states(conn, updates):
+    # A job the song writer has already finished keeps its final state
+    with Metrics.timed("sqlite job states"), conn:
+        for job_id, state, updated_at, columns in updates:
+            assignments = ', '.join(f"{column} = ?" for column in ['state', 'updated_at', *columns])
+
+            conn.execute(f"UPDATE track_job SET {assignments} WHERE id = ? AND state NOT IN (?, ?, ?)",
+                         (state, updated_at, *columns.values(), job_id, *FINISHED_STATES))
+
+
+def keep_writing_states():
+    conn = connect()
+    stopping = False
+
+    while not stopping:
+        updates = [_updates.get()]
+        time.sleep(STATE_FLUSH_SECONDS)
+
+        while True:
+            try:
+                updates.append(_updates.get_nowait())
+            except queue.Empty:
+                break
+
+        stopping = None in updates
+        write_states(conn, [update for update in updates if update is not None])
+
+    conn.close()
+
+
+def start_state_writer():
+    global _writer
+
+    _writer = threading.Thread(target=keep_writing_states, daemon=True)
+    _writer.start()
+
+
+def stop_state_writer():
+    # States still queued are written before this returns
+    _updates.put(None)
+    _writer.join()
+
+
+def get_finished_state(skip_reason):
+    # The final (state, reason) of a track, from the reason the pipeline skipped it
+    if skip_reason is None:
+        return ANALYZED, None
+
+    if skip_reason == "too large to process":
+        return SKIPPED_TOO_LARGE, skip_reason
+
+    return FAILED, skip_reason
+
+
+def get_job_state(job_id, skip_reason, video_url=None, duration=None, files=None, windowed=None, source_song_id=None):
+    # A row for Db_Writer.write_songs: the final state and reason, then the
+    # columns learned on the way (None keeps what the job already has)
+    state, reason = get_finished_state(skip_reason)
+
+    return (state, reason, time.time(), video_url, duration, json.dumps(files) if files else None,
+            windowed, source_song_id, job_id)
+
+
+def retry_failed(conn):
+    # Failed tracks go back to pending and their albums are picked up again.
+    # Stored video urls and audio are kept, so only the failed step reruns.
+    # Returns the albums reopened and the number of tracks.
+    with conn:
+        album_ids = [row[0] for row in conn.execute("SELECT DISTINCT album_id FROM track_job WHERE state = ?", (FAILED,))]
+        conn.executemany("UPDATE album SET songs_processed = 0 WHERE id = ?", [(album_id,) for album_id in album_ids])
+
+        count = conn.execute("UPDATE track_job SET state = ?, reason = NULL, updated_at = ? WHERE state = ?",
+                             (PENDING, time.time(), FAILED)).rowcount
+
+    return album_ids, count
+
+
+def print_job_stats(conn):
+    counts = dict(conn.execute("SELECT state, COUNT(*) FROM track_job GROUP BY state"))
+    states = [PENDING, RESOLVED, DOWNLOADED, SCORED, ANALYZED, FAILED, SKIPPED_TOO_LARGE]
+
+    print("Track jobs: " + ", ".join(f"{counts.get(state, 0)} {state}" for state in states))
+
+    for reason, count in conn.execute("""
+        SELECT reason, COUNT(*) FROM track_job WHERE state = ? GROUP BY reason ORDER BY COUNT(*) DESC
+    """, (FAILED,)):
+        print(f"  {count} failed: {reason}")
@@ -0,0 +1,89 @@
+import numpy as np
+import Audio_Store
+from Audio_Features import FEATURE_HEADS, SAMPLE_RATE, get_batch_audio_features, sample_windows
+from Model_Registry import load_models
+
+
+# Compares scores from windowed analysis budgets against the full downloaded
+# excerpt, using full excerpts already in the audio store, to help choose
+# ANALYSIS_WINDOWS and WINDOW_SECONDS in Populate_Songs.py.
+
+# (number of windows, seconds per window)
+BUDGETS = [(1, 30), (2, 20), (3, 20), (4, 30), (6, 20)]
+MAX_TRACKS = 100
+CHUNK_SIZE = 16
+
+
+def get_drift(blobs, budgets):
+    head_names = [name for name, index in FEATURE_HEADS]
+    drift = {budget: {'errors': [], 'genre_matches': 0, 'seconds': 0.0} for budget in budgets}
+    full_seconds = 0.0
+    tracks = 0
+
+    # Decoded audio is only held for one chunk of tracks at a time
+    for start in range(0, len(blobs), CHUNK_SIZE):
+        audio_list = []
+
+        for blob in blobs[start:start + CHUNK_SIZE]:
+            try:
+                audio_list.append(Audio_Store.read_blob(blob))
+            except Exception as e:
+                print(f"Unable to read {Audio_Store.get_blob_path(blob)}: {e}")
+
+        full_features = get_batch_audio_features(audio_list)
+
+        for budget in budgets:
+            windowed = [sample_windows(audio, *budget) for audio in audio_list]
+            budget_features = get_batch_audio_features(windowed)
+
+            for windows, full, sampled in zip(windowed, full_features, budget_features):
+                if full == -1 or sampled == -1:
+                    continue
+
+                drift[budget]['errors'].append([abs(float(a) - float(b)) for a, b in zip(full[1:], sampled[1:])])
+                drift[budget]['genre_matches'] += full[0] == sampled[0]
+                drift[budget]['seconds'] += sum(len(window) for window in windows) / SAMPLE_RATE
+
+        for audio, full in zip(audio_list, full_features):
+            if full != -1:
+                full_seconds += len(audio) / SAMPLE_RATE
+                tracks += 1
+
+    return head_names, drift, full_seconds, tracks
+
+
+def print_report(head_names, drift, full_seconds, tracks):
+    print(f"Compared {tracks} tracks ({full_seconds / 60:.1f} minutes of full excerpts)")
+    print()
+
+    header = f"{'Budget':<10}{'Audio':>8}{'Genre':>8}{'Mean':>8}{'Max':>8}  Worst head"
+    print(header)
+    print("-" * len(header))
+
+    for (window_count, window_seconds), result in drift.items():
+        if not result['errors']:
+            print(f"{window_count}x{window_seconds}s    no comparable tracks")
+            continue
+
+        errors = np.array(result['errors'])
+        head_errors = errors.mean(axis=0)
+        worst = int(np.argmax(head_errors))
+        audio_share = result['seconds'] / full_seconds * 100 if full_seconds else 0
+        genre_share = result['genre_matches'] / len(errors) * 100
+
+        print(f"{f'{window_count}x{window_seconds}s':<10}{audio_share:>7.0f}%{genre_share:>7.0f}%"
+              f"{errors.mean():>8.3f}{errors.max():>8.3f}  {head_names[worst]} ({head_errors[worst]:.3f})")
+
+    print()
+    print("Audio: share of full-excerpt audio analysed. Genre: tracks with the same top genre.")
+    print("Mean/Max: absolute score difference across the ten binary heads.")
+
+
+if __name__ == "__main__":
+    # Windowed entries only hold parts of their track
+    blobs = Audio_Store.get_manifest().execute(
+        "SELECT blob FROM audio WHERE analysis_windows = 0 ORDER BY blob LIMIT ?", (MAX_TRACKS,)).fetchall()
+
+    load_models()
+
+    print_report(*get_drift([blob for (blob,) in blobs], BUDGETS))
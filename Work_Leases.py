@@ -0,0 +1,250 @@
+import logging
+import os
+import socket
+import threading
+import time
+from Db_Writer import connect
+from Http_Client import request
+import Metrics
+
+log = logging.getLogger(__name__)
+
+# Albums are handed out as leases so several Populate_Songs.py processes can
+# split the backlog without doing the same album twice. A worker claims a few
+# unprocessed albums at a time and renews its leases while it works on them.
+# A written album is marked complete, and one whose tracks could not be listed
+# failed; both keep their row so the album is never handed out again until
+# --retry-failed. Leases still held when a run stops are released. A lease that
+# is not renewed expires and its album can be claimed by another worker, which
+# resumes it from its track jobs.
+#
+# Workers on one machine claim straight from games.db. With OSTVAULT_COORDINATOR
+# set to a Lease_Coordinator.py address, claims go through that server instead.
+# Its games.db never sees the workers' song writes, so completing an album also
+# marks it processed there.
+
+LEASE_SECONDS = 600
+RENEW_INTERVAL = LEASE_SECONDS / 3
+
+LEASED = "leased"
+COMPLETE = "complete"
+FAILED = "failed"
+
+ACTIONS = ("claim", "renew", "release", "complete", "fail", "waiting", "retry")
+
+COORDINATOR_URL = os.environ.get("OSTVAULT_COORDINATOR")
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+# Albums this process holds a lease on
+held = set()
+
+_conn = None
+_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def create_lease_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS album_lease
+        (
+            album_id INTEGER PRIMARY KEY,
+            owner TEXT,
+            expires_at REAL,
+            state TEXT DEFAULT 'leased',
+            FOREIGN KEY(album_id) REFERENCES album(id)
+        )
+    """)
+    conn.commit()
+
+
+def claim_albums(conn, owner, count, lease_seconds=LEASE_SECONDS):
+    # One statement, so two workers can never claim the same album. Albums are
+    # taken in idx_album_processed order, which reads only unprocessed albums
+    # and needs no sort.
+    now = time.time()
+
+    with conn:
+        rows = conn.execute("""
+            INSERT INTO album_lease (album_id, owner, expires_at, state)
+            SELECT album.id, ?, ?, ?
+            FROM album
+            LEFT JOIN album_lease ON album_lease.album_id = album.id
+            WHERE album.songs_processed = 0
+                AND (album_lease.album_id IS NULL OR (album_lease.state = ? AND album_lease.expires_at < ?))
+            ORDER BY album.game_id, album.artist_id, album.spotify_link, album.id
+            LIMIT ?
+            ON CONFLICT(album_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at, state = excluded.state
+            RETURNING album_id
+        """, (owner, now + lease_seconds, LEASED, LEASED, now, count)).fetchall()
+
+    return sorted(row[0] for row in rows)
+
+
+def renew_leases(conn, owner, album_ids, lease_seconds=LEASE_SECONDS):
+    # Returns the albums still held; a lease that already expired may be gone
+    with conn:
+        rows = conn.execute(f"""
+            UPDATE album_lease SET expires_at = ?
+            WHERE owner = ? AND state = ? AND album_id IN ({', '.join(['?'] * len(album_ids))})
+            RETURNING album_id
+        """, (time.time() + lease_seconds, owner, LEASED, *album_ids)).fetchall()
+
+    return sorted(row[0] for row in rows)
+
+
+def release_leases(conn, owner, album_ids):
+    with conn:
+        conn.execute(f"""
+            DELETE FROM album_lease
+            WHERE owner = ? AND state = ? AND album_id IN ({', '.join(['?'] * len(album_ids))})
+        """, (owner, LEASED, *album_ids))
+
+
+def finish_leases(conn, owner, album_ids, state):
+    # Recorded even if the lease expired meanwhile, since the work is done
+    with conn:
+        conn.executemany("""
+            INSERT INTO album_lease (album_id, owner, expires_at, state) VALUES (?, ?, NULL, ?)
+            ON CONFLICT(album_id) DO UPDATE SET owner = excluded.owner, expires_at = NULL, state = excluded.state
+        """, [(album_id, owner, state) for album_id in album_ids])
+
+        if state == COMPLETE:
+            conn.executemany("UPDATE album SET songs_processed = 1 WHERE id = ?", [(album_id,) for album_id in album_ids])
+
+
+def get_waiting(conn, owner):
+    # Unprocessed albums leased by other workers, which come back if those
+    # workers stop without finishing them
+    rows = conn.execute("""
+        SELECT album_lease.album_id FROM album_lease
+        JOIN album ON album.id = album_lease.album_id
+        WHERE album_lease.state = ? AND album_lease.owner != ? AND album.songs_processed = 0
+    """, (LEASED, owner)).fetchall()
+
+    return sorted(row[0] for row in rows)
+
+
+def reset_leases(conn, album_ids):
+    # For --retry-failed: albums whose tracks failed, and albums that failed
+    # as a whole, can be claimed again
+    placeholders = ', '.join(['?'] * len(album_ids))
+
+    with conn:
+        conn.execute(f"DELETE FROM album_lease WHERE state = ? OR album_id IN ({placeholders})", (FAILED, *album_ids))
+        conn.execute(f"UPDATE album SET songs_processed = 0 WHERE id IN ({placeholders})", album_ids)
+
+
+def run_action(conn, action, payload):
+    # Shared by local workers and Lease_Coordinator.py; returns album ids
+    owner = payload["owner"]
+    album_ids = payload.get("album_ids", [])
+
+    if action == "claim":
+        return claim_albums(conn, owner, payload["count"])
+    if action == "renew":
+        return renew_leases(conn, owner, album_ids)
+    if action == "waiting":
+        return get_waiting(conn, owner)
+
+    if action == "release":
+        release_leases(conn, owner, album_ids)
+    elif action == "complete":
+        finish_leases(conn, owner, album_ids, COMPLETE)
+    elif action == "fail":
+        finish_leases(conn, owner, album_ids, FAILED)
+    elif action == "retry":
+        reset_leases(conn, album_ids)
+
+    return []
+
+
+def get_store():
+    global _conn
+
+    if _conn is None:
+        _conn = connect(check_same_thread=False)
+        create_lease_table(_conn)
+
+    return _conn
+
+
+def call(action, **payload):
+    # Runs a lease action on the coordinator, or on the local database
+    payload["owner"] = OWNER
+
+    with Metrics.timed(f"lease {action}"):
+        if COORDINATOR_URL:
+            response = request("POST", f"{COORDINATOR_URL}/{action}", json=payload)
+            response.raise_for_status()
+
+            return response.json().get("album_ids", [])
+
+        with _lock:
+            return run_action(get_store(), action, payload)
+
+
+def claim(count):
+    album_ids = call("claim", count=count)
+    held.update(album_ids)
+
+    return album_ids
+
+
+def renew():
+    album_ids = sorted(held)
+
+    if not album_ids:
+        return
+
+    renewed = call("renew", album_ids=album_ids)
+
+    for album_id in set(album_ids) - set(renewed):
+        log.warning(f"Lost the lease on album {album_id}")
+        Metrics.count("leases lost")
+
+
+def release(album_ids):
+    album_ids = [album_id for album_id in album_ids if album_id in held]
+
+    if album_ids:
+        call("release", album_ids=album_ids)
+        held.difference_update(album_ids)
+
+
+def complete(album_ids):
+    call("complete", album_ids=album_ids)
+    held.difference_update(album_ids)
+
+
+def fail(album_ids):
+    call("fail", album_ids=album_ids)
+    held.difference_update(album_ids)
+
+
+def waiting():
+
+    return call("waiting")
+
+
+def retry(album_ids):
+    call("retry", album_ids=album_ids)
+
+
+def keep_renewing():
+    while not _stop.wait(RENEW_INTERVAL):
+        try:
+            renew()
+        except Exception as e:
+            log.warning(f"Lease renewal failed: {e}")
+            Metrics.count("lease renewal failures")
+
+
+def start_renewing():
+    _stop.clear()
+    threading.Thread(target=keep_renewing, daemon=True).start()
+
+
+def stop_renewing():
+    # Whatever is still held goes back to the pool for other workers
+    _stop.set()
+    release(list(held))
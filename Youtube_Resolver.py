@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import threading
+import time
+import yt_dlp
+from yt_dlp.utils import download_range_func
+import Http_Client
+import Metrics
+
+
+# Finds and downloads the YouTube audio for a track with one search and one
+# download. Each pipeline thread keeps a single long-lived YoutubeDL, and
+# query -> video id resolutions are kept on disk so re-runs skip the search.
+#
+# With OSTVAULT_YOUTUBE_URL set, searches go to Fake_Services.py instead and
+# its videos are plain audio files that yt-dlp downloads directly.
+
+CACHE_FILE = "youtube_cache.db"
+YOUTUBE_URL = os.environ.get("OSTVAULT_YOUTUBE_URL")
+VIDEO_URL = f"{YOUTUBE_URL}/audio/{{}}.wav" if YOUTUBE_URL else "https://www.youtube.com/watch?v={}"
+
+# Only the first five minutes are fetched unless analysis windows are given
+DEFAULT_SECTIONS = [(0, 300)]
+
+DOWNLOAD_OPTIONS = {
+    'format': 'bestaudio[ext=webm]/bestaudio/best',
+    'socket_timeout': 120,
+    'retries': 5,
+    'quiet': True,
+    'no_warnings': True,
+    'force_keyframes_at_cuts': True,
+}
+
+if os.path.exists('cookies.txt'):
+    DOWNLOAD_OPTIONS['cookiefile'] = 'cookies.txt'
+
+stats = {"searches": 0, "cached": 0, "downloads": 0}
+
+_local = threading.local()
+_conn = None
+_lock = threading.Lock()
+
+
+def get_downloader():
+    if not hasattr(_local, "ydl"):
+        _local.ydl = yt_dlp.YoutubeDL(dict(DOWNLOAD_OPTIONS))
+
+    return _local.ydl
+
+
+def get_store():
+    global _conn
+
+    if _conn is None:
+        _conn = sqlite3.connect(CACHE_FILE, timeout=30, check_same_thread=False)
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS resolution
+            (
+                search_query TEXT PRIMARY KEY,
+                video_id TEXT,
+                duration REAL,
+                resolved_at REAL
+            )
+        """)
+        _conn.commit()
+
+    return _conn
+
+
+def search(search_query):
+    # Returns the first search hit, or None
+    if YOUTUBE_URL:
+        response = Http_Client.request("GET", f"{YOUTUBE_URL}/search", params={"q": search_query})
+        response.raise_for_status()
+        return next(iter(response.json()['entries']), None)
+
+    # process=False returns the search hits without resolving each video page;
+    # the page is only fetched once, when the chosen video is downloaded
+    results = get_downloader().extract_info(search_query, download=False, process=False)
+
+    return next(iter(results.get('entries') or []), None)
+
+
+def resolve(search_query):
+    # Returns {'id', 'url', 'duration'} for the first search result, or None
+    with _lock:
+        row = get_store().execute("SELECT video_id, duration FROM resolution WHERE search_query = ?", (search_query,)).fetchone()
+
+    if row:
+        stats["cached"] += 1
+        return {'id': row[0], 'url': VIDEO_URL.format(row[0]), 'duration': row[1]}
+
+    with Metrics.timed("youtube search"):
+        entry = search(search_query)
+
+    stats["searches"] += 1
+
+    if not entry:
+        return None
+
+    video = {'id': entry['id'], 'url': VIDEO_URL.format(entry['id']), 'duration': entry.get('duration')}
+
+    with _lock:
+        conn = get_store()
+        conn.execute("INSERT OR REPLACE INTO resolution (search_query, video_id, duration, resolved_at) VALUES (?, ?, ?, ?)",
+                     (search_query, video['id'], video['duration'], time.time()))
+        conn.commit()
+
+    return video
+
+
+def download(video_url, outtmpl, sections=None):
+    # Returns the path of every file written (one per section) and the
+    # extension, taken from the info of this single download
+    ydl = get_downloader()
+    ydl.params['outtmpl'] = {'default': outtmpl}
+    ydl.params['download_ranges'] = download_range_func(None, sections or DEFAULT_SECTIONS)
+
+    # extract_info only returns once every file has been fully written
+    with Metrics.timed("youtube download") as measurement:
+        info = ydl.extract_info(video_url, download=True)
+        files = [download['filepath'] for download in info['requested_downloads']]
+        measurement["bytes"] = sum(os.path.getsize(file) for file in files if os.path.exists(file))
+
+    stats["downloads"] += 1
+
+    return files, info['ext']
+
+
+def print_resolver_stats():
+    print(f"YouTube: {stats['searches']} searches, {stats['cached']} cached resolutions, {stats['downloads']} downloads")